@@ -0,0 +1,284 @@
+"""
+Voice-activity gate in front of speech recognition.
+
+The microphone records whenever the room gets louder than energy_threshold,
+which a TV or a conversation does all the time. AudioGate looks at each
+recorded chunk with a few vectorized NumPy passes before it is recognized:
+
+  1. Voice activity: a frame counts as speech if its energy is well above the
+     noise floor (tracked across chunks) and its zero-crossing rate is in
+     the range of speech, not of hum or hiss.
+  2. Chunks with too little speech are dropped; the rest are trimmed to the
+     speech plus a little padding.
+  3. Optionally, a KeywordSpotter compares the chunk with recordings of
+     command words and drops chunks that contain none of them.
+
+GateStats counts what was dropped and why ('silence' for chunks too quiet,
+'noise' for chunks loud enough but with the zero-crossing rate of hum or
+hiss, 'no keyword'), so the thresholds can be tuned.
+"""
+import glob
+import os
+import wave
+from functools import lru_cache
+
+import numpy as np
+
+from recognizers import AudioChunk
+
+# Voice activity settings
+GATE_FRAME = 0.02          # Seconds per analysis frame
+GATE_MARGIN_DB = 10.0      # How far above the noise floor a speech frame must be
+GATE_MIN_DB = -50.0        # Frames quieter than this are never speech, however quiet the room
+GATE_MIN_ZCR = 0.01        # Zero crossings per sample below this are hum, not speech
+GATE_MAX_ZCR = 0.35        # ...and above this, hiss or static
+GATE_MIN_SPEECH = 0.2      # Seconds of speech frames a chunk needs to be recognized
+GATE_PAD = 0.2             # Seconds kept before the first and after the last speech frame
+GATE_NOISE_PERCENTILE = 10  # Percentile of a chunk's frame energies taken as its noise level
+GATE_NOISE_RISE = 0.1      # How fast the noise floor follows louder chunks (it drops immediately)
+
+# Keyword spotting settings
+KWS_SAMPLE_RATE = 16000    # Features are computed on 16 kHz audio
+KWS_FRAME = 400            # 25 ms frames...
+KWS_HOP = 160              # ...every 10 ms
+KWS_FFT = 512
+KWS_MELS = 26
+KWS_CEPSTRA = 13
+KWS_THRESHOLD = 12.0       # Largest average MFCC distance still counted as a keyword
+
+
+class GateStats:
+    """What the gate let through and what it dropped, by count and seconds of audio"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.passed = 0
+        self.seconds_in = 0.0
+        self.seconds_out = 0.0
+        self.dropped = {}          # reason -> [chunks, seconds]
+        self.last_decision = None  # Description of the last chunk, for tuning
+
+    def record(self, duration, kept, reason, detail):
+        self.chunks += 1
+        self.seconds_in += duration
+        if reason is None:
+            self.passed += 1
+            self.seconds_out += kept
+        else:
+            entry = self.dropped.setdefault(reason, [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+        self.last_decision = f"{'passed' if reason is None else 'dropped: ' + reason} ({detail})"
+
+    @property
+    def seconds_trimmed(self):
+        return self.seconds_in - self.seconds_out - sum(seconds for _, seconds in self.dropped.values())
+
+    def to_dict(self):
+        return {
+            'chunks': self.chunks,
+            'passed': self.passed,
+            'seconds_in': round(self.seconds_in, 2),
+            'seconds_recognized': round(self.seconds_out, 2),
+            'seconds_trimmed': round(self.seconds_trimmed, 2),
+            'dropped': {reason: {'chunks': count, 'seconds': round(seconds, 2)}
+                        for reason, (count, seconds) in self.dropped.items()},
+        }
+
+    def summary(self):
+        if not self.chunks:
+            return "Gate: no audio yet"
+        share = self.seconds_out / self.seconds_in * 100 if self.seconds_in else 0.0
+        dropped = ', '.join(f"{count} {reason} ({seconds:.1f} s)"
+                            for reason, (count, seconds) in self.dropped.items()) or 'none'
+        return (f"Gate: {self.chunks} chunks, {self.seconds_in:.1f} s in; recognized {self.passed} chunks, "
+                f"{self.seconds_out:.1f} s ({share:.0f}%); dropped {dropped}; "
+                f"trimmed {self.seconds_trimmed:.1f} s of silence. Last chunk {self.last_decision}")
+
+
+def frame_features(samples, frame_length):
+    """
+    Energy and zero-crossing rate of consecutive frames.
+
+    Returns:
+        tuple: (energy in dBFS per frame, zero crossings per sample per frame)
+    """
+    count = len(samples) // frame_length
+    frames = samples[:count * frame_length].reshape(count, frame_length)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+    return energy_db, zcr
+
+
+class AudioGate:
+    """
+    Drops chunks without speech (or without a keyword) and trims silence from the rest.
+
+    Args:
+        spotter: Optional KeywordSpotter; chunks must then contain one of its keywords
+        margin_db: Speech must be this far above the noise floor (default: GATE_MARGIN_DB)
+        min_speech: Seconds of speech a chunk needs (default: GATE_MIN_SPEECH)
+    """
+
+    def __init__(self, spotter=None, margin_db=GATE_MARGIN_DB, min_speech=GATE_MIN_SPEECH):
+        self.spotter = spotter
+        self.margin_db = margin_db
+        self.min_speech = min_speech
+        self.noise_floor_db = None
+        self.stats = GateStats()
+
+    def process(self, chunk):
+        """
+        Gate one chunk.
+
+        Returns:
+            tuple: (trimmed AudioChunk, None) if it should be recognized, or (None, reason) if dropped
+        """
+        samples = chunk.samples()
+        frame_length = max(1, int(chunk.sample_rate * GATE_FRAME))
+        energy_db, zcr = frame_features(samples, frame_length)
+        if not len(energy_db):
+            self.stats.record(chunk.duration, 0.0, 'silence', 'empty')
+            return None, 'silence'
+
+        # The floor drops to a quieter chunk at once but only creeps up, so a long loud stretch raises it slowly
+        noise_db = float(np.percentile(energy_db, GATE_NOISE_PERCENTILE))
+        if self.noise_floor_db is None or noise_db < self.noise_floor_db:
+            self.noise_floor_db = noise_db
+        else:
+            self.noise_floor_db += GATE_NOISE_RISE * (noise_db - self.noise_floor_db)
+        threshold_db = max(GATE_MIN_DB, self.noise_floor_db + self.margin_db)
+
+        loud = energy_db >= threshold_db
+        speech = loud & (zcr >= GATE_MIN_ZCR) & (zcr <= GATE_MAX_ZCR)
+        loud_seconds = np.count_nonzero(loud) * GATE_FRAME
+        speech_seconds = np.count_nonzero(speech) * GATE_FRAME
+        detail = (f"{speech_seconds:.2f} s speech, {loud_seconds:.2f} s loud of {chunk.duration:.2f} s, "
+                  f"peak {energy_db.max():.0f} dB, threshold {threshold_db:.0f} dB")
+        if speech_seconds < self.min_speech:
+            # Loud enough but outside the speech ZCR band: hum or hiss rather than a quiet room
+            reason = 'noise' if loud_seconds >= self.min_speech else 'silence'
+            self.stats.record(chunk.duration, 0.0, reason, detail)
+            return None, reason
+
+        # Keep from the first to the last speech frame, plus padding
+        frames = np.flatnonzero(speech)
+        pad = int(GATE_PAD / GATE_FRAME)
+        start = max(0, frames[0] - pad) * frame_length
+        end = min(len(energy_db), frames[-1] + 1 + pad) * frame_length
+        width = chunk.sample_width
+        trimmed = AudioChunk(chunk.pcm[start * width:end * width], chunk.sample_rate, width)
+
+        if self.spotter:
+            keyword, distance = self.spotter.best_match(trimmed)
+            detail += f", closest keyword {keyword} at {distance:.1f}"
+            if distance > self.spotter.threshold:
+                self.stats.record(chunk.duration, 0.0, 'no keyword', detail)
+                return None, 'no keyword'
+
+        self.stats.record(chunk.duration, trimmed.duration, None, detail)
+        return trimmed, None
+
+
+@lru_cache(maxsize=None)
+def _mel_filters():
+    """Triangular mel filterbank, KWS_MELS x (KWS_FFT // 2 + 1)"""
+    def to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    edges = to_hz(np.linspace(to_mel(0), to_mel(KWS_SAMPLE_RATE / 2), KWS_MELS + 2))
+    bins = np.fft.rfftfreq(KWS_FFT, 1 / KWS_SAMPLE_RATE)
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling))
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix():
+    """DCT-II basis, KWS_CEPSTRA x KWS_MELS"""
+    n = np.arange(KWS_MELS)
+    return np.cos(np.pi / KWS_MELS * (n[None, :] + 0.5) * np.arange(KWS_CEPSTRA)[:, None])
+
+
+def mfcc(samples):
+    """MFCCs of 16 kHz float32 samples, one row per 10 ms, without c0 so loudness does not matter"""
+    if len(samples) < KWS_FRAME:
+        samples = np.pad(samples, (0, KWS_FRAME - len(samples)))
+    count = 1 + (len(samples) - KWS_FRAME) // KWS_HOP
+    index = np.arange(KWS_FRAME)[None, :] + KWS_HOP * np.arange(count)[:, None]
+    frames = samples[index] * np.hamming(KWS_FRAME)
+    power = np.abs(np.fft.rfft(frames, KWS_FFT)) ** 2 / KWS_FFT
+    # The floor (about -80 dB) keeps near-silent frames from dominating the distances
+    cepstra = np.log(power @ _mel_filters().T + 1e-8) @ _dct_matrix().T
+    return cepstra[:, 1:]
+
+
+def subsequence_distance(template, features):
+    """
+    Smallest average distance between a template and any stretch of features.
+
+    Dynamic time warping where the template may start and end anywhere in the
+    chunk and be spoken at half to double its recorded speed. Each step only
+    looks back one or two template frames, so every template frame is one
+    vectorized pass over the chunk.
+    """
+    length = len(template)
+    cost = np.sqrt(((template[:, None, :] - features[None, :, :]) ** 2).sum(axis=2))
+    previous2 = np.full(len(features) + 2, np.inf)
+    previous = np.full(len(features) + 2, np.inf)
+    previous[2:] = cost[0]  # Free start anywhere in the chunk
+    for i in range(1, length):
+        current = np.full(len(features) + 2, np.inf)
+        # Steps (1, 1), (1, 2) and (2, 1) in (template, chunk) frames
+        current[2:] = cost[i] + np.minimum(np.minimum(previous[1:-1], previous[:-2]), previous2[1:-1])
+        previous2, previous = previous, current
+    return float(previous[2:].min() / length)
+
+
+class KeywordSpotter:
+    """
+    Cheap keyword spotting against a few recordings of each command word.
+
+    Every template is matched against the chunk with subsequence_distance on
+    MFCCs, which takes a few milliseconds for a 2 s chunk, against hundreds
+    of milliseconds for full recognition.
+
+    Args:
+        templates: {keyword: [16 kHz float32 samples, ...]}
+        threshold: Largest distance counted as a match (default: KWS_THRESHOLD)
+    """
+
+    def __init__(self, templates, threshold=KWS_THRESHOLD):
+        self.threshold = threshold
+        self.templates = [(keyword, mfcc(samples)) for keyword, recordings in templates.items()
+                          for samples in recordings]
+
+    @classmethod
+    def from_directory(cls, directory, threshold=KWS_THRESHOLD):
+        """Load <keyword>.wav or <keyword>_<n>.wav recordings (16-bit PCM)"""
+        templates = {}
+        for path in sorted(glob.glob(os.path.join(directory, '*.wav'))):
+            keyword = os.path.splitext(os.path.basename(path))[0].rsplit('_', 1)[0]
+            with wave.open(path, 'rb') as file:
+                pcm = file.readframes(file.getnframes())
+                channels, width, rate = file.getnchannels(), file.getsampwidth(), file.getframerate()
+            if channels > 1:
+                pcm = np.frombuffer(pcm, dtype='<i2').reshape(-1, channels)[:, 0].tobytes()
+            templates.setdefault(keyword, []).append(AudioChunk(pcm, rate, width).resampled(KWS_SAMPLE_RATE))
+        if not templates:
+            raise ValueError(f"No keyword recordings (*.wav) in {directory}")
+        return cls(templates, threshold)
+
+    def best_match(self, chunk):
+        """
+        Returns:
+            tuple: (keyword, distance) of the closest template
+        """
+        features = mfcc(chunk.resampled(KWS_SAMPLE_RATE))
+        return min(((keyword, subsequence_distance(template, features)) for keyword, template in self.templates),
+                   key=lambda match: match[1])
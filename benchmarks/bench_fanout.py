@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Fan-out benchmark against simulated ESP32 and Kasa fleets.
+
+Starts a FakeFleet of N devices on loopback addresses, points main.py at
+them through a generated config.txt and measures three paths:
+
+  fanout    main.send_command_to_all()
+  on_all    POST /on_all and /off_all through the Flask app
+  schedule  main.execute_scheduled_action(), what the schedule engine runs
+
+For each path and fleet size it prints per-device latency percentiles
+(from the command history) and the wall time of each all-lights command.
+Results can be saved as a baseline and compared against later runs.
+
+Usage:
+  python benchmarks/bench_fanout.py --sizes 10,100,1000 --save-baseline baseline.json
+  python benchmarks/bench_fanout.py --sizes 10,100,1000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stats import percentile  # noqa: E402
+
+SCENARIOS = ('fanout', 'on_all', 'schedule')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark all-lights commands against a simulated fleet.")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated fleet sizes.")
+    parser.add_argument("--rounds", default=5, type=int, help="Measured all-lights commands per scenario and size.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: "
+                        + ", ".join(SCENARIOS))
+    parser.add_argument("--latency", default=0.45, type=float, help="Simulated device latency in seconds.")
+    parser.add_argument("--jitter", default=0.05, type=float, help="Extra random latency of up to this many seconds.")
+    parser.add_argument("--failure-rate", default=0.0, type=float, help="Fraction of commands that fail.")
+    parser.add_argument("--kasa-fraction", default=0.1, type=float, help="Fraction of the fleet that are Kasa plugs.")
+    parser.add_argument("--workers", default=None, type=int, help="Override FANOUT_MAX_WORKERS.")
+    parser.add_argument("--servo-port", default=18080, type=int, help="Port the fake servo lights listen on.")
+    parser.add_argument("--kasa-port", default=19999, type=int, help="Port the fake Kasa plugs listen on.")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Write results to FILE as JSON.")
+    parser.add_argument("--compare", metavar="FILE", help="Compare results with a baseline written earlier.")
+    return parser.parse_args()
+
+
+def raise_file_limit():
+    # Each device needs a listening socket plus both ends of a connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and (hard == resource.RLIM_INFINITY or soft < hard):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def write_config(path, servo_hosts, kasa_hosts):
+    with open(path, 'w') as file:
+        for index, host in enumerate(servo_hosts):
+            file.write(f"Light {index:04d} - {host}\n")
+        for index, host in enumerate(kasa_hosts):
+            file.write(f"$Plug {index:04d} - {host}\n")
+
+
+def device_latencies(main, since):
+    main.history.flush()
+    rows = main.db.query('SELECT latency_ms, success FROM command_history WHERE ts >= ?', (since,))
+    return sorted(row[0] for row in rows), sum(1 for row in rows if not row[1])
+
+
+def run_scenario(main, client, scenario, rounds):
+    commands = [main.COMMAND_ON, main.COMMAND_OFF]
+    walls = []
+    since = time.time()
+
+    def once(command):
+        start = time.perf_counter()
+        if scenario == 'fanout':
+            main.send_command_to_all(command)
+        elif scenario == 'on_all':
+            client.post('/on_all' if command == main.COMMAND_ON else '/off_all')
+        else:
+            main.execute_scheduled_action('ON' if command == main.COMMAND_ON else 'OFF')
+        return time.perf_counter() - start
+
+    once(commands[1])  # Warm-up: open connections so every measured round starts from steady state
+    since = time.time()
+    for index in range(rounds):
+        walls.append(once(commands[index % 2]))
+    latencies, failures = device_latencies(main, since)
+    walls.sort()
+    return {
+        'rounds': rounds,
+        'commands': len(latencies),
+        'failures': failures,
+        'device_p50_ms': percentile(latencies, 50),
+        'device_p95_ms': percentile(latencies, 95),
+        'device_p99_ms': percentile(latencies, 99),
+        'wall_p50_s': round(percentile(walls, 50), 4),
+        'wall_p95_s': round(percentile(walls, 95), 4),
+        'wall_p99_s': round(percentile(walls, 99), 4),
+        'wall_total_s': round(sum(walls), 4),
+    }
+
+
+def print_results(results, baseline=None):
+    header = (f"{'scenario':<10} {'N':>5} {'cmds':>6} {'fail':>5} {'dev p50':>9} {'dev p95':>9} {'dev p99':>9} "
+              f"{'wall p50':>9} {'wall p95':>9} {'wall p99':>9} {'total':>8}")
+    print(header)
+    print('-' * len(header))
+    for key, result in results.items():
+        scenario, size = key.split('/')
+        print(f"{scenario:<10} {size:>5} {result['commands']:>6} {result['failures']:>5} "
+              f"{result['device_p50_ms']:>7.1f}ms {result['device_p95_ms']:>7.1f}ms {result['device_p99_ms']:>7.1f}ms "
+              f"{result['wall_p50_s']:>8.3f}s {result['wall_p95_s']:>8.3f}s {result['wall_p99_s']:>8.3f}s "
+              f"{result['wall_total_s']:>7.2f}s")
+        if baseline and key in baseline:
+            before = baseline[key]
+            deltas = []
+            for metric in ('wall_p50_s', 'wall_p95_s', 'device_p95_ms'):
+                if before.get(metric):
+                    deltas.append(f"{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+            print(f"{'':<10} {'':>5} vs baseline: {', '.join(deltas)}")
+
+
+def main_bench():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+
+    directory = tempfile.mkdtemp(prefix='light-control-fanout-')
+    os.environ['LIGHT_CONTROL_DIR'] = directory
+    os.environ['LIGHT_CONTROL_SERVO_PORT'] = str(args.servo_port)
+    os.environ['LIGHT_CONTROL_KASA_PORT'] = str(args.kasa_port)
+    raise_file_limit()
+
+    from benchmarks.fake_devices import FakeFleet
+    import main
+    if args.workers:
+        main.FANOUT_MAX_WORKERS = args.workers
+
+    largest = max(sizes)
+    kasa_largest = int(round(largest * args.kasa_fraction))
+    servo_pool = FakeFleet.loopback_hosts(largest - kasa_largest)
+    kasa_pool = FakeFleet.loopback_hosts(kasa_largest, offset=largest)
+    fleet = FakeFleet(servo_pool, kasa_pool, args.servo_port, args.kasa_port, latency=args.latency,
+                      jitter=args.jitter, failure_rate=args.failure_rate).start()
+    client = main.app.test_client()
+
+    print(f"Fleet: up to {largest} devices ({args.kasa_fraction:.0%} Kasa), latency {args.latency}s "
+          f"+ up to {args.jitter}s jitter, failure rate {args.failure_rate:.0%}, "
+          f"fan-out workers {main.FANOUT_MAX_WORKERS}\n")
+    results = {}
+    for size in sizes:
+        kasa_count = int(round(size * args.kasa_fraction))
+        write_config(main.CONFIG_PATH, servo_pool[:size - kasa_count], kasa_pool[:kasa_count])
+        main.registry.reload()
+        for scenario in scenarios:
+            results[f"{scenario}/{size}"] = run_scenario(main, client, scenario, args.rounds)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+    fleet.stop()
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Cost of a logging call on the command path, before and after queue-based logging.
+
+"before" is what logging.basicConfig(filename=...) set up: a FileHandler on
+the root logger, so the calling thread formats, writes and flushes. "after"
+is main.py's QueueLogging: the caller only enqueues and a listener thread
+does the I/O. --write-delay simulates a slow SD card by sleeping in every
+flush. Several threads log at once, like the lights of a fan-out.
+
+Usage: python benchmarks/bench_logging.py [--threads 8] [--calls 2000] [--write-delay 0.002]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LIGHT_CONTROL_DIR', tempfile.mkdtemp(prefix='light-control-bench-'))
+
+import main  # noqa: E402
+from benchmarks.stats import percentile  # noqa: E402
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler whose flushes take write_delay seconds, like a busy SD card"""
+
+    def __init__(self, path, write_delay):
+        super().__init__(path)
+        self.write_delay = write_delay
+
+    def flush(self):
+        super().flush()
+        if self.write_delay:
+            time.sleep(self.write_delay)
+
+
+def measure(label, threads, calls):
+    samples = []
+    lock = threading.Lock()
+
+    def worker(number):
+        local = []
+        for i in range(calls):
+            start = time.perf_counter()
+            logging.info(f"Sent command '0' to 10.0.0.{number}; Response: {{'success': True}} ({i})")
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall = time.perf_counter() - start
+    samples.sort()
+    print(f"{label:<30} p50 {percentile(samples, 50) * 1e6:8.1f} us  p99 {percentile(samples, 99) * 1e6:8.1f} us  "
+          f"max {samples[-1] * 1e3:7.2f} ms  wall {wall:6.2f} s")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark logging call latency.")
+    parser.add_argument("--threads", default=8, type=int, help="Threads logging concurrently.")
+    parser.add_argument("--calls", default=2000, type=int, help="Log calls per thread.")
+    parser.add_argument("--write-delay", default=0.002, type=float, help="Seconds each flush to disk takes.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='logging-bench-')
+    root = logging.getLogger()
+
+    # before: synchronous file handler on the root logger
+    main.log_pipeline.stop()
+    root.removeHandler(main.log_pipeline.queue_handler)
+    direct = SlowFileHandler(os.path.join(directory, 'before.txt'), args.write_delay)
+    direct.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(direct)
+    measure("before (handler on caller)", args.threads, args.calls)
+    root.removeHandler(direct)
+    direct.close()
+
+    # after: the same slow handler behind main.QueueLogging
+    pipeline = main.QueueLogging(SlowFileHandler(os.path.join(directory, 'after.txt'), args.write_delay))
+    measure("after (queue + listener)", args.threads, args.calls)
+    start = time.perf_counter()
+    pipeline.stop()
+    print(f"listener drained the backlog {time.perf_counter() - start:.2f} s after the last call")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Schedule CRUD throughput before and after the SQLite access layer.
+
+"before" replays what the routes used to do: a fresh sqlite3.connect() per
+operation on a rollback-journal database without indexes. "after" goes
+through main.py's Database (per-thread connection, WAL, indexes, batched
+inserts). Both run the same create / list enabled / toggle / delete mix,
+optionally with a concurrent reader thread standing in for the scheduler.
+
+Usage: python benchmarks/bench_schedule_db.py [--schedules 2000] [--reader]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LIGHT_CONTROL_DIR', tempfile.mkdtemp(prefix='light-control-bench-'))
+
+import main  # noqa: E402
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schedules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT NOT NULL,
+        action TEXT NOT NULL,
+        enabled INTEGER DEFAULT 1,
+        days TEXT DEFAULT 'daily',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+class ConnectPerOperation:
+    """The pre-migration access pattern"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute(SCHEMA)
+        conn.commit()
+        conn.close()
+
+    def create_many(self, rows):
+        ids = []
+        for row in rows:
+            conn = sqlite3.connect(self.path)
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO schedules (time, action, days) VALUES (?, ?, ?)', row)
+            ids.append(cursor.lastrowid)
+            conn.commit()
+            conn.close()
+        return ids
+
+    def list_enabled(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute('SELECT * FROM schedules WHERE enabled = 1').fetchall()
+        conn.close()
+        return rows
+
+    def toggle(self, schedule_id):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT enabled FROM schedules WHERE id = ?', (schedule_id,))
+        enabled = cursor.fetchone()[0]
+        cursor.execute('UPDATE schedules SET enabled = ? WHERE id = ?', (0 if enabled else 1, schedule_id))
+        conn.commit()
+        conn.close()
+
+    def delete(self, schedule_id):
+        conn = sqlite3.connect(self.path)
+        conn.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
+        conn.commit()
+        conn.close()
+
+
+class AccessLayer:
+    """main.Database, as used by the routes now"""
+
+    def __init__(self, path):
+        self.db = main.Database(path)
+        self.db.migrate()
+
+    def create_many(self, rows):
+        ids = []
+        with self.db.transaction() as conn:
+            for row in rows:
+                ids.append(conn.execute('INSERT INTO schedules (time, action, days) VALUES (?, ?, ?)', row).lastrowid)
+        return ids
+
+    def list_enabled(self):
+        return self.db.query('SELECT * FROM schedules WHERE enabled = 1')
+
+    def toggle(self, schedule_id):
+        with self.db.transaction() as conn:
+            enabled = conn.execute('SELECT enabled FROM schedules WHERE id = ?', (schedule_id,)).fetchone()[0]
+            conn.execute('UPDATE schedules SET enabled = ? WHERE id = ?', (0 if enabled else 1, schedule_id))
+
+    def delete(self, schedule_id):
+        self.db.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
+
+
+def run(label, store, count, lists, reader):
+    rows = [(f"{i // 60 % 24:02d}:{i % 60:02d}", 'ON' if i % 2 else 'OFF', 'daily') for i in range(count)]
+    stop = threading.Event()
+    reads = [0]
+
+    def read_loop():
+        while not stop.is_set():
+            store.list_enabled()
+            reads[0] += 1
+
+    thread = None
+    if reader:
+        thread = threading.Thread(target=read_loop, daemon=True)
+        thread.start()
+
+    timings = {}
+    start = time.perf_counter()
+    ids = store.create_many(rows)
+    timings['create'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(lists):
+        store.list_enabled()
+    timings['list'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for schedule_id in ids:
+        store.toggle(schedule_id)
+    timings['toggle'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for schedule_id in ids:
+        store.delete(schedule_id)
+    timings['delete'] = time.perf_counter() - start
+
+    stop.set()
+    if thread:
+        thread.join()
+
+    print(f"{label}:")
+    for operation, elapsed in timings.items():
+        operations = lists if operation == 'list' else count
+        print(f"  {operation:<7} {operations / elapsed:10.0f} ops/s  ({elapsed:.3f} s)")
+    if reader:
+        print(f"  concurrent reader completed {reads[0]} list queries")
+    return timings
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark schedule CRUD throughput.")
+    parser.add_argument("--schedules", default=2000, type=int, help="Schedules created, toggled and deleted.")
+    parser.add_argument("--lists", default=200, type=int, help="List-enabled queries to run.")
+    parser.add_argument("--reader", action="store_true", help="Run a concurrent reader thread during the test.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='schedule-db-bench-')
+    before = run("before (connect per operation)", ConnectPerOperation(os.path.join(directory, 'before.db')),
+                 args.schedules, args.lists, args.reader)
+    after = run("after (access layer)", AccessLayer(os.path.join(directory, 'after.db')),
+                args.schedules, args.lists, args.reader)
+    print("speedup:")
+    for operation in before:
+        print(f"  {operation:<7} {before[operation] / after[operation]:6.1f}x")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare per-command latency of a fresh connection per request (the old
+bare requests.post) against main.py's pooled keep-alive session, using a
+local stand-in /servo server.
+
+On loopback a TCP handshake costs next to nothing, so the stand-in holds
+every new connection for --connect-delay seconds before answering, like
+the handshake with an ESP32 over Wi-Fi. Only the path that opens a
+connection per command pays it on every command.
+
+Usage: python benchmarks/bench_servo_session.py [--commands 500] [--connect-delay 0.01]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LIGHT_CONTROL_DIR', tempfile.mkdtemp(prefix='light-control-bench-'))
+
+from benchmarks.fake_devices import FakeServoServer  # noqa: E402
+from benchmarks.stats import percentile  # noqa: E402
+import main  # noqa: E402
+
+
+def report(label, samples, connections):
+    print(f"{label:<28} mean {statistics.mean(samples) * 1000:7.3f} ms  "
+          f"p50 {percentile(samples, 50) * 1000:7.3f} ms  "
+          f"p95 {percentile(samples, 95) * 1000:7.3f} ms  "
+          f"p99 {percentile(samples, 99) * 1000:7.3f} ms  "
+          f"{connections} connections")
+
+
+def time_calls(func, commands):
+    samples = []
+    for i in range(commands):
+        start = time.perf_counter()
+        func("0" if i % 2 else "180")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs unpooled /servo commands.")
+    parser.add_argument("--commands", default=500, type=int, help="Commands sent per variant.")
+    parser.add_argument("--latency", default=0.0, type=float, help="Simulated device latency in seconds.")
+    parser.add_argument("--connect-delay", default=0.01, type=float,
+                        help="Simulated cost in seconds of opening a connection (a Wi-Fi round trip).")
+    args = parser.parse_args()
+
+    print(f"Stand-in light answers in {args.latency * 1e3:.0f} ms, new connections cost "
+          f"{args.connect_delay * 1e3:.0f} ms\n")
+    server = FakeServoServer(latency=args.latency, connect_delay=args.connect_delay).start()
+    address = server.address
+    url = f"http://{address}/servo"
+
+    def unpooled(command):
+        response = requests.post(url, data={"position": command})
+        response.raise_for_status()
+
+    def pooled(command):
+        success, response = main.send_command(address, command, max_retries=0)
+        if not success:
+            raise RuntimeError(response)
+
+    # Warm up both paths so neither pays one-off import or DNS costs in the measurement
+    unpooled("0")
+    pooled("0")
+
+    for label, func in (("new connection per command", unpooled), ("pooled keep-alive session", pooled)):
+        opened = server.connections
+        samples = time_calls(func, args.commands)
+        report(label, samples, server.connections - opened)
+    server.stop()
+
+
+if __name__ == '__main__':
+    main_bench()
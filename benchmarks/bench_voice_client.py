@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Latency of a voice command, with a connection per command and with main_voice.VoiceClient.
+
+"before" is what main_voice.py used to do: open a new connection, send one
+command and close it again, for every utterance. "after" is VoiceClient,
+warmed up before the first command and reusing its keep-alive connection.
+Two paths are measured:
+
+  device  /servo on a local stand-in light (benchmarks.fake_devices.FakeServoServer),
+          what the voice path falls back to when main.py is down
+  server  POST /batch?async=1 to main.py, run under gunicorn in front of the stand-in light
+
+The first command is reported separately, since that is the one a cold
+connection costs the most. On loopback a TCP handshake is almost free, so
+--rtt puts a proxy in front of each path that delays connection setup by one
+round trip and every exchange by another, like the Wi-Fi hop to an ESP32.
+
+Usage: python benchmarks/bench_voice_client.py [--commands 200] [--latency 0] [--rtt 0.01]
+"""
+import argparse
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LIGHT_CONTROL_DIR', tempfile.mkdtemp(prefix='light-control-bench-'))
+
+import main_voice  # noqa: E402
+from benchmarks.fake_devices import FakeServoServer  # noqa: E402
+from benchmarks.stats import percentile  # noqa: E402
+
+
+class DelayProxy(socketserver.ThreadingTCPServer):
+    """TCP proxy adding a round trip to connection setup and half of one to every chunk in each direction"""
+    daemon_threads = True
+
+    def __init__(self, target, rtt):
+        host, port = target.split(':')
+        self.target = (host, int(port))
+        self.rtt = rtt
+        super().__init__(('127.0.0.1', 0), DelayProxyHandler)
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class DelayProxyHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        time.sleep(self.server.rtt)  # SYN / SYN-ACK
+        upstream = socket.create_connection(self.server.target)
+        for sock in (self.request, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        back = threading.Thread(target=self.pipe, args=(upstream, self.request), daemon=True)
+        back.start()
+        self.pipe(self.request, upstream)
+        back.join()
+        upstream.close()
+
+    def pipe(self, source, dest):
+        # Every chunk is delivered rtt/2 after it arrived, without holding up the chunks behind it
+        chunks = queue.Queue()
+
+        def deliver():
+            while True:
+                due, data = chunks.get()
+                time.sleep(max(0.0, due - time.monotonic()))
+                try:
+                    if data:
+                        dest.sendall(data)
+                    else:
+                        dest.shutdown(socket.SHUT_WR)
+                        return
+                except OSError:
+                    return
+
+        sender = threading.Thread(target=deliver, daemon=True)
+        sender.start()
+        try:
+            while True:
+                data = source.recv(65536)
+                chunks.put((time.monotonic() + self.server.rtt / 2, data))
+                if not data:
+                    break
+        except OSError:
+            chunks.put((0, b''))
+        sender.join()
+
+
+def report(label, first, samples):
+    samples = sorted(samples)
+    print(f"{label:<34} first {first * 1e3:7.2f} ms  p50 {percentile(samples, 50) * 1e3:7.2f} ms  "
+          f"p95 {percentile(samples, 95) * 1e3:7.2f} ms  max {samples[-1] * 1e3:7.2f} ms")
+
+
+def route(address):
+    """Address clients use to reach address (through a DelayProxy with --rtt)"""
+    return address
+
+
+def measure(command, count):
+    """Time the first command, then count more; returns (first, samples)"""
+    samples = []
+    for index in range(count + 1):
+        start = time.perf_counter()
+        command('ON' if index % 2 else 'OFF')
+        samples.append(time.perf_counter() - start)
+    return samples[0], samples[1:]
+
+
+def bench_device(address, count):
+    address = route(address)
+    url = f"http://{address}/servo"
+
+    def per_command(action):
+        requests.post(url, data={'position': main_voice.SERVO_POSITIONS[action]},
+                      timeout=main_voice.DEVICE_TIMEOUT, headers={'Connection': 'close'}).raise_for_status()
+
+    report("device, connection per command", *measure(per_command, count))
+
+    client = main_voice.VoiceClient()
+    client.lights = {address: False}
+    client.warm_lights([address])
+    report("device, VoiceClient (pre-warmed)", *measure(lambda action: client.send_to_lights([address], action),
+                                                        count))
+    client.close()
+
+
+def start_server(device_address, directory):
+    """Run main.py under gunicorn, as deployed (the Flask dev server closes every connection)"""
+    ip, port = device_address.split(':')
+    with open(os.path.join(directory, 'config.txt'), 'w') as file:
+        file.write(f"Stand-in - {ip}\n")
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        server_port = sock.getsockname()[1]
+    env = dict(os.environ, LIGHT_CONTROL_DIR=directory, LIGHT_CONTROL_SERVO_PORT=port)
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py'), '--host', '127.0.0.1',
+                                '--port', str(server_port)], env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    server_url = f"http://127.0.0.1:{server_port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{server_url}/devices", timeout=1)
+            return process, server_port
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("main.py did not start")
+
+
+def bench_server(address, count):
+    process, server_port = start_server(address, tempfile.mkdtemp(prefix='light-control-bench-'))
+    server_url = f"http://{route(f'127.0.0.1:{server_port}')}"
+    ip = address.split(':')[0]
+    targets = [("Stand-in", (ip,))]
+
+    def per_command(action):
+        requests.post(f"{server_url}/batch", params={'async': 1, 'source': 'voice'},
+                      json={'entries': [{'device': ip, 'action': action}]}, timeout=main_voice.API_TIMEOUT,
+                      headers={'Connection': 'close'}).raise_for_status()
+
+    report("server, connection per command", *measure(per_command, count))
+
+    client = main_voice.VoiceClient(server_url)
+    client.warm()
+    report("server, VoiceClient (pre-warmed)", *measure(lambda action: client.send(targets, action), count))
+    client.close()
+    process.terminate()
+    process.wait()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark voice command latency.")
+    parser.add_argument("--commands", default=200, type=int, help="Commands timed per client, after the first.")
+    parser.add_argument("--latency", default=0.0, type=float, help="Seconds the stand-in light takes to answer.")
+    parser.add_argument("--paths", default="device,server", help="Comma-separated subset of: device, server.")
+
+    parser.add_argument("--rtt", default=0.0, type=float, help="Simulated network round trip in seconds.")
+    args = parser.parse_args()
+
+    global route
+    if args.rtt:
+        route = lambda address: DelayProxy(address, args.rtt).start().address  # noqa: E731
+    print(f"Stand-in light answers in {args.latency * 1e3:.0f} ms, network round trip {args.rtt * 1e3:.0f} ms\n")
+    device = FakeServoServer(latency=args.latency).start()
+    paths = args.paths.split(',')
+    if 'device' in paths:
+        bench_device(device.address, args.commands)
+    if 'server' in paths:
+        bench_server(device.address, args.commands)
+    device.stop()
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeServoHandler(BaseHTTPRequestHandler):
+    """Answers like the ESP32 firmware: GET / for liveness and POST /servo to move the servo"""
+    # HTTP/1.1 so clients can keep the connection alive between commands
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle plus delayed ACKs
+        # add ~40 ms to every response on a reused connection
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+        if self.server.connect_delay:
+            time.sleep(self.server.connect_delay)  # Handshake over a real network, paid once per connection
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send(self, status, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/':
+            self._send(200, 'text/plain', 'ESP32 HTTP Server is online.')
+        else:
+            self._send(404, 'text/plain', 'Not found')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if self.path != '/servo':
+            self._send(404, 'text/plain', 'Not found')
+            return
+
+        self.server.simulate_delay()
+        if self.server.should_fail():
+            self._send(500, 'application/json', json.dumps({'success': False, 'message': 'Simulated failure'}))
+            return
+
+        position = form.get('position', [None])[0]
+        if position not in ('0', '180'):
+            self._send(400, 'application/json',
+                       json.dumps({'success': False, 'message': 'Invalid position. Use 0 or 180.'}))
+            return
+        self.server.commands += 1
+        self._send(200, 'application/json',
+                   json.dumps({'success': True, 'message': f'Servo moved to position: {position}'}))
+
+
+class FakeServoServer(ThreadingHTTPServer):
+    """
+    Local stand-in for an ESP32 servo light.
+
+    Args:
+        host: Address to bind (default: 127.0.0.1)
+        port: Port to bind, 0 picks a free one (default: 0)
+        latency: Base response delay in seconds, like the firmware's servo delay (default: 0)
+        jitter: Extra random delay of up to this many seconds (default: 0)
+        failure_rate: Fraction of commands answered with HTTP 500 (default: 0)
+        connect_delay: Seconds each new connection waits before its first request is read, standing
+            in for the TCP handshake over Wi-Fi that loopback does not have (default: 0)
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, connect_delay=0.0):
+        super().__init__((host, port), FakeServoHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.connect_delay = connect_delay
+        self.commands = 0
+        self.connections = 0
+        self._thread = None
+
+    @property
+    def address(self):
+        """Host:port string usable wherever main.py expects a light's IP"""
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def simulate_delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def should_fail(self):
+        return self.failure_rate and random.random() < self.failure_rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _kasa_xor(data, decrypt):
+    key = 171
+    out = bytearray()
+    for byte in data:
+        out.append(key ^ byte)
+        key = byte if decrypt else key ^ byte
+    return bytes(out)
+
+
+class FakeKasaHandler(socketserver.BaseRequestHandler):
+    """Speaks the length-prefixed XOR Smart Home protocol, serving many requests per connection"""
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            header = self._recv_exactly(4)
+            if header is None:
+                return
+            body = self._recv_exactly(struct.unpack('>I', header)[0])
+            if body is None:
+                return
+            request = json.loads(_kasa_xor(body, decrypt=True))
+            reply = self.server.answer(request)
+            payload = json.dumps(reply).encode('utf-8')
+            self.request.sendall(struct.pack('>I', len(payload)) + _kasa_xor(payload, decrypt=False))
+            if self.server.close_after_reply:
+                return
+
+
+class FakeKasaDevice(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for a Kasa smart plug.
+
+    Args:
+        host: Address to bind (default: 127.0.0.1)
+        port: Port to bind, 0 picks a free one (default: 0)
+        latency: Base response delay in seconds (default: 0)
+        jitter: Extra random delay of up to this many seconds (default: 0)
+        failure_rate: Fraction of commands answered with a non-zero err_code (default: 0)
+        close_after_reply: Drop the connection after every reply, like some firmware does (default: False)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 close_after_reply=False):
+        super().__init__((host, port), FakeKasaHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.close_after_reply = close_after_reply
+        self.relay_state = 0
+        self.commands = 0
+        self.connections = 0
+        self._thread = None
+
+    @property
+    def address(self):
+        """Host:port string usable wherever main.py expects a plug's IP"""
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def answer(self, request):
+        system = request.get('system', {})
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if 'set_relay_state' in system:
+            self.commands += 1
+            if self.failure_rate and random.random() < self.failure_rate:
+                return {'system': {'set_relay_state': {'err_code': -1, 'err_msg': 'simulated failure'}}}
+            self.relay_state = int(system['set_relay_state'].get('state', 0))
+            return {'system': {'set_relay_state': {'err_code': 0}}}
+        if 'get_sysinfo' in system:
+            return {'system': {'get_sysinfo': {'alias': 'Fake Plug', 'relay_state': self.relay_state,
+                                               'err_code': 0}}}
+        return {'system': {'err_code': -2, 'err_msg': 'module not support'}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeFleet:
+    """
+    Many fake devices served from one asyncio loop, for fan-out benchmarks.
+
+    Every servo light listens on its own loopback address (127.x.y.z) at
+    servo_port and every Kasa plug at kasa_port, so config.txt can list them
+    by plain IP the way it lists real devices. Simulated latency is an
+    asyncio sleep, so a thousand devices need no extra threads.
+
+    Args:
+        servo_hosts: Addresses of fake servo lights
+        kasa_hosts: Addresses of fake Kasa plugs
+        servo_port: Port every servo light listens on
+        kasa_port: Port every Kasa plug listens on
+        latency: Base response delay in seconds (default: 0.45, the firmware's servo delay)
+        jitter: Extra random delay of up to this many seconds (default: 0)
+        failure_rate: Fraction of commands that fail (default: 0)
+    """
+
+    def __init__(self, servo_hosts, kasa_hosts, servo_port, kasa_port, latency=0.45, jitter=0.0,
+                 failure_rate=0.0):
+        self.servo_hosts = list(servo_hosts)
+        self.kasa_hosts = list(kasa_hosts)
+        self.servo_port = servo_port
+        self.kasa_port = kasa_port
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.commands = 0
+        self.failures = 0
+        self._loop = None
+        self._servers = []
+        self._thread = None
+
+    @staticmethod
+    def loopback_hosts(count, offset=0):
+        """Distinct loopback addresses 127.0.0.2, 127.0.0.3, ... (Linux routes all of 127/8 to lo)"""
+        hosts = []
+        for index in range(offset, offset + count):
+            number = index + 2
+            hosts.append(f"127.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}")
+        return hosts
+
+    async def _delay_and_decide(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        self.commands += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures += 1
+            return False
+        return True
+
+    async def _serve_servo(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method, path = request_line.decode('latin-1').split()[:2]
+                if method == 'POST' and path == '/servo':
+                    position = parse_qs(body.decode('utf-8')).get('position', [''])[0]
+                    if await self._delay_and_decide():
+                        status, payload = 200, {'success': True, 'message': f'Servo moved to position: {position}'}
+                    else:
+                        status, payload = 500, {'success': False, 'message': 'Simulated failure'}
+                    content_type, text = 'application/json', json.dumps(payload)
+                else:
+                    status, content_type, text = 200, 'text/plain', 'ESP32 HTTP Server is online.'
+                data = text.encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n"
+                             .encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_kasa(self, reader, writer):
+        relay_state = 0
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                body = await reader.readexactly(struct.unpack('>I', header)[0])
+                system = json.loads(_kasa_xor(body, decrypt=True)).get('system', {})
+                if 'set_relay_state' in system:
+                    if await self._delay_and_decide():
+                        relay_state = int(system['set_relay_state'].get('state', 0))
+                        reply = {'system': {'set_relay_state': {'err_code': 0}}}
+                    else:
+                        reply = {'system': {'set_relay_state': {'err_code': -1, 'err_msg': 'simulated failure'}}}
+                else:
+                    reply = {'system': {'get_sysinfo': {'alias': 'Fake Plug', 'relay_state': relay_state,
+                                                        'err_code': 0}}}
+                payload = json.dumps(reply).encode('utf-8')
+                writer.write(struct.pack('>I', len(payload)) + _kasa_xor(payload, decrypt=False))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _start_servers(self):
+        for host in self.servo_hosts:
+            self._servers.append(await asyncio.start_server(self._serve_servo, host, self.servo_port))
+        for host in self.kasa_hosts:
+            self._servers.append(await asyncio.start_server(self._serve_kasa, host, self.kasa_port))
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_servers())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='fake-fleet', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        async def shutdown():
+            for server in self._servers:
+                server.close()
+            # Connection handlers idle on keep-alive reads; cancel them so the loop can stop cleanly
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(timeout=30)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
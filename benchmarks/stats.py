@@ -0,0 +1,10 @@
+"""Summary statistics shared by the benchmarks, so every script computes them the same way"""
+import math
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values in any order; None if there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
@@ -1,20 +1,118 @@
 import time
 import re
 import telnetlib
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, redirect
 import logging
 import ipaddress
 import subprocess  # Needed for running Kasa commands
 import os
+import json
+import socket
+import struct
 import requests
+from requests.adapters import HTTPAdapter
 import sqlite3
 import threading
-from datetime import datetime
-import schedule
+import asyncio
+import collections
+import uuid
+import atexit
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import heapq
+import bisect
+import random
+import argparse
+import fcntl
+import hashlib
+import gzip
+import queue
+import shutil
+import logging.handlers
+
+from servo import SERVO_PORT, device_url
+
+# Directory holding config.txt, log.txt and schedules.db (overridable for local runs and benchmarks)
+BASE_DIR = os.environ.get('LIGHT_CONTROL_DIR', '/home/jason/light-control')
+
+# Logging settings
+LOG_PATH = os.path.join(BASE_DIR, 'log.txt')
+LOG_LEVEL = os.environ.get('LIGHT_CONTROL_LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LIGHT_CONTROL_LOG_FORMAT', 'text')  # 'text' or 'json' (one object per line)
+LOG_MAX_BYTES = int(os.environ.get('LIGHT_CONTROL_LOG_MAX_BYTES', 5 * 1024 * 1024))  # Rotate past this size
+LOG_ROTATE_WHEN = os.environ.get('LIGHT_CONTROL_LOG_ROTATE_WHEN')  # e.g. 'midnight': rotate by time instead
+LOG_BACKUP_COUNT = 7  # Rotated segments kept, gzip-compressed
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def gzip_rotator(source, dest):
+    """Compress a rotated log segment instead of just renaming it"""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def log_file_handler():
+    """The rotating log.txt handler the log listener writes to"""
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(LOG_PATH, when=LOG_ROTATE_WHEN,
+                                                            backupCount=LOG_BACKUP_COUNT)
+    else:
+        handler = logging.handlers.RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES,
+                                                       backupCount=LOG_BACKUP_COUNT)
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = gzip_rotator
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    return handler
+
+class QueueLogging:
+    """
+    Non-blocking logging: the root logger only puts records on a queue and a
+    listener thread formats them and does the file I/O (including rotation
+    and compression), so logging never makes a command wait on the SD card.
+    """
+
+    def __init__(self, handler, level=LOG_LEVEL):
+        self.handler = handler
+        self.queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        self.listener = None
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(self.queue_handler)
+        self.start()
+        atexit.register(self.stop)
+        # The listener thread does not survive fork(), so the forked server worker starts its own
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, self.handler)
+        self.listener.start()
+
+    def stop(self):
+        """Write out queued records and stop the listener"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
 
 # Set up logging
-logging.basicConfig(filename='/home/jason/light-control/log.txt', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+log_pipeline = QueueLogging(log_file_handler())
 
 # Flask web app setup
 app = Flask(__name__)
@@ -22,49 +120,1047 @@ app = Flask(__name__)
 env = os.environ.copy()
 env["PATH"] += ":/home/jason/.local/bin"
 
+# Fan-out settings for commands sent to every light at once
+FANOUT_MAX_WORKERS = 8  # Maximum number of lights commanded concurrently
+FANOUT_STAGGER = 0.0    # Optional delay in seconds between dispatching each light
+
+# HTTP settings for servo lights
+HTTP_CONNECT_TIMEOUT = 2.0  # Seconds to wait for a TCP connection to a light
+HTTP_READ_TIMEOUT = 5.0     # Seconds to wait for a light to answer (servo moves take ~0.5 s)
+HTTP_POOL_MAXSIZE = 2       # Keep-alive connections kept open per light
+
+# One keep-alive session per light, created on first use
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_device_session(ip):
+    """Return the pooled keep-alive HTTP session for a light, creating it if needed"""
+    session = _sessions.get(ip)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(ip)
+            if session is None:
+                session = requests.Session()
+                # Retries are handled by send_command, so the adapter must not retry on its own
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE,
+                                                        max_retries=0)
+                session.mount('http://', adapter)
+                _sessions[ip] = session
+    return session
+
+# Kasa settings
+KASA_BACKEND = os.environ.get('LIGHT_CONTROL_KASA_BACKEND', 'native')  # 'native' or 'cli'
+KASA_CLI_FALLBACK = True  # Retry through the kasa CLI if the native protocol fails
+KASA_PORT = int(os.environ.get('LIGHT_CONTROL_KASA_PORT', 9999))  # TP-Link Smart Home protocol port
+KASA_TIMEOUT = 3.0        # Seconds to wait for a Kasa plug to connect or answer
+# Plugs that are power-cycled rather than switched off
+KASA_POWER_CYCLE_IPS = {'10.0.0.132', '10.0.0.218'}
+
+# Retry and circuit breaker settings
+RETRY_MAX_DELAY = 8.0             # Cap in seconds on the exponential backoff between retries
+BREAKER_FAILURE_THRESHOLD = 4     # Consecutive failed attempts before a device's breaker opens
+BREAKER_PROBE_INTERVAL = 15.0     # Seconds before an open breaker is first probed
+BREAKER_PROBE_MAX_INTERVAL = 300.0  # Longest wait between probes of a device that stays down
+BREAKER_PROBE_WORKERS = 8         # Devices probed at the same time
+
+# Health prober settings
+HEALTH_INTERVAL = 30.0          # Seconds between probes of the whole fleet
+HEALTH_TIMEOUT = 2.0            # Seconds a device has to answer a probe
+HEALTH_OFFLINE_AFTER = 2        # Consecutive failed probes before a device is considered offline
+HEALTH_MAX_CONCURRENCY = 512    # Probes in flight at once (each holds a socket)
+HEALTH_SKIP_OFFLINE = False     # Skip offline lights in fan-outs instead of just sending to them last
+
+# Background job settings for the asynchronous command API
+JOB_MAX_WORKERS = 4  # Jobs (single light or fan-out) running at the same time
+JOB_HISTORY = 200    # Finished jobs kept for /jobs/<id> lookups
+
+# Server-Sent Events settings
+EVENTS_PORT = int(os.environ.get('LIGHT_CONTROL_EVENTS_PORT', 5070))  # Port of the /events stream
+# URL browsers use for the stream when a reverse proxy (TLS, path prefix) forwards it to EVENTS_PORT,
+# e.g. 'https://lights.example/events' or '/light-events'; unset, pages use EVENTS_PORT on their own host
+EVENTS_URL = os.environ.get('LIGHT_CONTROL_EVENTS_URL') or None
+# Origins besides pages served from the stream's own host that may read it, e.g. 'https://lights.example'
+EVENTS_ALLOWED_ORIGINS = {origin.strip().rstrip('/') for origin in
+                          os.environ.get('LIGHT_CONTROL_EVENTS_ORIGINS', '').split(',') if origin.strip()}
+EVENTS_HISTORY = 100      # Recent events replayed to clients reconnecting with Last-Event-ID
+EVENTS_HEARTBEAT = 15.0   # Seconds between keep-alive comments on idle streams
+EVENTS_CLIENT_BACKLOG = 256  # Undelivered events allowed per client before it is disconnected
+
+# Scheduler settings
+SCHEDULER_MAX_SLEEP = 60.0  # Longest uninterrupted sleep, so wall-clock jumps (NTP, DST) are noticed
+SCHEDULER_WORKERS = 2       # Scheduled actions that may run at the same time
+
+# Web server settings (defaults for the command-line options, see parse_args)
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 5069
+SERVER_THREADS = int(os.environ.get('LIGHT_CONTROL_THREADS', 16))  # Request threads of the single server process
+SERVER_TIMEOUT = 120  # Seconds a worker may stay silent before it is restarted
+SERVER_KEEPALIVE = 75  # Seconds an idle keep-alive connection is kept open (main_voice.py pings every 30)
+LEADER_LOCK_PATH = os.path.join(BASE_DIR, 'leader.lock')  # Held by the process running background services
+
+def backoff_delay(retry, base):
+    """Delay before retry number `retry` (0-based): exponential backoff with full jitter"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, base * 2 ** retry))
+
 # Database setup
-DB_PATH = '/home/jason/light-control/schedules.db'
-
-def init_database():
-    """Initialize the database with schedules table"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS schedules (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            time TEXT NOT NULL,
-            action TEXT NOT NULL,
-            enabled INTEGER DEFAULT 1,
-            days TEXT DEFAULT 'daily',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    logging.info("Database initialized")
+DB_PATH = os.path.join(BASE_DIR, 'schedules.db')
+DB_BUSY_TIMEOUT = 5.0  # Seconds a writer waits for a competing write to finish
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: schedules table (databases created before migrations already have it)
+    """
+    CREATE TABLE IF NOT EXISTS schedules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT NOT NULL,
+        action TEXT NOT NULL,
+        enabled INTEGER DEFAULT 1,
+        days TEXT DEFAULT 'daily',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # 2: the scheduler loads enabled schedules and the UI lists them by time
+    """
+    CREATE INDEX IF NOT EXISTS idx_schedules_enabled_time ON schedules (enabled, time);
+    CREATE INDEX IF NOT EXISTS idx_schedules_time ON schedules (time);
+    """,
+    # 3: one row per command actually sent to a device
+    """
+    CREATE TABLE IF NOT EXISTS command_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        device TEXT,
+        ip TEXT NOT NULL,
+        action TEXT NOT NULL,
+        source TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        latency_ms REAL NOT NULL,
+        success INTEGER NOT NULL,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_command_history_ts ON command_history (ts);
+    CREATE INDEX IF NOT EXISTS idx_command_history_ip_ts ON command_history (ip, ts);
+    """,
+    # 4: named groups and scenes of lights (members by IP); schedules may target one of them
+    """
+    CREATE TABLE IF NOT EXISTS groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS group_members (
+        group_id INTEGER NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+        ip TEXT NOT NULL,
+        PRIMARY KEY (group_id, ip)
+    );
+    CREATE TABLE IF NOT EXISTS scenes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS scene_members (
+        scene_id INTEGER NOT NULL REFERENCES scenes (id) ON DELETE CASCADE,
+        ip TEXT NOT NULL,
+        action TEXT NOT NULL CHECK (action IN ('ON', 'OFF')),
+        PRIMARY KEY (scene_id, ip)
+    );
+    ALTER TABLE schedules ADD COLUMN target TEXT NOT NULL DEFAULT 'all';
+    CREATE INDEX IF NOT EXISTS idx_schedules_target ON schedules (target);
+    """,
+    # 5: schedules may skip lights recently confirmed in the target state
+    """
+    ALTER TABLE schedules ADD COLUMN skip_unchanged INTEGER NOT NULL DEFAULT 0;
+    """,
+]
+
+class Database:
+    """
+    Small SQLite access layer.
+
+    Each thread keeps one open connection instead of connecting per query.
+    The database runs in WAL mode so the scheduler's reads and the API's
+    writes do not block each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL; avoids an fsync per commit
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def transaction(self):
+        """Run several statements atomically; commits on success, rolls back on error"""
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def query(self, sql, params=()):
+        """Return all rows of a SELECT"""
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        """Return the first row of a SELECT, or None"""
+        return self.connection().execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        """Run one write statement in its own transaction and return the cursor"""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        """Run one write statement for many rows in a single transaction"""
+        with self.transaction() as conn:
+            return conn.executemany(sql, rows)
+
+    def migrate(self):
+        """Bring the schema up to date by applying pending MIGRATIONS"""
+        conn = self.connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # executescript commits first, so user_version is bumped in the same script
+            conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+            logging.info(f"Applied database migration {number}")
+        logging.info("Database initialized")
+
+
+db = Database(DB_PATH)
+
+# Command history settings
+HISTORY_BATCH_SIZE = 100       # Records written per transaction
+HISTORY_FLUSH_INTERVAL = 2.0   # Seconds a record may wait in memory before being written
+HISTORY_MAX_BUFFER = 10000     # Oldest unwritten records are dropped beyond this
+HISTORY_RETENTION = 30 * 24 * 3600  # Seconds a record is kept before it is pruned
+HISTORY_PRUNE_INTERVAL = 3600.0     # Seconds between prunes of expired records
+HISTORY_DEFAULT_WINDOW = 24 * 3600  # Seconds of history /history covers when no 'since' is given
+
+class HistoryWriter:
+    """
+    Buffers command history records and writes them to SQLite in batches.
+
+    record() only appends to an in-memory buffer, so the command path never
+    waits on disk; a background thread flushes the buffer every
+    HISTORY_FLUSH_INTERVAL seconds or as soon as HISTORY_BATCH_SIZE records
+    are waiting. Every HISTORY_PRUNE_INTERVAL seconds the same thread deletes
+    records older than HISTORY_RETENTION, so the table stays bounded.
+    """
+
+    COLUMNS = ('ts', 'device', 'ip', 'action', 'source', 'attempts', 'latency_ms', 'success', 'error')
+
+    def __init__(self, database, batch_size=HISTORY_BATCH_SIZE, interval=HISTORY_FLUSH_INTERVAL,
+                 max_buffer=HISTORY_MAX_BUFFER, retention=HISTORY_RETENTION, prune_interval=HISTORY_PRUNE_INTERVAL):
+        self.db = database
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._buffer = collections.deque(maxlen=max_buffer)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def record(self, **fields):
+        """Queue one history record (keyword arguments named after COLUMNS)"""
+        self._buffer.append(tuple(fields.get(column) for column in self.COLUMNS))
+        if self._thread is None:
+            self._start()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to write command history: {e}")
+            if time.monotonic() - self._last_prune >= self.prune_interval:
+                self._last_prune = time.monotonic()
+                try:
+                    self.prune()
+                except sqlite3.Error as e:
+                    logging.error(f"Failed to prune command history: {e}")
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._flush_lock:
+            while self._buffer:
+                rows = []
+                while self._buffer and len(rows) < self.batch_size:
+                    rows.append(self._buffer.popleft())
+                placeholders = ', '.join('?' for _ in self.COLUMNS)
+                self.db.executemany(f"INSERT INTO command_history ({', '.join(self.COLUMNS)}) "
+                                    f"VALUES ({placeholders})", rows)
+
+    def prune(self):
+        """Delete records older than the retention period; returns how many were deleted"""
+        deleted = self.db.execute("DELETE FROM command_history WHERE ts < ?",
+                                  (time.time() - self.retention,)).rowcount
+        if deleted:
+            logging.info(f"Pruned {deleted} command history records older than {self.retention / 86400:g} days")
+        return deleted
+
+
+history = HistoryWriter(db)
+atexit.register(history.flush)
 
 # Initialize database on startup
-init_database()
-# Function to read config.txt and return a dictionary of lights
-def load_config():
-    config = {}
-    try:
-        with open('/home/jason/light-control/config.txt', 'r') as file:
+db.migrate()
+# In-process metrics exposed at /metrics in the Prometheus text format.
+# Label sets are resolved once and cached, so recording a sample is a lock
+# plus an integer/float increment with no allocation.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        """Return the child metric for these label values, creating it once"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def render(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{self._label_text(values)} {child.value}"
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def render(self):
+        for values, child in list(self._children.items()):
+            with child.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{self._label_text(values, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(values)} {total}"
+            yield f"{self.name}_count{self._label_text(values)} {count}"
+
+
+class Gauge(_Metric):
+    """Gauge whose values are read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        self.callback = callback
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        samples = self.callback() if self.callback else {}
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for values, value in samples.items():
+            yield f"{self.name}{self._label_text(values)} {value}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+COMMAND_DURATION = metrics.register(Histogram(
+    'light_command_duration_seconds', 'Time to send a command to a device, including retries',
+    labels=('device', 'kind', 'outcome')))
+COMMAND_RETRIES = metrics.register(Counter(
+    'light_command_retries_total', 'Command attempts that were retried', labels=('device',)))
+COMMAND_FAILURES = metrics.register(Counter(
+    'light_command_failures_total', 'Failed command attempts by failure type', labels=('device', 'reason')))
+FANOUT_DURATION = metrics.register(Histogram(
+    'light_fanout_duration_seconds', 'End-to-end duration of all-lights commands', labels=('action',)))
+SCHEDULER_LAG = metrics.register(Histogram(
+    'light_scheduler_lag_seconds', 'Actual minus planned fire time of scheduled actions',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)))
+metrics.register(Gauge('light_history_buffer_records', 'Command history records waiting to be written',
+                       callback=lambda: history.pending()))
+
+def failure_reason(error):
+    """Classify a failed attempt (an exception or an HTTP status code) for COMMAND_FAILURES"""
+    if isinstance(error, int):
+        return 'http_status'
+    if isinstance(error, (requests.Timeout, socket.timeout)):
+        return 'timeout'
+    if isinstance(error, (requests.ConnectionError, ConnectionError)):
+        return 'connection'
+    if isinstance(error, KasaProtocolError):
+        return 'protocol'
+    if isinstance(error, subprocess.CalledProcessError):
+        return 'cli'
+    if isinstance(error, OSError):
+        return 'connection'
+    return 'other'
+
+CONFIG_PATH = os.path.join(BASE_DIR, 'config.txt')
+
+class DeviceRegistry:
+    """
+    In-memory view of config.txt with O(1) lookups by IP and by name.
+
+    The file is parsed once and re-parsed only when its modification time
+    changes (checked at most every check_interval seconds) or when reload()
+    is called explicitly.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._last_check = 0.0
+        self._devices = {}
+        self._by_ip = {}
+        self._by_name = {}
+
+    def _parse(self):
+        config = {}
+        with open(self.path, 'r') as file:
             for line in file:
                 if '-' in line:
-                    light_name, ip_address = map(str.strip, line.split('-'))
+                    light_name, ip_address = map(str.strip, line.rsplit('-', 1))
                     try:
                         # Validate IP address
                         ip = str(ipaddress.ip_address(ip_address))
                         is_kasa = light_name.startswith('$')
-                        config[light_name] = {'ip': ip, 'is_kasa': is_kasa}
+                        config[light_name] = {'name': light_name, 'ip': ip, 'is_kasa': is_kasa}
                     except ValueError:
                         logging.error(f"Invalid IP address '{ip_address}' for light '{light_name}'.")
-    except FileNotFoundError:
-        logging.error("config.txt file not found.")
-    return config
+        return config
+
+    def _load(self, stamp):
+        try:
+            devices = self._parse()
+        except FileNotFoundError:
+            logging.error("config.txt file not found.")
+            devices = {}
+        by_ip = {}
+        by_name = {}
+        for name, info in devices.items():
+            by_ip.setdefault(info['ip'], info)
+            by_name[name] = info
+            by_name.setdefault(name.lstrip('$').lower(), info)
+        self._devices, self._by_ip, self._by_name = devices, by_ip, by_name
+        self._stamp = stamp
+        self.version += 1
+        logging.info(f"Loaded {len(devices)} devices from config.txt (version {self.version})")
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force=False):
+        """Re-parse config.txt if it changed since the last load (or unconditionally if force)"""
+        now = time.monotonic()
+        if not force and self.version and now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            stamp = self._file_stamp()
+            if force or not self.version or stamp != self._stamp:
+                self._load(stamp)
+
+    def reload(self):
+        """Force a re-parse of config.txt"""
+        self.refresh(force=True)
+        return self.version
+
+    def devices(self):
+        """Return a dictionary of light name to {'name', 'ip', 'is_kasa'}, in config order"""
+        self.refresh()
+        return dict(self._devices)
+
+    def get_by_ip(self, ip):
+        """Return the light with this IP, or None"""
+        self.refresh()
+        return self._by_ip.get(ip)
+
+    def get_by_name(self, name):
+        """Return the light with this name (exact, or case-insensitive without the $ prefix), or None"""
+        self.refresh()
+        return self._by_name.get(name) or self._by_name.get(name.lstrip('$').lower())
+
+
+registry = DeviceRegistry(CONFIG_PATH)
+
+# Function to return a dictionary of lights from config.txt
+def load_config():
+    return registry.devices()
+
+class KasaProtocolError(Exception):
+    """Raised when a Kasa plug answers with an error or an unreadable reply"""
+
+
+def kasa_encrypt(payload):
+    """Encrypt a Kasa request with the Smart Home autokey XOR cipher, length-prefixed"""
+    key = 171
+    encrypted = bytearray()
+    for byte in payload:
+        key ^= byte
+        encrypted.append(key)
+    return struct.pack('>I', len(payload)) + bytes(encrypted)
+
+
+def kasa_decrypt(data):
+    """Decrypt a Kasa reply body (without its length prefix)"""
+    key = 171
+    decrypted = bytearray()
+    for byte in data:
+        decrypted.append(key ^ byte)
+        key = byte
+    return bytes(decrypted)
+
+
+class KasaConnection:
+    """
+    Persistent TCP connection to one Kasa plug speaking the local Smart Home protocol.
+
+    The socket is opened on first use and kept open between commands. If a reused
+    socket turns out to be closed by the plug, the request is retried once on a
+    fresh connection before the error is raised.
+    """
+
+    def __init__(self, ip, port=KASA_PORT, timeout=KASA_TIMEOUT):
+        # Allow "host:port" so local stand-in devices can listen on any port
+        host, _, custom_port = ip.partition(':')
+        self.host = host
+        self.port = int(custom_port) if custom_port else port
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                raise ConnectionResetError("Kasa device closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def _exchange(self, request):
+        self._sock.sendall(request)
+        length, = struct.unpack('>I', self._recv_exactly(4))
+        return self._recv_exactly(length)
+
+    def query(self, payload):
+        """Send a request dictionary and return the decoded reply dictionary"""
+        request = kasa_encrypt(json.dumps(payload).encode('utf-8'))
+        with self._lock:
+            reused = self._sock is not None
+            try:
+                if not reused:
+                    self._connect()
+                reply = self._exchange(request)
+            except OSError:
+                self.close()
+                if not reused:
+                    raise
+                # The plug may have dropped an idle connection; try once more on a new one
+                try:
+                    self._connect()
+                    reply = self._exchange(request)
+                except OSError:
+                    self.close()
+                    raise
+        try:
+            return json.loads(kasa_decrypt(reply))
+        except ValueError as e:
+            raise KasaProtocolError(f"Unreadable reply from {self.host}: {e}")
+
+    def set_relay_state(self, on):
+        """Switch the plug's relay on or off"""
+        reply = self.query({'system': {'set_relay_state': {'state': 1 if on else 0}}})
+        err_code = reply.get('system', {}).get('set_relay_state', {}).get('err_code')
+        if err_code != 0:
+            raise KasaProtocolError(f"Kasa device {self.host} returned error code {err_code}")
+        return reply
+
+    def get_sysinfo(self):
+        """Return the plug's system information (includes relay_state)"""
+        reply = self.query({'system': {'get_sysinfo': {}}})
+        try:
+            return reply['system']['get_sysinfo']
+        except (KeyError, TypeError):
+            raise KasaProtocolError(f"Kasa device {self.host} returned no sysinfo")
+
+
+# One persistent connection per Kasa plug, created on first use
+_kasa_connections = {}
+_kasa_connections_lock = threading.Lock()
+
+def get_kasa_connection(ip):
+    """Return the persistent connection for a Kasa plug, creating it if needed"""
+    connection = _kasa_connections.get(ip)
+    if connection is None:
+        with _kasa_connections_lock:
+            connection = _kasa_connections.get(ip)
+            if connection is None:
+                connection = KasaConnection(ip)
+                _kasa_connections[ip] = connection
+    return connection
+
+
+def set_kasa_state(ip, action):
+    """Switch a Kasa plug on or off with the native driver, falling back to the kasa CLI"""
+    if KASA_BACKEND == 'native':
+        try:
+            get_kasa_connection(ip).set_relay_state(action == 'on')
+            return
+        except (OSError, KasaProtocolError) as e:
+            if not KASA_CLI_FALLBACK:
+                raise
+            logging.warning(f"Native Kasa command to {ip} failed ({e}); falling back to kasa CLI")
+    subprocess.run(["kasa", "--host", ip, action], check=True, env=env)
+
+
+def probe_device(ip, is_kasa):
+    """Cheap liveness check of a light (GET / or Kasa sysinfo); raises if it does not answer"""
+    if is_kasa:
+        get_kasa_connection(ip).get_sysinfo()
+        return
+    response = get_device_session(ip).get(device_url(ip, "/"), timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    response.raise_for_status()
+
+
+class CircuitBreakers:
+    """
+    Per-device circuit breakers.
+
+    A device's breaker opens after `threshold` consecutive failed attempts.
+    While it is open, commands to that device fail immediately instead of
+    waiting out connect timeouts and retries. A background thread probes
+    open devices (half-open) with probe_device(), doubling the wait while
+    they stay down, and closes the breaker as soon as one answers. A
+    successful command closes it as well.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, probe_interval=BREAKER_PROBE_INTERVAL,
+                 max_probe_interval=BREAKER_PROBE_MAX_INTERVAL, probe_workers=BREAKER_PROBE_WORKERS):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.probe_workers = probe_workers
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._devices = {}  # ip -> breaker entry, see _entry()
+        self._thread = None
+
+    def _entry(self, ip, is_kasa=False):
+        entry = self._devices.get(ip)
+        if entry is None:
+            entry = {'state': self.CLOSED, 'failures': 0, 'is_kasa': is_kasa, 'opened_at': None,
+                     'next_probe': None, 'interval': self.probe_interval, 'last_error': None}
+            self._devices[ip] = entry
+        return entry
+
+    def state(self, ip):
+        """'closed', 'open' or 'half_open'"""
+        with self._lock:
+            entry = self._devices.get(ip)
+            return entry['state'] if entry else self.CLOSED
+
+    def allow(self, ip):
+        """Whether commands may be sent to a device (its breaker is closed)"""
+        return self.state(ip) == self.CLOSED
+
+    def record_success(self, ip):
+        """Reset a device's failure count, closing its breaker"""
+        with self._lock:
+            entry = self._devices.get(ip)
+            if entry is None:
+                return
+            previous = entry['state']
+            entry.update(state=self.CLOSED, failures=0, opened_at=None, next_probe=None,
+                         interval=self.probe_interval, last_error=None)
+        if previous != self.CLOSED:
+            self._changed(ip, self.CLOSED, previous)
+
+    def record_failure(self, ip, is_kasa, error):
+        """Count a failed attempt; returns True if the device's breaker is (now) open"""
+        with self._lock:
+            entry = self._entry(ip, is_kasa)
+            entry['is_kasa'] = is_kasa
+            entry['failures'] += 1
+            entry['last_error'] = str(error)
+            if entry['state'] != self.CLOSED:
+                return True
+            if entry['failures'] < self.threshold:
+                return False
+            self._open(entry, time.time())
+            self._start()
+            self._wakeup.notify()
+        logging.warning(f"Circuit breaker for {ip} opened after {self.threshold} consecutive failures: {error}")
+        self._changed(ip, self.OPEN, self.CLOSED)
+        return True
+
+    def _open(self, entry, now):
+        entry['state'] = self.OPEN
+        entry['opened_at'] = entry['opened_at'] or now
+        # Spread probes of devices that failed together (e.g. a power cut) over half an interval
+        entry['next_probe'] = now + random.uniform(entry['interval'] / 2, entry['interval'])
+
+    def _changed(self, ip, state, previous):
+        light = registry.get_by_ip(ip)
+        events.publish('breaker', {'ip': ip, 'name': light['name'] if light else None,
+                                   'state': state, 'previous': previous})
+
+    def snapshot(self):
+        """Breaker state of every device that has failed since its last success"""
+        with self._lock:
+            return {ip: {
+                'state': entry['state'],
+                'failures': entry['failures'],
+                'last_error': entry['last_error'],
+                'opened_at': datetime.fromtimestamp(entry['opened_at']).isoformat(timespec='seconds')
+                             if entry['opened_at'] else None,
+                'next_probe_in': round(max(0.0, entry['next_probe'] - time.time()), 1)
+                                 if entry['state'] == self.OPEN else None
+            } for ip, entry in self._devices.items() if entry['failures']}
+
+    def open_count(self):
+        with self._lock:
+            return sum(1 for entry in self._devices.values() if entry['state'] != self.CLOSED)
+
+    def _start(self):
+        # Called with the lock held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='breaker-probe', daemon=True)
+            self._thread.start()
+
+    def _due(self):
+        """Wait until at least one open breaker is due for a probe and mark those half-open"""
+        with self._wakeup:
+            while True:
+                now = time.time()
+                due = [(ip, entry['is_kasa']) for ip, entry in self._devices.items()
+                       if entry['state'] == self.OPEN and entry['next_probe'] <= now]
+                if due:
+                    for ip, _ in due:
+                        self._devices[ip]['state'] = self.HALF_OPEN
+                    return due
+                waits = [entry['next_probe'] - now for entry in self._devices.values()
+                         if entry['state'] == self.OPEN]
+                self._wakeup.wait(min(waits) if waits else None)
+
+    def _probe(self, ip, is_kasa):
+        try:
+            probe_device(ip, is_kasa)
+        except Exception as e:
+            with self._lock:
+                entry = self._devices[ip]
+                if entry['state'] != self.HALF_OPEN:
+                    return  # A command succeeded meanwhile
+                entry['last_error'] = str(e)
+                entry['interval'] = min(self.max_probe_interval, entry['interval'] * 2)
+                self._open(entry, time.time())
+            logging.info(f"Probe of {ip} failed ({e}); next probe within {entry['interval']:.0f} s")
+            return
+        logging.info(f"Probe of {ip} succeeded; closing its circuit breaker")
+        self.record_success(ip)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.probe_workers, thread_name_prefix='breaker-probe') as executor:
+            while True:
+                due = self._due()
+                for future in [executor.submit(self._probe, ip, is_kasa) for ip, is_kasa in due]:
+                    future.result()
+
+
+# Response of commands refused because the device's breaker is open
+BREAKER_OPEN_MESSAGE = "Device unavailable (circuit breaker open)"
+
+breakers = CircuitBreakers()
+metrics.register(Gauge('light_breakers_open', 'Devices whose circuit breaker is open or half-open',
+                       callback=lambda: breakers.open_count()))
+
+
+class HealthProber:
+    """
+    Background reachability checks of every configured light.
+
+    Every `interval` seconds all devices are probed at once from one asyncio
+    loop (a bare GET / on servo lights, a sysinfo query on Kasa plugs), so a
+    round takes about one round-trip time, at most `timeout`, however large
+    the fleet. A device is marked offline after `offline_after` consecutive
+    failed probes and online again as soon as it answers.
+    """
+
+    def __init__(self, interval=HEALTH_INTERVAL, timeout=HEALTH_TIMEOUT, offline_after=HEALTH_OFFLINE_AFTER,
+                 concurrency=HEALTH_MAX_CONCURRENCY):
+        self.interval = interval
+        self.timeout = timeout
+        self.offline_after = offline_after
+        self.concurrency = concurrency
+        self.last_round_ms = None
+        self._lock = threading.Lock()
+        self._devices = {}  # ip -> {'online', 'last_seen', 'rtt_ms', 'checked_at', 'failures', 'error'}
+        self._thread = None
+
+    def get(self, ip):
+        """Health entry of a device, or None if it has not been probed yet"""
+        with self._lock:
+            entry = self._devices.get(ip)
+            return dict(entry) if entry else None
+
+    def is_offline(self, ip):
+        """Whether the last probes of a device failed (unprobed devices are not offline)"""
+        with self._lock:
+            entry = self._devices.get(ip)
+            return entry is not None and entry['online'] is False
+
+    def snapshot(self):
+        with self._lock:
+            return {ip: dict(entry) for ip, entry in self._devices.items()}
+
+    def online_count(self):
+        with self._lock:
+            return sum(1 for entry in self._devices.values() if entry['online'])
+
+    @staticmethod
+    def _address(ip, default_port):
+        host, _, port = ip.partition(':')
+        return host, int(port) if port else default_port
+
+    async def _probe_servo(self, ip):
+        reader, writer = await asyncio.open_connection(*self._address(ip, SERVO_PORT))
+        try:
+            writer.write(f"GET / HTTP/1.1\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit():
+            raise ValueError(f"Not an HTTP response: {status_line[:40]!r}")
+        if int(parts[1]) >= 500:
+            raise ValueError(f"HTTP {int(parts[1])}")
+
+    async def _probe_kasa(self, ip):
+        reader, writer = await asyncio.open_connection(*self._address(ip, KASA_PORT))
+        try:
+            writer.write(kasa_encrypt(json.dumps({'system': {'get_sysinfo': {}}}).encode()))
+            await writer.drain()
+            length = struct.unpack('>I', await reader.readexactly(4))[0]
+            reply = json.loads(kasa_decrypt(await reader.readexactly(length)))
+        finally:
+            writer.close()
+        if 'get_sysinfo' not in reply.get('system', {}):
+            raise KasaProtocolError(f"Kasa device {ip} returned no sysinfo")
+
+    async def _probe(self, semaphore, ip, is_kasa):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._probe_kasa(ip) if is_kasa else self._probe_servo(ip), self.timeout)
+            except asyncio.TimeoutError:
+                return ip, None, 'timeout'
+            except (OSError, asyncio.IncompleteReadError, ValueError, KasaProtocolError) as e:
+                return ip, None, str(e) or type(e).__name__
+            return ip, (time.perf_counter() - start) * 1000, None
+
+    async def _probe_devices(self, devices):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._probe(semaphore, info['ip'], info['is_kasa'])
+                                      for info in devices.values()))
+
+    def probe_all(self):
+        """Probe every configured device once and update the online map"""
+        devices = registry.devices()
+        start = time.perf_counter()
+        results = asyncio.run(self._probe_devices(devices)) if devices else []
+        self.last_round_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        now = time.time()
+        changes = []
+        recovered = []
+        with self._lock:
+            configured = {info['ip'] for info in devices.values()}
+            for ip in set(self._devices) - configured:
+                del self._devices[ip]
+            for ip, rtt_ms, error in results:
+                entry = self._devices.setdefault(ip, {'online': None, 'last_seen': None, 'rtt_ms': None,
+                                                      'checked_at': None, 'failures': 0, 'error': None})
+                entry['checked_at'] = now
+                if error is None:
+                    entry.update(last_seen=now, rtt_ms=round(rtt_ms, 1), failures=0, error=None)
+                    online = True
+                    recovered.append(ip)
+                else:
+                    entry['failures'] += 1
+                    entry['error'] = error
+                    online = False if entry['failures'] >= self.offline_after else entry['online']
+                if online != entry['online']:
+                    # Devices seen for the first time only make news if they are down
+                    if entry['online'] is not None or not online:
+                        changes.append((ip, online, entry['online']))
+                    entry['online'] = online
+
+        for ip in recovered:
+            if not breakers.allow(ip):
+                logging.info(f"Health probe reached {ip}; closing its circuit breaker")
+                breakers.record_success(ip)
+        for ip, online, previous in changes:
+            light = registry.get_by_ip(ip)
+            logging.info(f"Light {ip} is now {'online' if online else 'offline'}")
+            events.publish('health', {'ip': ip, 'name': light['name'] if light else None,
+                                      'online': online, 'previous': previous})
+        return results
+
+    def start(self):
+        """Probe the fleet every `interval` seconds on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            start = time.monotonic()
+            try:
+                self.probe_all()
+            except Exception as e:
+                logging.error(f"Health probe round failed: {e}")
+            time.sleep(max(0.0, self.interval - (time.monotonic() - start)))
 
-# Function to send Kasa on/off commands using subprocess
+
+health = HealthProber()
+metrics.register(Gauge('light_devices_online', 'Lights that answered their last health probe',
+                       callback=lambda: health.online_count()))
+
+
+# Function to send Kasa on/off commands
 def send_kasa_command(ip, action, max_retries=3, retry_delay=1):
     """
     Send command to a Kasa device with retry functionality.
@@ -73,35 +1169,383 @@ def send_kasa_command(ip, action, max_retries=3, retry_delay=1):
         ip: IP address of the Kasa device
         action: Action to perform ("on" or "off")
         max_retries: Maximum number of retry attempts (default: 3)
-        retry_delay: Delay between retries in seconds (default: 1)
+        retry_delay: Base delay between retries in seconds, doubled on each retry and jittered (default: 1)
     
     Returns:
         Tuple of (success, response)
     """
+    success, response, _ = _send_kasa_command(ip, action, max_retries, retry_delay)
+    return success, response
+
+def _send_kasa_command(ip, action, max_retries, retry_delay):
+    """send_kasa_command, also returning the number of attempts made"""
+    if not breakers.allow(ip):
+        COMMAND_FAILURES.labels(ip, 'circuit_open').inc()
+        return False, BREAKER_OPEN_MESSAGE, 0
     retries = 0
     while retries <= max_retries:
         try:
             logging.info(f"Sending '{action}' command to Kasa device at {ip} (attempt {retries+1}/{max_retries+1})")
-            subprocess.run(["kasa", "--host", ip, action], check=True, env=env)
+            set_kasa_state(ip, action)
             logging.info(f"Successfully sent '{action}' command to {ip}")
-            if action == 'off' and (ip == '10.0.0.132' or ip == "10.0.0.218"):
+            if action == 'off' and ip in KASA_POWER_CYCLE_IPS:
                 time.sleep(2)
-                subprocess.run(["kasa", "--host", ip, "on"], check=True, env=env)
-            return True, f"Kasa device {action} successfully"
-        except subprocess.CalledProcessError as e:
-            if retries < max_retries:
+                set_kasa_state(ip, "on")
+            breakers.record_success(ip)
+            return True, f"Kasa device {action} successfully", retries + 1
+        except (subprocess.CalledProcessError, OSError, KasaProtocolError) as e:
+            COMMAND_FAILURES.labels(ip, failure_reason(e)).inc()
+            tripped = breakers.record_failure(ip, True, e)
+            if retries < max_retries and not tripped:
                 logging.warning(f"Failed to send '{action}' command to Kasa device at {ip}: {e}. Retry {retries+1}/{max_retries}")
+                COMMAND_RETRIES.labels(ip).inc()
+                time.sleep(backoff_delay(retries, retry_delay))
                 retries += 1
-                time.sleep(retry_delay)
             else:
-                logging.error(f"Failed to send '{action}' command to Kasa device at {ip} after {max_retries} retries: {e}")
-                return False, str(e)
+                logging.error(f"Failed to send '{action}' command to Kasa device at {ip} after {retries} retries: {e}")
+                return False, str(e), retries + 1
     
     # This line should not be reached, but just in case
-    return False, "Maximum retries exceeded"
+    return False, "Maximum retries exceeded", retries
+
+class EventBroker:
+    """
+    Publishes server events to Server-Sent Events clients.
+
+    All /events clients are served by one asyncio loop on its own thread and
+    port, so an idle stream costs a socket and a small queue rather than a
+    web server worker thread. publish() may be called from any thread.
+
+    The page reaches the stream on another port, which makes it a cross-origin
+    request: only pages from the stream's own host (or EVENTS_ALLOWED_ORIGINS)
+    get their Origin echoed back, and other origins are refused.
+    """
+
+    def __init__(self, history=EVENTS_HISTORY, heartbeat=EVENTS_HEARTBEAT, backlog=EVENTS_CLIENT_BACKLOG):
+        self.heartbeat = heartbeat
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._history = collections.deque(maxlen=history)
+        self._next_id = 1
+        self._clients = set()
+        self._loop = None
+
+    def publish(self, event_type, data):
+        """Send an event to every connected client"""
+        with self._lock:
+            event = (self._next_id, event_type, json.dumps(data, default=str))
+            self._next_id += 1
+            self._history.append(event)
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def client_count(self):
+        return len(self._clients)
+
+    def _deliver(self, event):
+        for queue in list(self._clients):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A client this far behind is gone or stuck; drop it and let it reconnect
+                self._clients.discard(queue)
+                queue.overflowed = True
+
+    @staticmethod
+    def origin_allowed(origin, host):
+        """True if a page from origin may read the stream reached at host (the Host header)"""
+        if origin.rstrip('/') in EVENTS_ALLOWED_ORIGINS:
+            return True
+        parsed = urlsplit(origin)
+        return parsed.scheme in ('http', 'https') and bool(parsed.hostname) and \
+            parsed.hostname == urlsplit(f"//{host}").hostname
+
+    @staticmethod
+    def _format(event):
+        event_id, event_type, data = event
+        return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n".encode('utf-8')
+
+    async def _handle_client(self, reader, writer):
+        queue = None
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET' or parts[1].split('?')[0] != '/events':
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                return
+
+            # Same-origin requests (through a reverse proxy) and non-browser clients send no Origin
+            origin = headers.get('origin')
+            cors = b''
+            if origin:
+                if not self.origin_allowed(origin, headers.get('host', '')):
+                    writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    await writer.drain()
+                    return
+                cors = f"Access-Control-Allow-Origin: {origin}\r\nVary: Origin\r\n".encode('latin-1')
+
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\n" + cors + b"\r\n"
+                         b"retry: 3000\n\n")
+            queue = asyncio.Queue(maxsize=self.backlog)
+            queue.overflowed = False
+            with self._lock:
+                try:
+                    last_id = int(headers.get('last-event-id', ''))
+                except ValueError:
+                    last_id = None
+                replay = [event for event in self._history if last_id is not None and event[0] > last_id]
+                self._clients.add(queue)
+            for event in replay:
+                writer.write(self._format(event))
+            await writer.drain()
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    if queue.overflowed:
+                        break
+                    writer.write(self._format(event))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if queue is not None:
+                self._clients.discard(queue)
+            writer.close()
+
+    def start(self, host=SERVER_HOST, port=EVENTS_PORT):
+        """Start serving /events on a background thread, on the same address as the web server"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            server = loop.run_until_complete(asyncio.start_server(self._handle_client, host, port))
+            with self._lock:
+                self._loop = loop
+            ready.set()
+            logging.info(f"Event stream listening on {host}:{port}")
+            try:
+                loop.run_until_complete(server.serve_forever())
+            finally:
+                with self._lock:
+                    self._loop = None
+
+        threading.Thread(target=run, name='events', daemon=True).start()
+        ready.wait(5)
+
+
+events = EventBroker()
+metrics.register(Gauge('light_event_stream_clients', 'Connected /events clients',
+                       callback=lambda: events.client_count()))
+
+# Commands understood by send_command and the states they leave a light in
+COMMAND_ON = "0"
+COMMAND_OFF = "180"
+COMMAND_STATES = {COMMAND_ON: 'on', COMMAND_OFF: 'off'}
+# Commands for the ON/OFF actions used by schedules, scenes and /batch
+ACTION_COMMANDS = {'ON': COMMAND_ON, 'OFF': COMMAND_OFF}
+
+# Where a command came from, as recorded in the command history
+COMMAND_SOURCES = ('web', 'schedule', 'voice', 'api')
+
+# Only trust a recorded state for skipping commands if it was confirmed this recently. Lights also
+# change state outside the server (the firmware's button, the physical rocker), so keep this short
+STATE_TRUST_SECONDS = 300
+
+class DeviceStateShadow:
+    """
+    Last confirmed on/off state of each light, keyed by IP.
+
+    A state is recorded when a command succeeds and forgotten when one fails,
+    since a failed servo command may or may not have actuated the switch.
+    """
+
+    def __init__(self, trust_seconds=STATE_TRUST_SECONDS):
+        self.trust_seconds = trust_seconds
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def record(self, ip, state):
+        """Record a confirmed state and return the previously known one (or None)"""
+        with self._lock:
+            previous = self._states.get(ip)
+            self._states[ip] = {'state': state, 'updated_at': time.time()}
+        return previous['state'] if previous else None
+
+    def forget(self, ip):
+        """Mark a light's state as unknown and return the previously known one (or None)"""
+        with self._lock:
+            previous = self._states.pop(ip, None)
+        return previous['state'] if previous else None
+
+    def get(self, ip):
+        """Return {'state', 'updated_at'} for a light, or None if its state is unknown"""
+        with self._lock:
+            entry = self._states.get(ip)
+            return dict(entry) if entry else None
+
+    def is_in_state(self, ip, state):
+        """Whether a light was recently confirmed to be in the given state"""
+        entry = self.get(ip)
+        if entry is None or entry['state'] != state:
+            return False
+        return self.trust_seconds is None or time.time() - entry['updated_at'] <= self.trust_seconds
+
+
+state_shadow = DeviceStateShadow()
+
+def _execute_command(ip, command, is_kasa, max_retries, retry_delay, source='web'):
+    """Send a command to a light, record the resulting state and log it to the command history"""
+    start = time.perf_counter()
+    success, response, attempts = _send_device_command(ip, command, is_kasa, max_retries, retry_delay)
+    elapsed = time.perf_counter() - start
+    latency_ms = elapsed * 1000
+    COMMAND_DURATION.labels(ip, 'kasa' if is_kasa else 'servo', 'success' if success else 'failure').observe(elapsed)
+    light = registry.get_by_ip(ip)
+    history.record(ts=time.time(), device=light['name'] if light else None, ip=ip,
+                   action=COMMAND_STATES.get(command, command), source=source, attempts=attempts,
+                   latency_ms=round(latency_ms, 1), success=1 if success else 0,
+                   error=None if success else str(response))
+    if success:
+        state = COMMAND_STATES.get(command)
+        if is_kasa and command == COMMAND_OFF and ip in KASA_POWER_CYCLE_IPS:
+            state = 'on'  # Power-cycled plugs end up switched back on
+        previous = state_shadow.record(ip, state) if state else None
+    else:
+        state = None
+        previous = state_shadow.forget(ip)
+    if state != previous:
+        events.publish('state', {'ip': ip, 'name': light['name'] if light else None,
+                                 'state': state, 'previous': previous})
+    return success, response
+
+
+class _DeviceLane:
+    """Pending work for one light: at most one command waiting behind the one in flight"""
+
+    def __init__(self, lock):
+        self.pending = None   # (command, is_kasa, max_retries, retry_delay, source, future)
+        self.busy = False
+        self.changed = threading.Condition(lock)  # Notified when the command in flight finishes
+        self.submitted = 0
+        self.executed = 0
+        self.coalesced = 0
+
+
+class DeviceCommandQueue:
+    """
+    Serializes commands per light and coalesces the ones that pile up.
+
+    Commands to the same light never interleave. While a command is in
+    flight only the latest desired command is kept waiting: an identical
+    command shares the waiting command's result, and a different one
+    supersedes it. Superseded callers are answered straight away with
+    (False, SUPERSEDED), as nothing was sent for them.
+
+    There are no worker threads: a caller runs its own command on its own
+    thread once the light is free, so a command in flight costs exactly
+    the one (pool) thread that sent it.
+    """
+
+    SUPERSEDED = "Superseded by a later command"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lanes = {}
+
+    def send(self, ip, command, is_kasa=False, max_retries=3, retry_delay=1, source='web'):
+        """Send a command to a light once the light is free and return (success, response)"""
+        with self._lock:
+            lane = self._lanes.get(ip)
+            if lane is None:
+                lane = self._lanes[ip] = _DeviceLane(self._lock)
+            lane.submitted += 1
+            future = None
+            if lane.pending is not None:
+                lane.coalesced += 1
+                pending_command, _, _, _, _, pending_future = lane.pending
+                if pending_command == command:
+                    future = pending_future
+                else:
+                    logging.info(f"Dropped command '{pending_command}' for {ip}, superseded by '{command}'")
+                    pending_future.set_result((False, self.SUPERSEDED))
+                    lane.changed.notify_all()
+            if future is None:
+                future = Future()
+                lane.pending = (command, is_kasa, max_retries, retry_delay, source, future)
+
+            # Until the result is in: whoever finds the light free runs the pending command,
+            # which is this caller's own (or an identical one it shares)
+            while not future.done():
+                if lane.busy or lane.pending is None:
+                    lane.changed.wait()
+                    continue
+                command, is_kasa, max_retries, retry_delay, source, running = lane.pending
+                lane.pending = None
+                lane.busy = True
+                self._lock.release()
+                try:
+                    result = _execute_command(ip, command, is_kasa, max_retries, retry_delay, source)
+                except Exception as e:
+                    logging.error(f"Unexpected error sending command '{command}' to {ip}: {e}")
+                    result = (False, str(e))
+                finally:
+                    self._lock.acquire()
+                lane.busy = False
+                lane.executed += 1
+                running.set_result(result)
+                lane.changed.notify_all()
+            return future.result()
+
+    def stats(self):
+        """Per-light counters: submitted, executed, coalesced, plus current pending/busy flags"""
+        with self._lock:
+            return {ip: {'submitted': lane.submitted, 'executed': lane.executed, 'coalesced': lane.coalesced,
+                         'pending': 1 if lane.pending is not None else 0, 'busy': lane.busy}
+                    for ip, lane in self._lanes.items()}
+
+
+command_queue = DeviceCommandQueue()
+metrics.register(Gauge('light_command_queue_depth', 'Commands queued or in flight per device', labels=('device',),
+                       callback=lambda: {(ip,): lane['pending'] + lane['busy']
+                                         for ip, lane in command_queue.stats().items()}))
+
+def send_command(ip, command, is_kasa=False, max_retries=3, retry_delay=1, source='web'):
+    """
+    Send command to a light through its command queue and wait for the outcome.
+
+    Args:
+        ip: IP address of the light
+        command: Command to send ("0" for on, "180" for off)
+        is_kasa: Whether this is a Kasa device
+        max_retries: Maximum number of retry attempts (default: 3)
+        retry_delay: Base delay between retries in seconds, doubled on each retry and jittered (default: 1)
+        source: Where the command came from, one of COMMAND_SOURCES (default: 'web')
+
+    Returns:
+        Tuple of (success, response); (False, DeviceCommandQueue.SUPERSEDED) if a later
+        command to the same light replaced this one before it was sent
+    """
+    return command_queue.send(ip, command, is_kasa, max_retries, retry_delay, source)
 
 # Telnet command function
-def send_command(ip, command, is_kasa=False, max_retries=3, retry_delay=1):
+def _send_device_command(ip, command, is_kasa=False, max_retries=3, retry_delay=1):
     """
     Send command to a light with retry functionality.
     
@@ -110,96 +1554,452 @@ def send_command(ip, command, is_kasa=False, max_retries=3, retry_delay=1):
         command: Command to send ("0" for on, "180" for off)
         is_kasa: Whether this is a Kasa device
         max_retries: Maximum number of retry attempts (default: 3)
-        retry_delay: Delay between retries in seconds (default: 1)
+        retry_delay: Base delay between retries in seconds, doubled on each retry and jittered (default: 1)
     
     Returns:
-        Tuple of (success, response)
+        Tuple of (success, response, attempts)
     """
     if is_kasa:
         logging.info(f"Sending Kasa command '{command}' to {ip}")
-        action = "on" if command == "0" else "off"
-        return send_kasa_command(ip, action)  # Send Kasa-specific on/off command
+        action = "on" if command == COMMAND_ON else "off"
+        return _send_kasa_command(ip, action, max_retries, retry_delay)  # Send Kasa-specific on/off command
     
     # For regular lights, implement retry logic
+    if not breakers.allow(ip):
+        COMMAND_FAILURES.labels(ip, 'circuit_open').inc()
+        return False, BREAKER_OPEN_MESSAGE, 0
     retries = 0
     while retries <= max_retries:
         try:
-            url = f"http://{ip}/servo"
-            response = requests.post(url, data={"position": command})
+            url = device_url(ip, "/servo")
+            response = get_device_session(ip).post(url, data={"position": command},
+                                                   timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
             if response.status_code == 200:
                 logging.info(f"Sent command '{command}' to {ip}; Response: {response.json()}")
-                return True, response.json()
+                breakers.record_success(ip)
+                return True, response.json(), retries + 1
             else:
-                if retries < max_retries:
+                COMMAND_FAILURES.labels(ip, failure_reason(response.status_code)).inc()
+                tripped = breakers.record_failure(ip, False, f"HTTP {response.status_code}")
+                if retries < max_retries and not tripped:
                     logging.warning(f"Error sending command to {ip}: {response.status_code}, {response.text}. Retry {retries+1}/{max_retries}")
+                    COMMAND_RETRIES.labels(ip).inc()
+                    time.sleep(backoff_delay(retries, retry_delay))
                     retries += 1
-                    time.sleep(retry_delay)
                 else:
-                    logging.error(f"Error sending command to {ip} after {max_retries} retries: {response.status_code}, {response.text}")
-                    return False, response.text
+                    logging.error(f"Error sending command to {ip} after {retries} retries: {response.status_code}, {response.text}")
+                    return False, response.text, retries + 1
         except Exception as e:
-            if retries < max_retries:
+            COMMAND_FAILURES.labels(ip, failure_reason(e)).inc()
+            tripped = breakers.record_failure(ip, False, e)
+            if retries < max_retries and not tripped:
                 logging.warning(f"Error sending command to {ip}: {e}. Retry {retries+1}/{max_retries}")
+                COMMAND_RETRIES.labels(ip).inc()
+                time.sleep(backoff_delay(retries, retry_delay))
                 retries += 1
-                time.sleep(retry_delay)
             else:
-                logging.error(f"Error sending command to {ip} after {max_retries} retries: {e}")
-                return False, str(e)
+                logging.error(f"Error sending command to {ip} after {retries} retries: {e}")
+                return False, str(e), retries + 1
     
     # This line should not be reached, but just in case
-    return False, "Maximum retries exceeded"
+    return False, "Maximum retries exceeded", retries
 
 # Telnet command function for all lights
-def send_command_to_all(command):
-    lights = load_config()
+def send_command_to_all(command, max_workers=None, stagger=None, skip_unchanged=False, on_result=None,
+                        source='web'):
+    """
+    Send a command to every configured light concurrently.
+
+    Args:
+        command: Command to send ("0" for on, "180" for off)
+        max_workers: Maximum number of lights commanded at once (default: FANOUT_MAX_WORKERS)
+        stagger: Delay in seconds between dispatching each light (default: FANOUT_STAGGER)
+        skip_unchanged: Skip lights the state shadow recently saw in the target state (default: False)
+        on_result: Optional callback(name, result) invoked as soon as each light finishes
+        source: Where the command came from, one of COMMAND_SOURCES (default: 'web')
+
+    Returns:
+        Dictionary of light name to {'ip', 'success', 'response', 'duration_ms', 'started_ms'}, in config order.
+        Lights that were skipped also carry 'skipped': True. Lights the health prober reports
+        offline are commanded last, or skipped as failed if HEALTH_SKIP_OFFLINE is set.
+    """
+    lights = registry.devices()
+    if not lights:
+        return {}
+    names = list(lights)
+    fanout_start = time.perf_counter()
+    try:
+        results = run_batch([(lights[name], command) for name in names], max_workers, stagger, skip_unchanged,
+                            (lambda index, result: on_result(names[index], result)) if on_result else None, source)
+        return dict(zip(names, results))
+    finally:
+        FANOUT_DURATION.labels(COMMAND_STATES.get(command, command)).observe(time.perf_counter() - fanout_start)
+
+def send_commands(commands, max_workers=None, skip_unchanged=False, on_result=None, source='web', label='batch'):
+    """
+    Send a command to each of a set of lights as one concurrent batch (groups and scenes).
+
+    Args:
+        commands: Dictionary of light IP to command ("0" for on, "180" for off)
+        max_workers: Maximum number of lights commanded at once (default: FANOUT_MAX_WORKERS)
+        skip_unchanged: Skip lights the state shadow recently saw in the target state (default: False)
+        on_result: Optional callback(name, result) invoked as soon as each light finishes
+        source: Where the command came from, one of COMMAND_SOURCES (default: 'web')
+        label: Action label for the FANOUT_DURATION metric (default: 'batch')
+
+    Returns:
+        Dictionary of light name to result, as for send_command_to_all. IPs that are no longer
+        configured are reported as failed under the IP itself.
+    """
+    entries = []
     results = {}
-    for name, info in lights.items():
-        success, response = send_command(info['ip'], command, info['is_kasa'])
-        time.sleep(0.5)
-        results[name] = {'ip': info['ip'], 'success': success, 'response': response}
+    for ip, command in commands.items():
+        light = registry.get_by_ip(ip)
+        if light is None:
+            results[ip] = {'ip': ip, 'success': False, 'response': "Unknown device", 'duration_ms': 0.0}
+            if on_result:
+                on_result(ip, results[ip])
+            continue
+        entries.append((light, command))
+    if not entries:
+        return results
+    fanout_start = time.perf_counter()
+    try:
+        batch_results = run_batch(entries, max_workers, None, skip_unchanged,
+                                  (lambda index, result: on_result(entries[index][0]['name'], result))
+                                  if on_result else None, source)
+        results.update((light['name'], result) for (light, _), result in zip(entries, batch_results))
+        return results
+    finally:
+        FANOUT_DURATION.labels(label).observe(time.perf_counter() - fanout_start)
+
+def run_batch(entries, max_workers=None, stagger=None, skip_unchanged=False, on_result=None, source='web'):
+    """
+    Run a list of light commands concurrently across lights and in order for each light.
+
+    This is the engine behind all-lights commands, groups, scenes, schedules and /batch.
+    Entries for different lights run in parallel; entries for the same light run one
+    after another in the order given, each waiting for the previous one to finish.
+
+    Args:
+        entries: List of (light, command) pairs, light being a registry entry ({'name', 'ip', 'is_kasa'})
+        max_workers: Maximum number of lights commanded at once (default: FANOUT_MAX_WORKERS)
+        stagger: Delay in seconds between starting each light (default: FANOUT_STAGGER)
+        skip_unchanged: Skip commands the state shadow recently saw in effect (default: False)
+        on_result: Optional callback(index, result) invoked as soon as each entry finishes
+        source: Where the commands came from, one of COMMAND_SOURCES (default: 'web')
+
+    Returns:
+        List of {'ip', 'success', 'response', 'duration_ms', 'started_ms'} in entry order, where
+        started_ms is the offset from the start of the batch. Entries that were not sent (already
+        in the target state with skip_unchanged, or offline with HEALTH_SKIP_OFFLINE) also carry
+        'skipped': True; entries replaced by a later command to the same light before they were
+        sent carry 'skipped': True and 'superseded': True, with success False.
+    """
+    if max_workers is None:
+        max_workers = FANOUT_MAX_WORKERS
+    if stagger is None:
+        stagger = FANOUT_STAGGER
+    if not entries:
+        return []
+
+    lanes = {}
+    for index, (light, _) in enumerate(entries):
+        lanes.setdefault(light['ip'], []).append(index)
+    results = [None] * len(entries)
+    batch_start = time.perf_counter()
+
+    def run_lane(indexes):
+        for index in indexes:
+            light, command = entries[index]
+            target_state = COMMAND_STATES.get(command)
+            start = time.perf_counter()
+            result = {'ip': light['ip']}
+            if skip_unchanged and target_state and state_shadow.is_in_state(light['ip'], target_state):
+                result.update(success=True, response=f"Already {target_state}", duration_ms=0.0, skipped=True)
+            elif HEALTH_SKIP_OFFLINE and health.is_offline(light['ip']):
+                result.update(success=False, response="Device offline", duration_ms=0.0, skipped=True)
+            else:
+                try:
+                    success, response = send_command(light['ip'], command, light['is_kasa'], source=source)
+                except Exception as e:
+                    logging.error(f"Unexpected error sending command to {light['name']} ({light['ip']}): {e}")
+                    success, response = False, str(e)
+                result.update(success=success, response=response,
+                              duration_ms=round((time.perf_counter() - start) * 1000, 1))
+                if not success and response == DeviceCommandQueue.SUPERSEDED:
+                    result.update(skipped=True, superseded=True)
+            result['started_ms'] = round((start - batch_start) * 1000, 1)
+            results[index] = result
+            if on_result:
+                on_result(index, result)
+
+    # Lights that failed their health probes go last, so they do not hold up the ones that answer
+    ordered = sorted(lanes.items(), key=lambda lane: health.is_offline(lane[0]))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ordered))),
+                            thread_name_prefix='fanout') as executor:
+        futures = []
+        for position, (_, indexes) in enumerate(ordered):
+            if stagger and position:
+                time.sleep(stagger)
+            futures.append(executor.submit(run_lane, indexes))
+        for future in futures:
+            future.result()
+
+    skipped = sum(1 for result in results if result.get('skipped'))
+    if skipped:
+        logging.info(f"Skipped {skipped} of {len(entries)} commands already in effect, superseded or to offline lights")
     return results
 
+class Job:
+    """A light command running in the background, with per-light progress and timings"""
+
+    def __init__(self, kind, lights):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.success = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._devices = {name: {'ip': info['ip'], 'status': 'pending'} for name, info in lights.items()}
+
+    def start(self):
+        with self._lock:
+            self.status = 'running'
+            self.started_at = time.time()
+        self._publish()
+
+    def device_finished(self, name, result):
+        with self._lock:
+            entry = self._devices.setdefault(name, {'ip': result.get('ip')})
+            entry.update(result)
+            entry['status'] = 'done'
+        self._publish(device=name, success=result.get('success'), duration_ms=result.get('duration_ms'))
+
+    def finish(self, success, error=None):
+        with self._lock:
+            self.status = 'done' if success else 'failed'
+            self.success = success
+            self.error = error
+            self.finished_at = time.time()
+        self._publish(success=success, error=error)
+
+    def _publish(self, **extra):
+        with self._lock:
+            completed = sum(1 for entry in self._devices.values() if entry['status'] == 'done')
+            data = {'id': self.id, 'kind': self.kind, 'status': self.status,
+                    'progress': {'completed': completed, 'total': len(self._devices)}}
+        data.update(extra)
+        events.publish('job', data)
+
+    def to_dict(self):
+        with self._lock:
+            devices = {name: dict(entry) for name, entry in self._devices.items()}
+            completed = sum(1 for entry in devices.values() if entry['status'] == 'done')
+            end = self.finished_at or time.time()
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'success': self.success,
+                'error': self.error,
+                'created_at': datetime.fromtimestamp(self.created_at).isoformat(timespec='milliseconds'),
+                'duration_ms': round((end - self.started_at) * 1000, 1) if self.started_at else None,
+                'progress': {'completed': completed, 'total': len(devices)},
+                'devices': devices
+            }
+
+
+class JobManager:
+    """Runs jobs on a small thread pool and remembers the most recent ones"""
+
+    def __init__(self, max_workers=JOB_MAX_WORKERS, history=JOB_HISTORY):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def start(self, kind, lights, work):
+        """
+        Queue work(job) in the background and return the Job right away.
+
+        work must return (success, error) once every light has been handled.
+        """
+        job = Job(kind, lights)
+        with self._lock:
+            self._jobs[job.id] = job
+            # Dicts keep insertion order, so the oldest jobs come first
+            while len(self._jobs) > self.history:
+                del self._jobs[next(iter(self._jobs))]
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        job.start()
+        try:
+            success, error = work(job)
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.kind}) crashed: {e}")
+            success, error = False, str(e)
+        job.finish(success, error)
+        logging.info(f"Job {job.id} ({job.kind}) finished: {'success' if success else error}")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def recent(self, limit=20):
+        with self._lock:
+            return list(self._jobs.values())[-limit:][::-1]
+
+    def active(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+
+
+job_manager = JobManager()
+metrics.register(Gauge('light_jobs_active', 'Background jobs queued or running',
+                       callback=lambda: job_manager.active()))
+
+def job_accepted(job):
+    """202 response pointing the caller at the job's status URL"""
+    url = f"/jobs/{job.id}"
+    response = jsonify({'success': True, 'job_id': job.id, 'status': job.status, 'url': url})
+    response.status_code = 202
+    response.headers['Location'] = url
+    return response
+
+def fanout_error(results, verb):
+    """Summarize a fan-out: (all_success, error message naming the failed lights)"""
+    failed_lights = [name for name, result in results.items() if not result['success']]
+    if not failed_lights:
+        return True, None
+    return False, f"Failed to {verb}: {', '.join(failed_lights)}"
+
+def start_light_job(light, command, source='web'):
+    """Run a single-light command as a background job"""
+    def work(job):
+        start = time.perf_counter()
+        success, response = send_command(light['ip'], command, light['is_kasa'], source=source)
+        job.device_finished(light['name'], {'ip': light['ip'], 'success': success, 'response': response,
+                                            'duration_ms': round((time.perf_counter() - start) * 1000, 1)})
+        return success, None if success else response
+    kind = 'on' if command == COMMAND_ON else 'off'
+    return job_manager.start(kind, {light['name']: light}, work)
+
+def start_fanout_job(command, skip_unchanged=False, source='web'):
+    """Run an all-lights command as a background job"""
+    verb = 'on' if command == COMMAND_ON else 'off'
+    def work(job):
+        results = send_command_to_all(command, skip_unchanged=skip_unchanged, on_result=job.device_finished,
+                                      source=source)
+        return fanout_error(results, f"turn {verb}")
+    return job_manager.start(f"{verb}_all", registry.devices(), work)
+
+def start_batch_job(kind, commands, verb, skip_unchanged=False, source='web'):
+    """Run a send_commands() batch (a group or scene) as a background job"""
+    def work(job):
+        results = send_commands(commands, skip_unchanged=skip_unchanged, on_result=job.device_finished,
+                                source=source, label=kind)
+        return fanout_error(results, verb)
+    lights = {}
+    for ip in commands:
+        light = registry.get_by_ip(ip)
+        lights[light['name'] if light else ip] = light or {'ip': ip}
+    return job_manager.start(kind, lights, work)
+
+def request_flag(name):
+    """Read a boolean option from the query string or JSON body of the current request"""
+    value = request.args.get(name)
+    if value is None:
+        data = request.get_json(silent=True) or {}
+        value = data.get(name) if isinstance(data, dict) else None
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+def request_source():
+    """Command source named by the caller (?source=voice or {"source": "voice"}), defaulting to 'web'"""
+    value = request.args.get('source')
+    if value is None:
+        data = request.get_json(silent=True)
+        value = data.get('source') if isinstance(data, dict) else None
+    return value if value in COMMAND_SOURCES else 'web'
+
+# Pages and JSON built from config.txt, cached per registry version: name -> (version, body, etag)
+_rendered = {}
+_rendered_lock = threading.Lock()
+
+def render_cached(name, build):
+    """
+    Return (body, strong ETag) of a page that only depends on config.txt.
+
+    build() runs once per registry version; later requests get the cached
+    bytes until config.txt changes. The ETag is a hash of the body, so it is
+    the same in every server worker.
+    """
+    registry.refresh()
+    version = registry.version
+    cached = _rendered.get(name)
+    if cached is None or cached[0] != version:
+        body = build()
+        body = body.encode() if isinstance(body, str) else body
+        cached = (version, body, hashlib.sha1(body).hexdigest())
+        with _rendered_lock:
+            _rendered[name] = cached
+    return cached[1], cached[2]
+
+def conditional_response(body, etag, mimetype):
+    """Response carrying a strong ETag, or 304 Not Modified if the client already has it"""
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def device_list():
+    """Configured lights, in config order, as shown by the page and /devices"""
+    return [{'name': name, 'display_name': name.lstrip('$'), 'ip': info['ip'], 'is_kasa': info['is_kasa']}
+            for name, info in registry.devices().items()]
+
 # Flask routes for the web interface
 @app.route('/')
 def index():
-    lights = load_config()
-    buttons_html = ""
-
-    for light_name, info in lights.items():
-        # Remove the $ symbol from the light name if it exists
-        display_name = light_name.lstrip('$')
-        buttons_html += f'''
-        <div class="light-control">
-          <h2>{display_name}</h2>
-          <button class="btn btn-on" data-ip="{info['ip']}" data-action="on">ON</button>
-          <button class="btn btn-off" data-ip="{info['ip']}" data-action="off">OFF</button>
-        </div>
-        '''
-
-    # Adding the All ON and All OFF buttons
-    all_buttons_html = '''
-        <div class="light-control">
-          <h2>All Lights</h2>
-          <button class="btn btn-on" id="all-on">ALL ON</button>
-          <button class="btn btn-off" id="all-off">ALL OFF</button>
-        </div>
-    '''
-
-    return render_template('index.html', all_buttons_html=all_buttons_html, buttons_html=buttons_html)
+    body, etag = render_cached('index', lambda: render_template('index.html', lights=device_list(),
+                                                                 events_port=EVENTS_PORT, events_url=EVENTS_URL))
+    return conditional_response(body, etag, 'text/html')
+
+@app.route('/devices', methods=['GET'])
+def get_devices():
+    """Configured lights as JSON, with a strong ETag (If-None-Match gets a 304 while config.txt is unchanged)"""
+    body, etag = render_cached('devices', lambda: json.dumps(device_list()))
+    return conditional_response(body, etag, 'application/json')
+
+@app.route('/bootstrap', methods=['GET'])
+def bootstrap():
+    """Everything the page shows besides the cached HTML, in one request: light states, schedules, groups and scenes"""
+    return jsonify({
+        'state': light_states(),
+        'schedules': schedule_list(),
+        'groups': [groups.to_dict(group) for group in groups.all()],
+        'scenes': [scenes.to_dict(scene) for scene in scenes.all()]
+    })
 
 @app.route('/on/<ip>', methods=['POST'])
 def turn_on(ip):
-    lights = load_config()
-    # Find the light that matches the IP and retrieve the is_kasa flag
-    for name, info in lights.items():
-        if info['ip'] == ip:
-            is_kasa = info['is_kasa']
-            break
-    else:
+    light = registry.get_by_ip(ip)
+    if light is None:
         logging.error(f"IP address {ip} not found in configuration.")
         return jsonify({'success': False, 'error': 'IP address not found'})
 
-    success, response = send_command(ip, "0", is_kasa)
+    if request_flag('async'):
+        job = start_light_job(light, COMMAND_ON, request_source())
+        logging.info(f"Web interface: ON button pressed for {ip}. Started job {job.id}")
+        return job_accepted(job)
+
+    success, response = send_command(ip, COMMAND_ON, light['is_kasa'], source=request_source())
     if success:
         logging.info(f"Web interface: ON button pressed for {ip}. Response: {response}")
         return jsonify({'success': True, 'response': response})
@@ -209,17 +2009,17 @@ def turn_on(ip):
 
 @app.route('/off/<ip>', methods=['POST'])
 def turn_off(ip):
-    lights = load_config()
-    # Find the light that matches the IP and retrieve the is_kasa flag
-    for name, info in lights.items():
-        if info['ip'] == ip:
-            is_kasa = info['is_kasa']
-            break
-    else:
+    light = registry.get_by_ip(ip)
+    if light is None:
         logging.error(f"IP address {ip} not found in configuration.")
         return jsonify({'success': False, 'error': 'IP address not found'})
 
-    success, response = send_command(ip, "180", is_kasa)
+    if request_flag('async'):
+        job = start_light_job(light, COMMAND_OFF, request_source())
+        logging.info(f"Web interface: OFF button pressed for {ip}. Started job {job.id}")
+        return job_accepted(job)
+
+    success, response = send_command(ip, COMMAND_OFF, light['is_kasa'], source=request_source())
     if success:
         logging.info(f"Web interface: OFF button pressed for {ip}. Response: {response}")
         return jsonify({'success': True, 'response': response})
@@ -230,30 +2030,299 @@ def turn_off(ip):
 
 @app.route('/on_all', methods=['POST'])
 def turn_on_all():
-    results = send_command_to_all("0")
-    all_success = all(result['success'] for result in results.values())
+    if request_flag('async'):
+        job = start_fanout_job(COMMAND_ON, skip_unchanged=request_flag('skip_unchanged'), source=request_source())
+        logging.info(f"Web interface: ALL ON buttons pressed. Started job {job.id}")
+        return job_accepted(job)
+
+    results = send_command_to_all(COMMAND_ON, skip_unchanged=request_flag('skip_unchanged'), source=request_source())
+    all_success, error_message = fanout_error(results, 'turn on')
     if all_success:
         logging.info("Web interface: ALL ON buttons pressed successfully.")
         return jsonify({'success': True})  # Return JSON response here
     else:
-        failed_lights = [name for name, result in results.items() if not result['success']]
-        error_message = f"Failed to turn on: {', '.join(failed_lights)}"
         logging.error(f"Web interface: Failed to turn ALL lights ON. {error_message}")
         return jsonify({'success': False, 'error': error_message})
 
 @app.route('/off_all', methods=['POST'])
 def turn_off_all():
-    results = send_command_to_all("180")
-    all_success = all(result['success'] for result in results.values())
+    if request_flag('async'):
+        job = start_fanout_job(COMMAND_OFF, skip_unchanged=request_flag('skip_unchanged'), source=request_source())
+        logging.info(f"Web interface: ALL OFF buttons pressed. Started job {job.id}")
+        return job_accepted(job)
+
+    results = send_command_to_all(COMMAND_OFF, skip_unchanged=request_flag('skip_unchanged'), source=request_source())
+    all_success, error_message = fanout_error(results, 'turn off')
     if all_success:
         logging.info("Web interface: ALL OFF buttons pressed successfully.")
         return jsonify({'success': True})
     else:
-        failed_lights = [name for name, result in results.items() if not result['success']]
-        error_message = f"Failed to turn off: {', '.join(failed_lights)}"
         logging.error(f"Web interface: Failed to turn ALL lights OFF. {error_message}")
         return jsonify({'success': False, 'error': error_message})
 
+# Largest number of entries accepted by one /batch request
+BATCH_MAX_ENTRIES = 1000
+
+def parse_batch(entries):
+    """Validate /batch entries; returns ([(light, command), ...], None) or (None, error message)"""
+    if not isinstance(entries, list) or not entries:
+        return None, 'Expected a non-empty list of {"device", "action"} entries'
+    if len(entries) > BATCH_MAX_ENTRIES:
+        return None, f'At most {BATCH_MAX_ENTRIES} entries per batch'
+    parsed = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            return None, f'Entry {index} must be an object'
+        device = entry.get('device')
+        action = entry.get('action')
+        light = (registry.get_by_ip(device) or registry.get_by_name(device)) if isinstance(device, str) else None
+        if light is None:
+            return None, f'Entry {index}: unknown device {device}'
+        command = ACTION_COMMANDS.get(action.upper()) if isinstance(action, str) else None
+        if command is None:
+            return None, f'Entry {index}: action must be ON or OFF'
+        parsed.append((light, command))
+    return parsed, None
+
+def batch_entry_result(index, entry, result):
+    """One /batch result: the entry it answers plus its outcome and timings"""
+    light, command = entry
+    return dict(result, index=index, device=light['name'], action=COMMAND_STATES[command].upper())
+
+def start_batch_request_job(entries, skip_unchanged=False, source='web'):
+    """Run /batch entries as a background job, tracking each entry under its index"""
+    def work(job):
+        results = run_batch(entries, skip_unchanged=skip_unchanged, source=source,
+                            on_result=lambda index, result: job.device_finished(
+                                str(index), batch_entry_result(index, entries[index], result)))
+        failed = [f"{light['name']} {COMMAND_STATES[command]}"
+                  for (light, command), result in zip(entries, results) if not result['success']]
+        return not failed, f"Failed: {', '.join(failed)}" if failed else None
+    return job_manager.start('batch', {str(index): light for index, (light, _) in enumerate(entries)}, work)
+
+@app.route('/batch', methods=['POST'])
+def run_batch_commands():
+    """
+    Run many light commands in one request.
+
+    The body is a list of {"device": name or IP, "action": "ON" or "OFF"} entries, or
+    {"entries": [...], "skip_unchanged": true, "source": "api"}. Entries for different lights run
+    concurrently; entries for the same light run in the order given. Returns one result
+    per entry with its timings, or a job to follow with ?async=1.
+    """
+    data = request.get_json(silent=True)
+    entries, error = parse_batch(data.get('entries') if isinstance(data, dict) else data)
+    if error:
+        return jsonify({'error': error}), 400
+    skip_unchanged = request_flag('skip_unchanged')
+    source = request_source()
+    if request_flag('async'):
+        job = start_batch_request_job(entries, skip_unchanged, source)
+        logging.info(f"Batch of {len(entries)} commands started as job {job.id}")
+        return job_accepted(job)
+
+    start = time.perf_counter()
+    results = run_batch(entries, skip_unchanged=skip_unchanged, source=source)
+    elapsed = time.perf_counter() - start
+    FANOUT_DURATION.labels('batch').observe(elapsed)
+    results = [batch_entry_result(index, entry, result)
+               for index, (entry, result) in enumerate(zip(entries, results))]
+    failed = [f"{result['device']} {result['action']}" for result in results if not result['success']]
+    if failed:
+        logging.error(f"Batch of {len(entries)} commands failed for: {', '.join(failed)}")
+    else:
+        logging.info(f"Batch of {len(entries)} commands succeeded in {elapsed:.3f}s")
+    return jsonify({'success': not failed, 'error': f"Failed: {', '.join(failed)}" if failed else None,
+                    'duration_ms': round(elapsed * 1000, 1), 'results': results})
+
+def light_states():
+    """Last confirmed state ('on', 'off' or null when unknown), breaker state and reachability of every light"""
+    states = {}
+    for name, info in registry.devices().items():
+        entry = state_shadow.get(info['ip'])
+        device_health = health.get(info['ip'])
+        states[name] = {
+            'ip': info['ip'],
+            'state': entry['state'] if entry else None,
+            'breaker': breakers.state(info['ip']),
+            'online': device_health['online'] if device_health else None,
+            'updated_at': datetime.fromtimestamp(entry['updated_at']).isoformat(timespec='seconds') if entry else None
+        }
+    return states
+
+@app.route('/state', methods=['GET'])
+def get_state():
+    """Last confirmed state, breaker state and reachability of every light"""
+    return jsonify(light_states())
+
+@app.route('/queues', methods=['GET'])
+def get_queues():
+    """Per-light command queue counters, including how many commands were coalesced"""
+    stats = command_queue.stats()
+    return jsonify({
+        'coalesced_total': sum(lane['coalesced'] for lane in stats.values()),
+        'devices': stats
+    })
+
+@app.route('/breakers', methods=['GET'])
+def get_breakers():
+    """Circuit breaker state of every light that has failed since its last successful command"""
+    snapshot = breakers.snapshot()
+    for ip, entry in snapshot.items():
+        light = registry.get_by_ip(ip)
+        entry['name'] = light['name'] if light else None
+    return jsonify({'open': sum(1 for entry in snapshot.values() if entry['state'] != CircuitBreakers.CLOSED),
+                    'devices': snapshot})
+
+@app.route('/health', methods=['GET'])
+def get_health():
+    """Online/offline map from the background health prober, with last-seen and round-trip times"""
+    snapshot = health.snapshot()
+    devices = {}
+    for name, info in registry.devices().items():
+        entry = snapshot.get(info['ip'])
+        devices[name] = {
+            'ip': info['ip'],
+            'online': entry['online'] if entry else None,
+            'rtt_ms': entry['rtt_ms'] if entry else None,
+            'last_seen': datetime.fromtimestamp(entry['last_seen']).isoformat(timespec='seconds')
+                         if entry and entry['last_seen'] else None,
+            'error': entry['error'] if entry else None
+        }
+    return jsonify({
+        'online': sum(1 for device in devices.values() if device['online']),
+        'offline': sum(1 for device in devices.values() if device['online'] is False),
+        'last_round_ms': health.last_round_ms,
+        'devices': devices
+    })
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Most recent background jobs, newest first"""
+    return jsonify([job.to_dict() for job in job_manager.recent()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, per-light progress and timings of a background job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    """Point EventSource clients at the asyncio event stream (see EventBroker and EVENTS_URL)"""
+    if EVENTS_URL:
+        return redirect(EVENTS_URL, code=307)
+    host = request.host.rsplit(':', 1)[0] if ':' in request.host else request.host
+    return redirect(f"{request.scheme}://{host}:{EVENTS_PORT}/events", code=307)
+
+def parse_time_param(value):
+    """Parse a time filter given as epoch seconds or an ISO 8601 timestamp"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+HISTORY_PERCENTILES = (50, 95, 99)  # Latency percentiles reported by /history
+
+def percentile_rank(pct, count):
+    """1-based nearest-rank position of a percentile among count sorted values"""
+    return max(1, (pct * count + 99) // 100)
+
+def summarize_history(where, params, by_device=False):
+    """
+    Success rate and latency percentiles of the history rows matching where, computed in SQLite.
+
+    Returns a single summary, or {ip: summary} with by_device. Percentiles are
+    nearest-rank: a window function numbers each group's rows by latency and
+    only the rows at the percentile ranks come back.
+    """
+    def empty(count=0, successes=0, max_latency=None):
+        return {'count': count, 'success_rate': round(successes / count, 4) if count else None,
+                'latency_ms': {**{f'p{pct}': None for pct in HISTORY_PERCENTILES}, 'max': max_latency}}
+
+    key = 'ip' if by_device else 'NULL'
+    partition = 'PARTITION BY ip ' if by_device else ''
+    summaries = {}
+    for group, count, successes, max_latency in db.query(
+            f"SELECT {key}, COUNT(*), SUM(success), MAX(latency_ms) FROM command_history {where} "
+            f"{'GROUP BY ip' if by_device else ''}", params):
+        if count:
+            summaries[group] = empty(count, successes, max_latency)
+    ranks = ' OR '.join(f"position = MAX(1, ({pct} * total + 99) / 100)" for pct in HISTORY_PERCENTILES)
+    for group, position, total, latency in db.query(
+            f"SELECT grp, position, total, latency_ms FROM ("
+            f"SELECT {key} AS grp, latency_ms, ROW_NUMBER() OVER ({partition}ORDER BY latency_ms) AS position, "
+            f"COUNT(*) OVER ({partition.strip()}) AS total FROM command_history {where}) WHERE {ranks}", params):
+        for pct in HISTORY_PERCENTILES:
+            if position == percentile_rank(pct, total):
+                summaries[group]['latency_ms'][f'p{pct}'] = latency
+
+    if by_device:
+        return summaries
+    return summaries.get(None, empty())
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    """
+    Command history with optional filters, plus aggregates over everything matched.
+
+    Query parameters: since, until (epoch seconds or ISO 8601), device (name or IP),
+    source, limit (most recent entries returned, default 100, max 1000). Without
+    since, only the last HISTORY_DEFAULT_WINDOW seconds are covered; since=0
+    covers everything still retained.
+    """
+    history.flush()  # Include records still waiting in the buffer
+
+    conditions = ['ts >= ?']
+    try:
+        since = request.args.get('since')
+        params = [parse_time_param(since) if since else time.time() - HISTORY_DEFAULT_WINDOW]
+        if request.args.get('until'):
+            conditions.append('ts < ?')
+            params.append(parse_time_param(request.args['until']))
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))  # SQLite reads LIMIT -1 as no limit
+        datetime.fromtimestamp(params[0])  # Rejects since values out of range (and inf) before any query
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': 'Invalid since, until or limit'}), 400
+    device = request.args.get('device')
+    if device:
+        light = registry.get_by_name(device)
+        conditions.append('ip = ?')
+        params.append(light['ip'] if light else device)
+    if request.args.get('source'):
+        conditions.append('source = ?')
+        params.append(request.args['source'])
+    where = f"WHERE {' AND '.join(conditions)}"
+
+    rows = db.query(f"SELECT ts, device, ip, action, source, attempts, latency_ms, success, error "
+                    f"FROM command_history {where} ORDER BY ts DESC LIMIT ?", params + [limit])
+    entries = [{
+        'time': datetime.fromtimestamp(row[0]).isoformat(timespec='milliseconds'),
+        'device': row[1], 'ip': row[2], 'action': row[3], 'source': row[4], 'attempts': row[5],
+        'latency_ms': row[6], 'success': bool(row[7]), 'error': row[8]
+    } for row in rows]
+
+    return jsonify({
+        'entries': entries,
+        'since': datetime.fromtimestamp(params[0]).isoformat(timespec='milliseconds'),
+        'summary': summarize_history(where, params),
+        'devices': summarize_history(where, params, by_device=True)
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Counters and histograms in the Prometheus text exposition format"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/config/reload', methods=['POST'])
+def reload_config():
+    """Re-read config.txt without waiting for its modification time to be noticed"""
+    version = registry.reload()
+    logging.info(f"Web interface: configuration reloaded (version {version}).")
+    return jsonify({'success': True, 'version': version, 'devices': len(registry.devices())})
+
 @app.route('/status', methods=['GET'])
 def status():
     """
@@ -262,114 +2331,577 @@ def status():
     """
     return jsonify({'status': 'online', 'message': 'Server is operational'}), 200
 
+# Groups and scenes
+
+class LightSetStore:
+    """
+    Named sets of lights kept in the database: groups (plain members) and
+    scenes (members with an ON/OFF action each). Members are stored by IP.
+    """
+
+    def __init__(self, kind, table, members_table, key, with_action):
+        self.kind = kind
+        self.table = table
+        self.members_table = members_table
+        self.key = key
+        self.with_action = with_action
+
+    def _members_query(self, where=''):
+        action = 'action' if self.with_action else 'NULL'
+        return f'SELECT {self.key}, ip, {action} FROM {self.members_table} {where} ORDER BY rowid'
+
+    def all(self):
+        """Every set as {'id', 'name', 'members': [(ip, action), ...]}, by name"""
+        sets = {row[0]: {'id': row[0], 'name': row[1], 'members': []}
+                for row in db.query(f'SELECT id, name FROM {self.table} ORDER BY name')}
+        for set_id, ip, action in db.query(self._members_query()):
+            sets[set_id]['members'].append((ip, action))
+        return list(sets.values())
+
+    def get(self, set_id):
+        """One set, or None if there is no such id"""
+        row = db.query_one(f'SELECT id, name FROM {self.table} WHERE id = ?', (set_id,))
+        if row is None:
+            return None
+        members = db.query(self._members_query(f'WHERE {self.key} = ?'), (set_id,))
+        return {'id': row[0], 'name': row[1], 'members': [(ip, action) for _, ip, action in members]}
+
+    def _write_members(self, conn, set_id, members):
+        conn.execute(f'DELETE FROM {self.members_table} WHERE {self.key} = ?', (set_id,))
+        if self.with_action:
+            conn.executemany(f'INSERT INTO {self.members_table} ({self.key}, ip, action) VALUES (?, ?, ?)',
+                             [(set_id, ip, action) for ip, action in members])
+        else:
+            conn.executemany(f'INSERT INTO {self.members_table} ({self.key}, ip) VALUES (?, ?)',
+                             [(set_id, ip) for ip, _ in members])
+
+    def create(self, name, members):
+        """Insert a set and return its id; raises sqlite3.IntegrityError if the name is taken"""
+        with db.transaction() as conn:
+            set_id = conn.execute(f'INSERT INTO {self.table} (name) VALUES (?)', (name,)).lastrowid
+            self._write_members(conn, set_id, members)
+        return set_id
+
+    def update(self, set_id, name=None, members=None):
+        """Rename a set and/or replace its members; returns False if there is no such id"""
+        with db.transaction() as conn:
+            if conn.execute(f'SELECT 1 FROM {self.table} WHERE id = ?', (set_id,)).fetchone() is None:
+                return False
+            if name is not None:
+                conn.execute(f'UPDATE {self.table} SET name = ? WHERE id = ?', (name, set_id))
+            if members is not None:
+                self._write_members(conn, set_id, members)
+        return True
+
+    def delete(self, set_id):
+        """Delete a set and the schedules targeting it; returns the deleted schedule ids, or None if not found"""
+        target = f'{self.kind}:{set_id}'
+        with db.transaction() as conn:
+            if conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (set_id,)).rowcount == 0:
+                return None
+            schedule_ids = [row[0] for row in conn.execute('SELECT id FROM schedules WHERE target = ?', (target,))]
+            conn.execute('DELETE FROM schedules WHERE target = ?', (target,))
+        return schedule_ids
+
+    def to_dict(self, entry):
+        devices = []
+        for ip, action in entry['members']:
+            light = registry.get_by_ip(ip)
+            device = {'ip': ip, 'name': light['name'] if light else None}
+            if self.with_action:
+                device['action'] = action
+            devices.append(device)
+        return {'id': entry['id'], 'name': entry['name'], 'devices': devices}
+
+
+groups = LightSetStore('group', 'groups', 'group_members', 'group_id', with_action=False)
+scenes = LightSetStore('scene', 'scenes', 'scene_members', 'scene_id', with_action=True)
+
+def group_commands(group, action):
+    """send_commands() argument turning every light of a group ON or OFF"""
+    return {ip: ACTION_COMMANDS[action] for ip, _ in group['members']}
+
+def scene_commands(scene):
+    """send_commands() argument applying a scene"""
+    return {ip: ACTION_COMMANDS[action] for ip, action in scene['members']}
+
+def parse_light_set(data, store, partial=False):
+    """
+    Validate a group or scene payload: {"name": ..., "devices": [...]}.
+
+    Devices are names or IPs; for scenes each is {"device": ..., "action": "ON"|"OFF"},
+    or the devices value is a {device: action} mapping. Returns ((name, members), None)
+    or (None, error message); with partial=True either field may be omitted.
+    """
+    if not isinstance(data, dict):
+        return None, f'Invalid {store.kind}'
+    name = data.get('name')
+    devices = data.get('devices')
+    if name is not None and (not isinstance(name, str) or not name.strip()):
+        return None, 'Name must be a non-empty string'
+    if not partial and (name is None or devices is None):
+        return None, 'Missing required fields'
+    if devices is None:
+        return (name.strip() if name else None, None), None
+
+    if store.with_action and isinstance(devices, dict):
+        devices = [{'device': device, 'action': action} for device, action in devices.items()]
+    if not isinstance(devices, list):
+        return None, 'Devices must be a list'
+    members = {}
+    for item in devices:
+        device, action = (item.get('device'), item.get('action')) if isinstance(item, dict) else (item, None)
+        light = (registry.get_by_ip(device) or registry.get_by_name(device)) if isinstance(device, str) else None
+        if light is None:
+            return None, f'Unknown device: {device}'
+        if store.with_action:
+            action = action.upper() if isinstance(action, str) else action
+            if action not in ACTION_COMMANDS:
+                return None, f'Action for {device} must be ON or OFF'
+        members[light['ip']] = action
+    return (name.strip() if name else None, list(members.items())), None
+
+def run_batch_request(kind, commands, verb):
+    """Run a group or scene command now, or as a background job with ?async=1"""
+    skip_unchanged = request_flag('skip_unchanged')
+    source = request_source()
+    if request_flag('async'):
+        job = start_batch_job(kind, commands, verb, skip_unchanged, source)
+        logging.info(f"Web interface: {verb}. Started job {job.id}")
+        return job_accepted(job)
+
+    results = send_commands(commands, skip_unchanged=skip_unchanged, source=source, label=kind)
+    success, error = fanout_error(results, verb)
+    if success:
+        logging.info(f"Web interface: {verb} succeeded.")
+    else:
+        logging.error(f"Web interface: {error}")
+    return jsonify({'success': success, 'error': error, 'results': results})
+
+def create_light_set(store):
+    fields, error = parse_light_set(request.get_json(silent=True), store)
+    if error:
+        return jsonify({'error': error}), 400
+    name, members = fields
+    try:
+        set_id = store.create(name, members)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': f'A {store.kind} named {name} already exists'}), 409
+    logging.info(f"Created {store.kind} {set_id} ({name}) with {len(members)} lights")
+    return jsonify(store.to_dict(store.get(set_id))), 201
+
+def update_light_set(store, set_id):
+    fields, error = parse_light_set(request.get_json(silent=True), store, partial=True)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        found = store.update(set_id, *fields)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': f'A {store.kind} named {fields[0]} already exists'}), 409
+    if not found:
+        return jsonify({'error': f'{store.kind.capitalize()} not found'}), 404
+    logging.info(f"Updated {store.kind} {set_id}")
+    return jsonify(store.to_dict(store.get(set_id)))
+
+def delete_light_set(store, set_id):
+    schedule_ids = store.delete(set_id)
+    if schedule_ids is None:
+        return jsonify({'error': f'{store.kind.capitalize()} not found'}), 404
+    for schedule_id in schedule_ids:
+        schedule_engine.remove(schedule_id)
+    logging.info(f"Deleted {store.kind} {set_id} and {len(schedule_ids)} schedules targeting it")
+    return jsonify({'message': f'{store.kind.capitalize()} deleted successfully', 'deleted_schedules': schedule_ids})
+
+@app.route('/groups', methods=['GET'])
+def list_groups():
+    """All groups with their lights"""
+    return jsonify([groups.to_dict(group) for group in groups.all()])
+
+@app.route('/groups', methods=['POST'])
+def create_group():
+    """Create a group: {"name": "Downstairs", "devices": ["Kitchen", "10.0.0.12"]}"""
+    return create_light_set(groups)
+
+@app.route('/groups/<int:group_id>', methods=['GET'])
+def get_group(group_id):
+    group = groups.get(group_id)
+    if group is None:
+        return jsonify({'error': 'Group not found'}), 404
+    return jsonify(groups.to_dict(group))
+
+@app.route('/groups/<int:group_id>', methods=['PUT'])
+def update_group(group_id):
+    """Rename a group and/or replace its lights"""
+    return update_light_set(groups, group_id)
+
+@app.route('/groups/<int:group_id>', methods=['DELETE'])
+def delete_group(group_id):
+    """Delete a group, along with any schedules targeting it"""
+    return delete_light_set(groups, group_id)
+
+@app.route('/groups/<int:group_id>/on', methods=['POST'])
+def turn_on_group(group_id):
+    group = groups.get(group_id)
+    if group is None:
+        return jsonify({'error': 'Group not found'}), 404
+    return run_batch_request('group_on', group_commands(group, 'ON'), f"turn {group['name']} on")
+
+@app.route('/groups/<int:group_id>/off', methods=['POST'])
+def turn_off_group(group_id):
+    group = groups.get(group_id)
+    if group is None:
+        return jsonify({'error': 'Group not found'}), 404
+    return run_batch_request('group_off', group_commands(group, 'OFF'), f"turn {group['name']} off")
+
+@app.route('/scenes', methods=['GET'])
+def list_scenes():
+    """All scenes with their lights and actions"""
+    return jsonify([scenes.to_dict(scene) for scene in scenes.all()])
+
+@app.route('/scenes', methods=['POST'])
+def create_scene():
+    """Create a scene: {"name": "Evening", "devices": {"Kitchen": "ON", "Porch": "OFF"}}"""
+    return create_light_set(scenes)
+
+@app.route('/scenes/<int:scene_id>', methods=['GET'])
+def get_scene(scene_id):
+    scene = scenes.get(scene_id)
+    if scene is None:
+        return jsonify({'error': 'Scene not found'}), 404
+    return jsonify(scenes.to_dict(scene))
+
+@app.route('/scenes/<int:scene_id>', methods=['PUT'])
+def update_scene(scene_id):
+    """Rename a scene and/or replace its lights and actions"""
+    return update_light_set(scenes, scene_id)
+
+@app.route('/scenes/<int:scene_id>', methods=['DELETE'])
+def delete_scene(scene_id):
+    """Delete a scene, along with any schedules targeting it"""
+    return delete_light_set(scenes, scene_id)
+
+@app.route('/scenes/<int:scene_id>/activate', methods=['POST'])
+def activate_scene(scene_id):
+    scene = scenes.get(scene_id)
+    if scene is None:
+        return jsonify({'error': 'Scene not found'}), 404
+    return run_batch_request('scene', scene_commands(scene), f"set scene {scene['name']}")
+
 # Scheduling functions
 def get_schedules():
-    """Get all schedules from database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM schedules WHERE enabled = 1')
-    schedules = cursor.fetchall()
-    conn.close()
-    return schedules
+    """Get all enabled schedules from database"""
+    return db.query('SELECT * FROM schedules WHERE enabled = 1')
+
+def parse_target(target):
+    """Split a schedule target ('all', 'group:<id>' or 'scene:<id>') into (kind, id); raises ValueError"""
+    if not target or target == 'all':
+        return 'all', None
+    kind, _, target_id = str(target).partition(':')
+    if kind not in ('group', 'scene') or not target_id.isdigit():
+        raise ValueError(f"Invalid target '{target}'")
+    return kind, int(target_id)
 
-def execute_scheduled_action(action):
-    """Execute a scheduled action (ON or OFF)"""
-    logging.info(f"Executing scheduled action: ALL {action}")
-    if action == "ON":
-        results = send_command_to_all("0")
-    else:  # OFF
-        results = send_command_to_all("180")
+def execute_scheduled_action(action, target='all', skip_unchanged=False):
+    """
+    Execute a scheduled action, sending every light its command (skip_unchanged skips recently confirmed ones).
+
+    action is ON or OFF for all lights or a group; scene targets apply the scene (action SCENE).
+    """
+    kind, target_id = parse_target(target)
+    if kind == 'all':
+        description = f"turn all lights {action}"
+    else:
+        entry = (groups if kind == 'group' else scenes).get(target_id)
+        if entry is None:
+            logging.error(f"Scheduled {action} targets {target}, which no longer exists")
+            events.publish('schedule', {'action': action, 'target': target, 'status': 'done', 'success': False,
+                                        'failed': [], 'description': f"{kind} {target_id} not found"})
+            return
+        description = f"set scene {entry['name']}" if kind == 'scene' else f"turn {entry['name']} {action}"
+    logging.info(f"Executing scheduled action: {description}")
+    events.publish('schedule', {'action': action, 'target': target, 'status': 'fired', 'description': description})
+    if kind == 'all':
+        results = send_command_to_all(ACTION_COMMANDS[action], skip_unchanged=skip_unchanged, source='schedule')
+    elif kind == 'group':
+        results = send_commands(group_commands(entry, action), skip_unchanged=skip_unchanged, source='schedule',
+                                label=f"group_{action.lower()}")
+    else:
+        results = send_commands(scene_commands(entry), skip_unchanged=skip_unchanged, source='schedule', label='scene')
     
-    all_success = all(result['success'] for result in results.values())
-    if all_success:
-        logging.info(f"Scheduled {action} executed successfully")
+    failed_lights = [name for name, result in results.items() if not result['success']]
+    events.publish('schedule', {'action': action, 'target': target, 'status': 'done', 'success': not failed_lights,
+                                'failed': failed_lights, 'description': description})
+    if not failed_lights:
+        logging.info(f"Scheduled {description} executed successfully")
     else:
-        failed_lights = [name for name, result in results.items() if not result['success']]
-        logging.error(f"Scheduled {action} failed for: {', '.join(failed_lights)}")
+        logging.error(f"Scheduled {description} failed for: {', '.join(failed_lights)}")
+
+# Day-of-week masks for the schedules.days column (bit 0 = Monday ... bit 6 = Sunday)
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DAY_PRESETS = {'daily': 0b1111111, 'weekdays': 0b0011111, 'weekends': 0b1100000}
+
+def parse_days(days):
+    """
+    Convert a days value into a weekday bit mask.
+
+    Accepts 'daily', 'weekdays', 'weekends' or a comma-separated list of day
+    names such as 'mon,wed,fri' (full names work too). Raises ValueError for
+    anything else.
+    """
+    days = (days or 'daily').strip().lower()
+    if days in DAY_PRESETS:
+        return DAY_PRESETS[days]
+    mask = 0
+    for day in days.split(','):
+        day = day.strip()[:3]
+        if day not in DAY_NAMES:
+            raise ValueError(f"Unknown day '{day}'")
+        mask |= 1 << DAY_NAMES.index(day)
+    return mask
+
+def next_fire_time(time_str, mask, after):
+    """Return the first datetime after 'after' at HH:MM on a day allowed by mask"""
+    hour, minute = map(int, time_str.split(':'))
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    for _ in range(8):
+        if candidate > after and mask & (1 << candidate.weekday()):
+            return candidate
+        candidate += timedelta(days=1)
+    return None  # Empty mask: never fires
+
+
+class ScheduleEngine:
+    """
+    Fires scheduled actions from a heap of next fire times.
+
+    The engine thread sleeps until exactly the next due schedule (woken early
+    when schedules change), so there is no per-second polling. add(), remove()
+    and load() are incremental: changed schedules get a new version and stale
+    heap entries are discarded lazily when they reach the top.
+    """
+
+    def __init__(self, action, max_sleep=SCHEDULER_MAX_SLEEP, workers=SCHEDULER_WORKERS):
+        self.action = action
+        self.max_sleep = max_sleep
+        self._cond = threading.Condition()
+        self._heap = []       # (fire timestamp, version, schedule id)
+        self._entries = {}    # schedule id -> (time, action, target, mask, version, skip_unchanged)
+        self._version = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='schedule')
+
+    def _push(self, sched_id, now):
+        time_str, _, _, mask, version, _ = self._entries[sched_id]
+        fire = next_fire_time(time_str, mask, now)
+        if fire is not None:
+            heapq.heappush(self._heap, (fire.timestamp(), version, sched_id))
+
+    def add(self, sched_id, time_str, action, days='daily', target='all', skip_unchanged=False):
+        """Add a schedule, or replace it if it is already known; raises ValueError for invalid days"""
+        mask = parse_days(days)
+        with self._cond:
+            self._version += 1
+            self._entries[sched_id] = (time_str, action, target, mask, self._version, bool(skip_unchanged))
+            self._push(sched_id, datetime.now())
+            self._cond.notify()
+
+    def remove(self, sched_id):
+        """Stop firing a schedule; its heap entry is dropped when it surfaces"""
+        with self._cond:
+            if self._entries.pop(sched_id, None) is not None:
+                self._cond.notify()
+
+    def load(self, rows):
+        """Replace all schedules with (id, time, action, days, target, skip_unchanged) rows in one go"""
+        now = datetime.now()
+        with self._cond:
+            self._entries.clear()
+            self._heap = []
+            for sched_id, time_str, action, days, target, skip_unchanged in rows:
+                try:
+                    mask = parse_days(days)
+                except ValueError as e:
+                    logging.error(f"Skipping schedule {sched_id}: {e}")
+                    continue
+                self._version += 1
+                self._entries[sched_id] = (time_str, action, target, mask, self._version, bool(skip_unchanged))
+                fire = next_fire_time(time_str, mask, now)
+                if fire is not None:
+                    self._heap.append((fire.timestamp(), self._version, sched_id))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def next_run(self, sched_id):
+        """Datetime the schedule fires next, or None if it is not active"""
+        with self._cond:
+            entry = self._entries.get(sched_id)
+            if entry is None:
+                return None
+            return next_fire_time(entry[0], entry[3], datetime.now())
+
+    def queue_size(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _is_current(self, item):
+        entry = self._entries.get(item[2])
+        return entry is not None and entry[4] == item[1]
+
+    def run(self):
+        """Engine loop; runs forever on the calling thread"""
+        while True:
+            with self._cond:
+                # Drop heap entries for removed or replaced schedules
+                while self._heap and not self._is_current(self._heap[0]):
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._cond.wait(min(delay, self.max_sleep))
+                    continue
+                planned, _, sched_id = heapq.heappop(self._heap)
+                _, action, target, _, _, skip_unchanged = self._entries[sched_id]
+                # Queue the following occurrence
+                self._push(sched_id, max(datetime.now(), datetime.fromtimestamp(planned)))
+            lag = time.time() - planned
+            SCHEDULER_LAG.observe(lag)
+            logging.info(f"Schedule {sched_id} due: {action} {target} ({lag:.3f}s late)")
+            self._executor.submit(self._fire, sched_id, action, target, skip_unchanged)
+
+    def _fire(self, sched_id, action, target, skip_unchanged=False):
+        try:
+            self.action(action, target, skip_unchanged)
+        except Exception as e:
+            logging.error(f"Schedule {sched_id} failed: {e}")
+
+
+schedule_engine = ScheduleEngine(execute_scheduled_action)
+metrics.register(Gauge('light_scheduler_queue_entries', 'Entries in the schedule engine heap',
+                       callback=lambda: schedule_engine.queue_size()))
 
 def load_schedules():
-    """Load all active schedules and set them up"""
-    schedule.clear()  # Clear existing scheduled jobs
+    """Load all active schedules into the schedule engine"""
     schedules = get_schedules()
-    
-    for sched in schedules:
-        sched_id, time_str, action, enabled, days, created_at = sched
-        if enabled:
-            # Schedule the job
-            schedule.every().day.at(time_str).do(execute_scheduled_action, action).tag(f'schedule_{sched_id}')
-            logging.info(f"Loaded schedule {sched_id}: {action} at {time_str}")
+    schedule_engine.load([(sched[0], sched[1], sched[2], sched[4], sched[6], sched[7]) for sched in schedules])
+    logging.info(f"Loaded {len(schedules)} schedules")
 
 def run_scheduler():
     """Background thread to run scheduled tasks"""
-    while True:
-        schedule.run_pending()
-        time.sleep(1)  # Check every second for more accurate timing
+    schedule_engine.run()
 
 # Schedule management API endpoints
-@app.route('/schedules', methods=['GET'])
-def get_all_schedules():
-    """Get all schedules"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM schedules ORDER BY time')
+def schedule_list():
+    """All schedules by time, with their next run"""
     schedules = []
-    for row in cursor.fetchall():
+    for row in db.query('SELECT * FROM schedules ORDER BY time'):
+        next_run = schedule_engine.next_run(row[0])
         schedules.append({
             'id': row[0],
             'time': row[1],
             'action': row[2],
             'enabled': bool(row[3]),
             'days': row[4],
-            'created_at': row[5]
+            'created_at': row[5],
+            'target': row[6],
+            'skip_unchanged': bool(row[7]),
+            'next_run': next_run.isoformat(timespec='minutes') if next_run else None
         })
-    conn.close()
-    return jsonify(schedules)
+    return schedules
 
-@app.route('/schedules', methods=['POST'])
-def create_schedule():
-    """Create a new schedule"""
-    data = request.json
+@app.route('/schedules', methods=['GET'])
+def get_all_schedules():
+    """Get all schedules"""
+    return jsonify(schedule_list())
+
+def validate_schedule(data):
+    """
+    Check a schedule payload.
+
+    Returns:
+        ((time, action, days, target, skip_unchanged), None), or (None, error message)
+    """
+    if not isinstance(data, dict):
+        return None, 'Invalid schedule'
     time_str = data.get('time')
     action = data.get('action')
-    days = data.get('days', 'daily')
+    days = data.get('days') or 'daily'
+    target = data.get('target') or 'all'
+    skip_unchanged = data.get('skip_unchanged', False)
+
+    if not isinstance(skip_unchanged, bool):
+        return None, 'skip_unchanged must be true or false'
+    if not isinstance(target, str):
+        return None, "Invalid target. Use all, group:<id> or scene:<id>"
+    try:
+        kind, target_id = parse_target(target)
+    except ValueError:
+        return None, "Invalid target. Use all, group:<id> or scene:<id>"
+    if kind != 'all' and (groups if kind == 'group' else scenes).get(target_id) is None:
+        return None, f'{kind.capitalize()} {target_id} not found'
+    if kind == 'scene':
+        action = 'SCENE'  # A scene carries its own ON/OFF actions
     
     if not time_str or not action:
-        return jsonify({'error': 'Missing required fields'}), 400
+        return None, 'Missing required fields'
     
-    if action not in ['ON', 'OFF']:
-        return jsonify({'error': 'Action must be ON or OFF'}), 400
+    if kind != 'scene' and (not isinstance(action, str) or action not in ['ON', 'OFF']):
+        return None, 'Action must be ON or OFF'
     
     # Validate time format
+    if not isinstance(time_str, str):
+        return None, 'Invalid time format. Use HH:MM'
     try:
         datetime.strptime(time_str, '%H:%M')
     except ValueError:
-        return jsonify({'error': 'Invalid time format. Use HH:MM'}), 400
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO schedules (time, action, days) VALUES (?, ?, ?)',
-                   (time_str, action, days))
-    schedule_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        return None, 'Invalid time format. Use HH:MM'
+
+    try:
+        if not isinstance(days, str):
+            raise ValueError(f"Invalid days {days!r}")
+        parse_days(days)
+    except ValueError:
+        return None, "Invalid days. Use daily, weekdays, weekends or a list like mon,wed,fri"
+    return (time_str, action, days, target, skip_unchanged), None
+
+@app.route('/schedules', methods=['POST'])
+def create_schedule():
+    """Create a new schedule, or several at once when given a list"""
+    data = request.json
+    batch = isinstance(data, list)
+    items = data if batch else [data]
+    if not items:
+        return jsonify({'error': 'No schedules given'}), 400
+
+    schedules = []
+    for item in items:
+        fields, error = validate_schedule(item)
+        if error:
+            return jsonify({'error': error}), 400
+        schedules.append(fields)
     
-    # Reload schedules
-    load_schedules()
+    # Insert every schedule in one transaction
+    schedule_ids = []
+    with db.transaction() as conn:
+        for time_str, action, days, target, skip_unchanged in schedules:
+            cursor = conn.execute('INSERT INTO schedules (time, action, days, target, skip_unchanged) '
+                                  'VALUES (?, ?, ?, ?, ?)', (time_str, action, days, target, int(skip_unchanged)))
+            schedule_ids.append(cursor.lastrowid)
     
-    logging.info(f"Created new schedule {schedule_id}: {action} at {time_str}")
-    return jsonify({'id': schedule_id, 'message': 'Schedule created successfully'})
+    for schedule_id, (time_str, action, days, target, skip_unchanged) in zip(schedule_ids, schedules):
+        schedule_engine.add(schedule_id, time_str, action, days, target, skip_unchanged)
+        logging.info(f"Created new schedule {schedule_id}: {action} {target} at {time_str}")
+
+    if batch:
+        return jsonify({'ids': schedule_ids, 'message': f'{len(schedule_ids)} schedules created successfully'})
+    return jsonify({'id': schedule_ids[0], 'message': 'Schedule created successfully'})
 
 @app.route('/schedules/<int:schedule_id>', methods=['DELETE'])
 def delete_schedule(schedule_id):
     """Delete a schedule"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
-    conn.commit()
-    conn.close()
+    db.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
     
-    # Reload schedules
-    load_schedules()
+    schedule_engine.remove(schedule_id)
     
     logging.info(f"Deleted schedule {schedule_id}")
     return jsonify({'message': 'Schedule deleted successfully'})
@@ -377,36 +2909,122 @@ def delete_schedule(schedule_id):
 @app.route('/schedules/<int:schedule_id>/toggle', methods=['PUT'])
 def toggle_schedule(schedule_id):
     """Enable/disable a schedule"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get current state
-    cursor.execute('SELECT enabled FROM schedules WHERE id = ?', (schedule_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return jsonify({'error': 'Schedule not found'}), 404
+    with db.transaction() as conn:
+        # Get current state
+        result = conn.execute('SELECT enabled, time, action, days, target, skip_unchanged FROM schedules '
+                              'WHERE id = ?', (schedule_id,)).fetchone()
+        if not result:
+            return jsonify({'error': 'Schedule not found'}), 404
+        
+        new_state = 0 if result[0] else 1
+        if new_state:
+            # Rows written before validation existed may not load; leave those disabled
+            fields, error = validate_schedule({'time': result[1], 'action': result[2], 'days': result[3],
+                                               'target': result[4], 'skip_unchanged': bool(result[5])})
+            if error:
+                logging.warning(f"Not enabling schedule {schedule_id}: {error}")
+                return jsonify({'error': error}), 400
+        conn.execute('UPDATE schedules SET enabled = ? WHERE id = ?', (new_state, schedule_id))
     
-    new_state = 0 if result[0] else 1
-    cursor.execute('UPDATE schedules SET enabled = ? WHERE id = ?', (new_state, schedule_id))
-    conn.commit()
-    conn.close()
-    
-    # Reload schedules
-    load_schedules()
+    if new_state:
+        schedule_engine.add(schedule_id, *fields)
+    else:
+        schedule_engine.remove(schedule_id)
     
     logging.info(f"Toggled schedule {schedule_id} to {'enabled' if new_state else 'disabled'}")
     return jsonify({'enabled': bool(new_state)})
 
-if __name__ == '__main__':
+def start_background_services(host=SERVER_HOST):
+    """Start the scheduler, the Server-Sent Events stream (listening on host) and the health prober"""
     # Load existing schedules
     load_schedules()
-    
+
     # Start scheduler thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread = threading.Thread(target=run_scheduler, name='scheduler', daemon=True)
     scheduler_thread.start()
     logging.info("Started scheduler thread")
-    
-    # Start the Flask web server in debug mode
-    logging.info("Starting Flask web server in debug mode.")
-    app.run(host='0.0.0.0', port=5069, debug=True)
+
+    # Start the Server-Sent Events stream
+    events.start(host)
+
+    # Start probing the fleet for reachability
+    health.start()
+
+# Open lock file of the process running the background services (closing it gives up leadership)
+_leader_lock = None
+
+def start_background_services_when_leader(host=SERVER_HOST, path=LEADER_LOCK_PATH):
+    """
+    Start the background services in exactly one server process.
+
+    The server runs a single worker, but gunicorn starts a replacement when a
+    worker times out, possibly before the old one has exited, and a second
+    server may be started on the same data directory. A daemon thread blocks
+    on an exclusive lock of `path` and starts the services once it holds it,
+    so the scheduler never fires a schedule twice. The kernel releases the
+    lock when its holder exits, at which point the waiting process takes over.
+    """
+    def wait_for_leadership():
+        global _leader_lock
+        lock_file = open(path, 'a+')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        _leader_lock = lock_file
+        logging.info(f"Process {os.getpid()} holds {path}; starting background services")
+        start_background_services(host)
+
+    threading.Thread(target=wait_for_leadership, name='leader-election', daemon=True).start()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Light control web server.")
+    parser.add_argument("--debug", action="store_true",
+                        help="Run Flask's development server with the debugger and reloader instead of gunicorn.")
+    parser.add_argument("--host", default=SERVER_HOST, help="Address to listen on.")
+    parser.add_argument("--port", default=SERVER_PORT, type=int, help="Port to listen on.")
+    parser.add_argument("--threads", default=SERVER_THREADS, type=int,
+                        help="Request threads. The server is a single process, since device state, queues, "
+                             "breakers, health data, schedules and the event stream all live in memory.")
+    parser.add_argument("--timeout", default=SERVER_TIMEOUT, type=int,
+                        help="Seconds a worker may stay silent before it is restarted.")
+    return parser.parse_args(argv)
+
+def serve(args):
+    """Serve the app with one gunicorn threaded (gthread) worker"""
+    from gunicorn.app.base import BaseApplication
+
+    class LightControlServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    options = {
+        'bind': f"{args.host}:{args.port}",
+        # One process: every request must see the same in-memory state; scale with threads
+        'workers': 1,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'graceful_timeout': 10,
+        'keepalive': SERVER_KEEPALIVE,
+        'post_worker_init': lambda worker: start_background_services_when_leader(args.host),
+    }
+    # The worker is forked from this process and must not inherit its SQLite connection
+    db.close()
+    logging.info(f"Starting gunicorn on {options['bind']} with {args.threads} threads")
+    LightControlServer().run()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.debug:
+        # The reloader runs the app in a child process; only that one serves requests
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_services_when_leader(args.host)
+        logging.info("Starting Flask web server in debug mode.")
+        app.run(host=args.host, port=args.port, debug=True)
+    else:
+        serve(args)
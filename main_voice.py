@@ -1,68 +1,397 @@
-import time
+import os
 import re
-import telnetlib
+import time
+import collections
 import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-# Set up Telnet connection
-HOST = "10.0.0.176"  # Replace with your ESP32's IP address
-PORT = 23
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Telnet command function
-def send_command(command):
-    try:
-        tn = telnetlib.Telnet(HOST, PORT)
-        tn.write(command.encode('ascii') + b"\n")
-        response = tn.read_until(b"\n").decode('ascii').strip()
-        print(response)
-        tn.close()
-    except Exception as e:
-        print(f"Error: {e}")
+from servo import device_url
+from transcript_stream import DEFAULT_SOCKET_PATH, QueueTranscriptStream, TranscriptListener
 
-# Function to clear file contents
-def clear_file_contents(filename):
-    with open(filename, 'w') as file:
-        file.truncate(0)
-    print(f"Cleared the contents of {filename}.")
+# main.py's web interface; voice commands go through its API so they get the same fan-out as the buttons
+SERVER_URL = os.environ.get('LIGHT_CONTROL_URL', 'http://127.0.0.1:5069')
+CONFIG_PATH = os.path.join(os.environ.get('LIGHT_CONTROL_DIR', '/home/jason/light-control'), 'config.txt')
+API_TIMEOUT = (2, 5)  # (connect, read) seconds for requests to main.py
+NAMES_REFRESH_INTERVAL = 60  # Seconds before light and group names are fetched again
+KEEPALIVE_INTERVAL = 30  # Seconds between requests keeping the idle connection to main.py open
 
-# Function to scan entire content for phrases
-def scan_file_for_phrases(filename):
-    with open(filename, 'r') as file:
-        content = file.read()
+# Direct commands to servo lights, used when main.py cannot be reached
+DEVICE_TIMEOUT = (2, 5)  # (connect, read) seconds; servo moves take ~0.5 s
+SERVO_POSITIONS = {'ON': '0', 'OFF': '180'}
 
-    # Updated regex patterns to account for any whitespace, line breaks, and optional punctuation
-    light_on_pattern = re.compile(r'light\s*[.,;!?]*\s*on\s*[.,;!?]*\s', re.IGNORECASE | re.DOTALL)
-    light_off_pattern = re.compile(r'light\s*[.,;!?]*\s*off\s*[.,;!?]*\s', re.IGNORECASE | re.DOTALL)
+# Vocabulary of the intent matcher
+ACTION_WORDS = {'on': 'ON', 'off': 'OFF'}
+ALL_LIGHTS_PHRASES = ('light', 'lights', 'the lights', 'all', 'all lights', 'all the lights', 'everything')
+NAME_SUFFIXES = ('light', 'lights', 'lamp')  # "kitchen light on" means the light named Kitchen
+CONNECTOR_WORDS = {'and', 'the'}  # "kitchen and the porch off" names two lights
+COMMAND_WORDS = {'turn', 'switch'}  # Start a new command, dropping a name left over from earlier words
+INTENT_PHRASE_GAP = 3.0  # Seconds of silence between chunks that end a phrase (transcribe.py's --phrase_timeout)
+ALL_LIGHTS = ('all lights', None)  # Target for every light; others are (name, (ip, ...))
 
-    # Search for patterns in the content
-    light_on_match = light_on_pattern.search(content)
-    light_off_match = light_off_pattern.search(content)
+def tokenize(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
 
-    if light_on_match:
-        print("Got 'light on'")
-        send_command("0")  # Send "on" command via Telnet
-        clear_file_contents(filename)  # Clear the file after detection
+class TrieNode:
+    __slots__ = ('children', 'target')
 
-    elif light_off_match:
-        print("Got 'light off'")
-        send_command("180")  # Send "off" command via Telnet
-        clear_file_contents(filename)  # Clear the file after detection
+    def __init__(self):
+        self.children = {}
+        self.target = None
 
-# Function to continuously monitor the file
-def monitor_file(filename, check_interval=1):
-    clear_file_contents(filename)  # Clear the file at the start
+class IntentMatcher:
+    """
+    Finds "<name> on/off" and "turn on/off <name>" commands in a stream of text.
 
-    try:
-        while True:
-            scan_file_for_phrases(filename)
-            time.sleep(check_interval)
+    Light names, group names and phrases for all lights are compiled into a
+    word trie once. feed() moves every newly arrived word through the trie a
+    single time, carrying the partial matches in progress from one chunk to
+    the next, so old text is never scanned again and a command split across
+    two chunks is still recognized. The longest name wins ("kitchen lamp"
+    over "kitchen"), and names joined by "and" form one command. A name and
+    its "on"/"off" must follow each other with at most connector words in
+    between ("the kitchen is off limits" is not a command), and a chunk
+    arriving more than INTENT_PHRASE_GAP seconds after the last one starts
+    a new phrase, dropping whatever was partly matched.
+    """
+
+    def __init__(self, targets):
+        """
+        Args:
+            targets: {phrase: target}; a target is (name, tuple of IPs), or ALL_LIGHTS
+        """
+        self.root = TrieNode()
+        for phrase, target in targets.items():
+            node = self.root
+            for word in tokenize(phrase):
+                node = node.children.setdefault(word, TrieNode())
+            if node is not self.root:
+                node.target = target
+        self.position = 0    # Words seen so far
+        self.recent = collections.deque(maxlen=8)  # (position, word) of the last words, to check what joins two names
+        self.active = []     # (trie node, start position) of names being matched
+        self.targets = []    # (target, start, end) named since the last command
+        self.action = None   # (action, position) of an "on"/"off" that came before its name
+        self.fed_at = None   # time.monotonic() of the last chunk
+
+    def idle(self):
+        """True if no command is partly matched"""
+        return not (self.active or self.targets or self.action)
+
+    def reset(self):
+        """Drop any partly matched command"""
+        self.active = []
+        self.targets = []
+        self.action = None
+
+    def feed(self, text, now=None):
+        """
+        Match a new chunk of text.
+
+        Args:
+            text: Newly transcribed text
+            now: time.monotonic() the chunk arrived at (default: now)
+
+        Returns:
+            list: (targets, action) for every command completed, action being 'ON' or 'OFF'
+        """
+        now = time.monotonic() if now is None else now
+        if self.fed_at is not None and now - self.fed_at > INTENT_PHRASE_GAP:
+            self.reset()  # A new phrase: "the kitchen" said a minute ago is not the name of this "off"
+        self.fed_at = now
+        intents = []
+        for word in tokenize(text):
+            self._step(word, intents)
+        # A chunk is a whole utterance: "turn on the kitchen" needs no further word to be complete
+        if self.action and self.targets:
+            self._emit(self.action[0], intents)
+        return intents
+
+    def _step(self, word, intents):
+        position = self.position
+        self.position += 1
+
+        if word in ACTION_WORDS:
+            self.active = []
+            if self.targets and self._joined(self.targets[-1][2], position):
+                self._emit(ACTION_WORDS[word], intents)
+            else:
+                self.targets = []
+                self.action = (ACTION_WORDS[word], position)
+            return
+
+        if word in COMMAND_WORDS:
+            self.targets = []
+
+        # Advance every partial match, and start a new one at this word
+        active = []
+        longest = None
+        for node, start in self.active + [(self.root, position)]:
+            child = node.children.get(word)
+            if child is None:
+                continue
+            active.append((child, start))
+            if child.target is not None and (longest is None or start < longest[1]):
+                longest = (child.target, start, position)
+        self.active = active
+        self.recent.append((position, word))
+        if longest:
+            self._add_target(longest)
+        elif self.action and not self.targets and not self.active and word not in CONNECTOR_WORDS:
+            self.action = None  # "turn it on yesterday": no name follows
+
+        if (self.action and self.targets and word not in CONNECTOR_WORDS
+                and not any(node.children for node, _ in self.active)):
+            self._emit(self.action[0], intents)  # "turn on the kitchen ...": the name cannot grow any longer
+
+    def _add_target(self, match):
+        target, start, end = match
+        if self.targets:
+            last_start, last_end = self.targets[-1][1:]
+            if start <= last_start:
+                self.targets[-1] = match  # A longer name covering the last one
+                return
+            if start <= last_end:
+                return  # Starts inside the last name; the leftmost name wins
+            if not self._joined(last_end, start):
+                self.targets = []  # Unrelated words in between: only the new name counts
+        self.targets.append(match)
+
+    def _joined(self, end, start):
+        """True if only connector words came between positions end and start"""
+        between = [word for position, word in self.recent if end < position < start]
+        return len(between) == start - end - 1 and all(word in CONNECTOR_WORDS for word in between)
+
+    def _emit(self, action, intents):
+        intents.append(([target for target, _, _ in self.targets], action))
+        self.targets = []
+        self.action = None
+        self.active = []
+
+class VoiceClient:
+    """
+    Keep-alive HTTP connections for voice commands.
+
+    Commands go to main.py's API over one pooled session. warm() opens its
+    connection at startup and a background request every KEEPALIVE_INTERVAL
+    seconds keeps it open, so no command waits for connection setup. A kept
+    connection that was closed anyway is reopened and the request resent,
+    which is safe because ON and OFF are absolute. If main.py cannot be
+    reached, servo lights get /servo directly, over one session per light.
+    """
+
+    def __init__(self, server_url=SERVER_URL):
+        self.server_url = server_url
+        self.session = self._session(pool_maxsize=4)
+        self.lights = {}  # ip -> is_kasa for every known light, set by load_targets()
+        self._device_sessions = {}
+        self._etag = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _session(pool_maxsize):
+        session = requests.Session()
+        # One resend if the connection turns out to be closed or the request cannot connect
+        retries = Retry(total=1, status=0, backoff_factor=0, allowed_methods=None, raise_on_status=False)
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retries))
+        return session
+
+    def get_json(self, path):
+        response = self.session.get(f"{self.server_url}{path}", timeout=API_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
 
+    def ping(self):
+        """Cheap request on the kept connection: /devices answers 304 while config.txt is unchanged"""
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = self.session.get(f"{self.server_url}/devices", headers=headers, timeout=API_TIMEOUT)
+        self._etag = response.headers.get('ETag', self._etag)
+
+    def warm(self):
+        """
+        Open connections before the first command: to main.py, or to the servo lights if it is down.
+
+        Returns:
+            float: Seconds taken
+        """
+        start = time.perf_counter()
+        try:
+            self.ping()
+        except requests.RequestException as e:
+            print(f"Could not reach {self.server_url} ({e}); opening connections to the lights")
+            self.warm_lights([ip for ip, is_kasa in self.lights.items() if not is_kasa])
+        return time.perf_counter() - start
+
+    def warm_lights(self, ips):
+        """Open a connection to each servo light (GET / answers without moving the servo)"""
+        def connect(ip):
+            try:
+                self.device_session(ip).get(device_url(ip, '/'), timeout=DEVICE_TIMEOUT)
+            except requests.RequestException:
+                pass  # The command itself will report it
+        self._for_each(connect, ips)
+
+    def start_keepalive(self):
+        def run():
+            while not self._stop.wait(KEEPALIVE_INTERVAL):
+                try:
+                    self.ping()
+                except requests.RequestException:
+                    pass  # Reconnected on the next command or ping
+        threading.Thread(target=run, name='voice-keepalive', daemon=True).start()
+
+    def send(self, targets, action):
+        """
+        Run a recognized command.
+
+        Args:
+            targets: Targets from IntentMatcher
+            action: 'ON' or 'OFF'
+
+        Returns:
+            dict: main.py's answer, or {ip: message} for lights commanded directly
+        """
+        if ALL_LIGHTS in targets:
+            path, payload = f"/{action.lower()}_all", {}
+            ips = list(self.lights)
+        else:
+            ips = list(dict.fromkeys(ip for _, target_ips in targets for ip in target_ips))
+            path, payload = '/batch', {'entries': [{'device': ip, 'action': action} for ip in ips]}
+        try:
+            # async: main.py answers as soon as the job starts, so the next utterance is not held up
+            response = self.session.post(f"{self.server_url}{path}", params={'async': 1, 'source': 'voice'},
+                                         json=payload, timeout=API_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except requests.ConnectionError as e:
+            print(f"Could not reach {self.server_url} ({e}); commanding the lights directly")
+        return self.send_to_lights(ips, action)
+
+    def send_to_lights(self, ips, action):
+        """POST /servo to servo lights concurrently; Kasa plugs need main.py and are skipped"""
+        results = {}
+
+        def move(ip):
+            if self.lights.get(ip):
+                results[ip] = "Kasa plugs can only be switched through main.py"
+                return
+            try:
+                response = self.device_session(ip).post(device_url(ip, '/servo'),
+                                                        data={'position': SERVO_POSITIONS[action]},
+                                                        timeout=DEVICE_TIMEOUT)
+                results[ip] = response.text.strip()
+            except requests.RequestException as e:
+                results[ip] = f"Error: {e}"
+        self._for_each(move, ips)
+        return results
+
+    def device_session(self, ip):
+        session = self._device_sessions.get(ip)
+        if session is None:
+            session = self._device_sessions.setdefault(ip, self._session(pool_maxsize=1))
+        return session
+
+    @staticmethod
+    def _for_each(function, ips):
+        if len(ips) == 1:
+            function(ips[0])
+        elif ips:
+            with ThreadPoolExecutor(max_workers=min(8, len(ips))) as pool:
+                list(pool.map(function, ips))
+
+    def close(self):
+        self._stop.set()
+        self.session.close()
+        for session in self._device_sessions.values():
+            session.close()
+
+def read_config_lights(path=CONFIG_PATH):
+    """Lights listed in config.txt ("Name - IP" lines), for when main.py cannot be reached"""
+    lights = []
+    try:
+        with open(path) as file:
+            for line in file:
+                if '-' in line:
+                    name, ip = (part.strip() for part in line.rsplit('-', 1))
+                    lights.append({'display_name': name.lstrip('$'), 'ip': ip, 'is_kasa': name.startswith('$')})
     except FileNotFoundError:
-        print(f"The file {filename} does not exist.")
+        print(f"No config file at {path}")
+    return lights
+
+def load_targets(client):
+    """
+    Phrases the matcher recognizes, built from main.py's lights and groups.
+
+    Returns:
+        dict: {phrase: target} for IntentMatcher
+    """
+    try:
+        lights = client.get_json('/devices')
+        light_groups = client.get_json('/groups')
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not load lights from {client.server_url} ({e}); using {CONFIG_PATH}")
+        lights, light_groups = read_config_lights(), []
+    client.lights = {light['ip']: light['is_kasa'] for light in lights}
+
+    targets = {phrase: ALL_LIGHTS for phrase in ALL_LIGHTS_PHRASES}
+    named = [(group['name'], tuple(device['ip'] for device in group['devices'])) for group in light_groups]
+    named += [(light['display_name'], (light['ip'],)) for light in lights]  # A light wins over a group of the same name
+    for name, ips in named:
+        for phrase in (name,) + tuple(f"{name} {suffix}" for suffix in NAME_SUFFIXES):
+            targets[phrase] = (name, ips)
+    return targets
+
+def dispatch(client, targets, action):
+    print(f"Got '{' and '.join(name for name, _ in targets)} {action.lower()}'")
+    try:
+        print(client.send(targets, action))
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error: {e}")
+
+# Act on commands as text arrives from transcribe.py
+def monitor_stream(stream, client):
+    matcher = IntentMatcher(load_targets(client))
+    loaded_at = time.monotonic()
+    print(f"Connections ready in {client.warm() * 1000:.1f} ms")
+    for text in stream:
+        if time.monotonic() - loaded_at > NAMES_REFRESH_INTERVAL and matcher.idle():
+            matcher = IntentMatcher(load_targets(client))  # Pick up renamed lights and new groups
+            loaded_at = time.monotonic()
+        for targets, action in matcher.feed(text):
+            dispatch(client, targets, action)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Turn lights on and off by voice.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH,
+                        help="Unix socket to receive text from a separately running transcribe.py.")
+    parser.add_argument("--transcribe", action="store_true",
+                        help="Run the transcriber in this process and hand text over in memory. "
+                             "Other arguments are passed on to transcribe.py.")
+    parser.add_argument("--server", default=SERVER_URL, help="URL of main.py's web interface.")
+    return parser.parse_known_args(argv)
 
 if __name__ == '__main__':
-    # Start the transcription monitoring in a separate thread
-    transcription_thread = threading.Thread(target=monitor_file, args=('transcription.txt',))
-    transcription_thread.start()
+    args, transcriber_args = parse_args()
+    if args.transcribe:
+        import transcribe
+        stream = QueueTranscriptStream()
+        transcriber = threading.Thread(target=transcribe.run, args=(transcribe.parse_args(transcriber_args), stream),
+                                       daemon=True)
+        transcriber.start()
+    else:
+        stream = TranscriptListener(args.socket)
+        print(f"Listening for transcriptions on {args.socket}")
 
-    # Keep the script running
-    transcription_thread.join()
+    client = VoiceClient(args.server)
+    client.start_keepalive()
+    try:
+        monitor_stream(stream, client)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.close()
+        client.close()
@@ -0,0 +1,269 @@
+"""
+Speech recognition backends for transcribe.py.
+
+A backend turns one recorded chunk of audio into text. OrderedRecognizer runs
+a backend's chunks concurrently on its executor and hands the results back
+in the order the chunks were recorded, so a short command recognized quickly
+never overtakes the sentence recorded before it.
+
+  google   SpeechRecognition's Google Web Speech API, in threads (needs the internet)
+  whisper  OpenAI Whisper on the local CPU, in worker processes that load the model once
+  fake     deterministic text after a fixed delay, for tests without a model or network
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+WHISPER_SAMPLE_RATE = 16000  # Whisper models take 16 kHz mono float32 audio
+WHISPER_MODEL = 'base.en'    # Loaded by every worker; tiny.en is faster, small.en more accurate
+WHISPER_WARM_TIMEOUT = 300   # Seconds warm() waits for the slowest worker to load its model
+RECOGNIZERS = ('google', 'whisper', 'fake')
+
+
+class AudioChunk:
+    """Raw mono PCM audio of one recording, in a form that pickles cheaply to worker processes"""
+
+    def __init__(self, pcm, sample_rate, sample_width=2):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+
+    @classmethod
+    def from_audio_data(cls, audio):
+        """Wrap a speech_recognition.AudioData"""
+        return cls(audio.get_raw_data(), audio.sample_rate, audio.sample_width)
+
+    @property
+    def duration(self):
+        return len(self.pcm) / (self.sample_rate * self.sample_width)
+
+    def samples(self):
+        """PCM samples as float32 in [-1, 1)"""
+        dtype = {1: np.int8, 2: '<i2', 4: '<i4'}[self.sample_width]
+        return np.frombuffer(self.pcm, dtype=dtype).astype(np.float32) / float(2 ** (8 * self.sample_width - 1))
+
+    def resampled(self, rate):
+        """float32 samples at another sample rate (linear interpolation)"""
+        samples = self.samples()
+        if rate == self.sample_rate or not len(samples):
+            return samples
+        count = int(len(samples) * rate / self.sample_rate)
+        positions = np.arange(count, dtype=np.float64) * (self.sample_rate / rate)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class Recognition:
+    """Result of one chunk: text, or the error the backend raised"""
+
+    def __init__(self, sequence, text, error=None, context=None, latency=0.0):
+        self.sequence = sequence
+        self.text = text
+        self.error = error
+        self.context = context  # Whatever the caller passed to submit()
+        self.latency = latency  # Seconds from submit() to the result being ready
+
+
+class OrderedRecognizer:
+    """
+    Recognizes chunks concurrently and puts the results on a queue in recording order.
+
+    Args:
+        backend: GoogleBackend, WhisperBackend or FakeBackend
+        workers: Chunks recognized at the same time (default: 2)
+        output: Queue the Recognition results are put on; lets a caller wait for
+            new audio and new results on one queue (default: a new queue)
+    """
+
+    def __init__(self, backend, workers=2, output=None):
+        self.backend = backend
+        self.workers = workers
+        self.output = output if output is not None else queue.Queue()
+        self._executor = backend.executor(workers)
+        self._lock = threading.Lock()
+        self._next_sequence = 0
+        self._next_result = 0
+        self._finished = {}  # sequence -> Recognition that finished ahead of an earlier chunk
+
+    def warm(self):
+        """
+        Start every worker and load its model before the first chunk arrives.
+
+        Returns:
+            float: Seconds taken
+        """
+        start = time.perf_counter()
+        warm_task = getattr(self.backend, 'warm_task', None)
+        if warm_task:
+            futures = [self._executor.submit(*warm_task()) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - start
+
+    def submit(self, chunk, context=None):
+        """Queue a chunk for recognition; returns its sequence number"""
+        with self._lock:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+        submitted = time.perf_counter()
+        future = self._executor.submit(*self.backend.task(chunk, sequence))
+        future.add_done_callback(lambda done: self._finish(sequence, context, submitted, done))
+        return sequence
+
+    def _finish(self, sequence, context, submitted, future):
+        try:
+            result = Recognition(sequence, future.result(), context=context)
+        except Exception as e:
+            result = Recognition(sequence, '', error=e, context=context)
+        result.latency = time.perf_counter() - submitted
+        with self._lock:
+            self._finished[sequence] = result
+            while self._next_result in self._finished:
+                self.output.put(self._finished.pop(self._next_result))
+                self._next_result += 1
+
+    @property
+    def pending(self):
+        """Chunks submitted whose results have not been put on the output queue yet"""
+        with self._lock:
+            return self._next_sequence - self._next_result
+
+    def get(self, timeout=None):
+        """Next result in recording order; raises queue.Empty after timeout seconds"""
+        return self.output.get(timeout=timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GoogleBackend:
+    """Google Web Speech API through SpeechRecognition; threads, as each chunk is a network round trip"""
+
+    def executor(self, workers):
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recognize')
+
+    def task(self, chunk, sequence):
+        return _recognize_google, chunk
+
+
+def _recognize_google(chunk):
+    import speech_recognition as sr
+    audio = sr.AudioData(chunk.pcm, chunk.sample_rate, chunk.sample_width)
+    try:
+        return sr.Recognizer().recognize_google(audio).strip()
+    except sr.UnknownValueError:
+        return ''  # No speech recognized; sr.RequestError (no network) is passed on
+
+
+class WhisperBackend:
+    """
+    Whisper on the local CPU in a pool of worker processes.
+
+    Each worker loads the model once, when it starts, and then recognizes
+    chunk after chunk; OrderedRecognizer.warm() starts them all up front.
+    Its warm-up tasks meet at a barrier shared by the workers, so each one
+    holds a different worker until every worker has loaded the model.
+    The CPU cores are split between the workers, so two chunks can be
+    recognized at once without each oversubscribing the whole CPU.
+
+    Args:
+        model: Whisper model name (default: WHISPER_MODEL)
+        language: Spoken language, skipping detection (default: 'en')
+    """
+
+    def __init__(self, model=WHISPER_MODEL, language='en'):
+        self.model = model
+        self.language = language
+
+    def executor(self, workers):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # Worker processes are spawned, not forked, so they do not inherit the audio threads
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_whisper_init,
+                                   initargs=(self.model, threads, context.Barrier(workers)))
+
+    def warm_task(self):
+        return (_whisper_ready,)
+
+    def task(self, chunk, sequence):
+        # Convert here so workers receive compact 16 kHz float32 audio
+        return _recognize_whisper, chunk.resampled(WHISPER_SAMPLE_RATE), self.language
+
+
+_whisper_model = None  # Loaded once per worker process by _whisper_init
+_warm_barrier = None   # Shared by all workers of one pool, one party per worker
+
+
+def _whisper_init(model, threads, barrier):
+    global _whisper_model, _warm_barrier
+    import torch
+    import whisper
+    _warm_barrier = barrier
+    torch.set_num_threads(threads)
+    _whisper_model = whisper.load_model(model, device='cpu')
+
+
+def _whisper_ready():
+    # A worker runs one task at a time, so the barrier only opens once a warm-up
+    # task runs on every worker, each of which has finished _whisper_init
+    _warm_barrier.wait(WHISPER_WARM_TIMEOUT)
+    return os.getpid()
+
+
+def _recognize_whisper(samples, language):
+    if not len(samples):
+        return ''
+    result = _whisper_model.transcribe(samples, language=language, fp16=False,
+                                       condition_on_previous_text=False)
+    return result['text'].strip()
+
+
+class FakeBackend:
+    """
+    Deterministic stand-in for tests: chunk n is recognized as texts[n % len(texts)]
+    after delays[n % len(delays)] seconds. Uneven delays make later chunks finish
+    first, which exercises the reordering.
+    """
+
+    def __init__(self, texts=('light on', 'light off'), delays=(0.0,)):
+        self.texts = tuple(texts)
+        self.delays = tuple(delays)
+
+    def executor(self, workers):
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recognize')
+
+    def task(self, chunk, sequence):
+        return _recognize_fake, self.texts[sequence % len(self.texts)], self.delays[sequence % len(self.delays)]
+
+
+def _recognize_fake(text, delay):
+    if delay:
+        time.sleep(delay)
+    return text
+
+
+def create_recognizer(name, workers=2, output=None, model=WHISPER_MODEL, language='en', fake_texts=None):
+    """
+    OrderedRecognizer for a backend named in RECOGNIZERS.
+
+    Args:
+        name: 'google', 'whisper' or 'fake'
+        workers: Chunks recognized at the same time
+        output: Queue to put results on (default: a new queue)
+        model: Whisper model name
+        language: Whisper language
+        fake_texts: Texts the fake backend returns in turn
+    """
+    if name == 'google':
+        backend = GoogleBackend()
+    elif name == 'whisper':
+        backend = WhisperBackend(model, language)
+    elif name == 'fake':
+        backend = FakeBackend(fake_texts) if fake_texts else FakeBackend()
+    else:
+        raise ValueError(f"Unknown recognizer '{name}'. Use one of: {', '.join(RECOGNIZERS)}")
+    return OrderedRecognizer(backend, workers, output)
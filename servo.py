@@ -0,0 +1,14 @@
+"""
+Addressing of the ESP32 servo lights, shared by main.py and main_voice.py
+so both build the same URLs for a light.
+"""
+import os
+
+SERVO_PORT = int(os.environ.get('LIGHT_CONTROL_SERVO_PORT', 80))  # HTTP port of the ESP32 firmware
+
+
+def device_url(ip, path):
+    """URL of an endpoint on a servo light (ip may already carry a port)"""
+    if SERVO_PORT == 80 or ':' in ip:
+        return f"http://{ip}{path}"
+    return f"http://{ip}:{SERVO_PORT}{path}"
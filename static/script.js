@@ -24,6 +24,83 @@ document.addEventListener('DOMContentLoaded', function() {
       return response.json();
   }
 
+  // Server-sent events stream (see subscribeToEvents) and the jobs waiting for its 'job' events, by id
+  let eventSource = null;
+  const jobWaiters = {};
+
+  function eventsConnected() {
+      return eventSource !== null && eventSource.readyState === EventSource.OPEN;
+  }
+
+  // Follow a background job until it finishes, resolving with its final success/error.
+  // Its 'job' event settles it; /jobs/<id> is checked once, then polled only while the stream is down
+  function waitForJob(jobId, url) {
+      return new Promise((resolve, reject) => {
+          let polling = false;
+          function finish(job) {
+              delete jobWaiters[jobId];
+              resolve({ success: job.success, error: job.error });
+          }
+          function poll() {
+              polling = true;
+              // Only an answer read after the stream was open can hand over to the events
+              const connected = eventsConnected();
+              fetch(url)
+              .then(handleResponse)
+              .then(job => {
+                  if (!(jobId in jobWaiters)) {
+                      return;
+                  }
+                  if (job.status === 'done' || job.status === 'failed') {
+                      finish(job);
+                  } else if (connected) {
+                      polling = false;
+                  } else {
+                      setTimeout(poll, 250);
+                  }
+              })
+              .catch(error => {
+                  if (jobId in jobWaiters) {
+                      delete jobWaiters[jobId];
+                      reject(error);
+                  }
+              });
+          }
+          jobWaiters[jobId] = {
+              finish,
+              fallBack: () => { if (!polling) poll(); }
+          };
+          poll();
+      });
+  }
+
+  // Whether the bulk buttons skip lights recently confirmed in the target state
+  function skipUnchangedQuery() {
+      return document.getElementById('skip-unchanged').checked ? '&skip_unchanged=1' : '';
+  }
+
+  // Send a light command in async mode so the request returns immediately, then follow the job
+  function runCommand(endpoint, query = '') {
+      return fetch(`${endpoint}?async=1${query}`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({})
+      })
+      .then(handleResponse)
+      .then(data => data.job_id ? waitForJob(data.job_id, data.url) : data);
+  }
+
+  // Send several light commands as one /batch request, following it as a job like runCommand
+  function runBatch(entries) {
+      return fetch(`/batch?async=1${skipUnchangedQuery()}`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ entries })
+      })
+      .then(handleResponse)
+      .then(data => data.job_id ? waitForJob(data.job_id, data.url) : data);
+  }
+
   // Event listeners for individual light buttons
   const buttons = document.querySelectorAll('.btn');
   buttons.forEach(button => {
@@ -41,12 +118,7 @@ document.addEventListener('DOMContentLoaded', function() {
               command = 'OFF';
           }
 
-          fetch(endpoint, {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({})
-          })
-          .then(handleResponse)
+          runCommand(endpoint)
           .then(data => {
               if (data.success) {
                   showFeedback(`Successfully turned ${command} ${ip}.`);
@@ -66,12 +138,7 @@ document.addEventListener('DOMContentLoaded', function() {
   const allOffButton = document.getElementById('all-off');
 
   allOnButton.addEventListener('click', function() {
-      fetch('/on_all', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({})
-      })
-      .then(handleResponse)
+      runCommand('/on_all', skipUnchangedQuery())
       .then(data => {
           if (data.success) {
               showFeedback('Successfully turned ALL lights ON.');
@@ -86,12 +153,7 @@ document.addEventListener('DOMContentLoaded', function() {
   });
 
   allOffButton.addEventListener('click', function() {
-      fetch('/off_all', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({})
-      })
-      .then(handleResponse)
+      runCommand('/off_all', skipUnchangedQuery())
       .then(data => {
           if (data.success) {
               showFeedback('Successfully turned ALL lights OFF.');
@@ -105,41 +167,225 @@ document.addEventListener('DOMContentLoaded', function() {
       });
   });
   
-  // Load schedules on page load
-  loadSchedules();
+  // Mark the ON or OFF button of a light according to its last known state
+  function showLightState(ip, state) {
+      const control = document.querySelector(`.light-control[data-ip="${ip}"]`);
+      if (!control) {
+          return;
+      }
+      control.querySelectorAll('.btn').forEach(button => {
+          button.classList.toggle('active', button.getAttribute('data-action') === state);
+      });
+  }
+
+  // Grey out a light whose circuit breaker is open (the server is failing its commands fast)
+  function showBreakerState(ip, state) {
+      const control = document.querySelector(`.light-control[data-ip="${ip}"]`);
+      if (control) {
+          control.classList.toggle('unavailable', state !== 'closed');
+      }
+  }
+
+  // Grey out a light that stopped answering the server's health probes
+  function showHealth(ip, online) {
+      const control = document.querySelector(`.light-control[data-ip="${ip}"]`);
+      if (control) {
+          control.classList.toggle('offline', online === false);
+      }
+  }
+
+  // Show the last known state of every light
+  function renderLightStates(states) {
+      Object.values(states).forEach(light => {
+          showLightState(light.ip, light.state);
+          showBreakerState(light.ip, light.breaker);
+          showHealth(light.ip, light.online);
+      });
+  }
+
+  // Listen for state changes, job progress and schedule firings pushed by the server
+  function subscribeToEvents() {
+      if (!window.EventSource) {
+          return;
+      }
+      // The server's configured public URL (behind a reverse proxy), else the events port on this host
+      const port = document.body.getAttribute('data-events-port');
+      const url = document.body.getAttribute('data-events-url')
+          || `${window.location.protocol}//${window.location.hostname}:${port}/events`;
+      const source = eventSource = new EventSource(url);
+      source.addEventListener('job', event => {
+          const data = JSON.parse(event.data);
+          const waiter = jobWaiters[data.id];
+          if (waiter && (data.status === 'done' || data.status === 'failed')) {
+              waiter.finish(data);
+          }
+      });
+      // The stream dropped (it reconnects on its own): follow pending jobs by polling meanwhile
+      source.addEventListener('error', () => {
+          Object.values(jobWaiters).forEach(waiter => waiter.fallBack());
+      });
+      source.addEventListener('state', event => {
+          const data = JSON.parse(event.data);
+          showLightState(data.ip, data.state);
+      });
+      source.addEventListener('breaker', event => {
+          const data = JSON.parse(event.data);
+          showBreakerState(data.ip, data.state);
+      });
+      source.addEventListener('health', event => {
+          const data = JSON.parse(event.data);
+          showHealth(data.ip, data.online);
+      });
+      source.addEventListener('schedule', event => {
+          const data = JSON.parse(event.data);
+          if (data.status === 'fired') {
+              showFeedback(`Schedule running: ${data.description}`);
+          } else if (!data.success) {
+              showFeedback(`Schedule failed (${data.description}): ${data.failed.join(', ')}`, true);
+          }
+      });
+  }
+
+  // Add a button for every group (ON/OFF) and scene, and offer them as schedule targets
+  function renderLightSets(groups, scenes) {
+      const list = document.getElementById('light-set-list');
+      const targetSelect = document.getElementById('schedule-target');
+      list.innerHTML = '';
+      const sets = groups.map(group => ({ ...group, kind: 'group' }))
+          .concat(scenes.map(scene => ({ ...scene, kind: 'scene' })));
+      sets.forEach(set => {
+          const item = document.createElement('div');
+          item.className = 'light-set';
+          const title = document.createElement('h3');
+          title.textContent = set.kind === 'scene' ? `Scene: ${set.name}` : set.name;
+          item.appendChild(title);
+          // Each button sends the set's lights as one /batch request
+          const entries = action => set.devices.map(device => ({ device: device.ip, action: action || device.action }));
+          const actions = set.kind === 'scene'
+              ? [['Activate', 'btn-scene', entries()]]
+              : [['ON', 'btn-on', entries('ON')], ['OFF', 'btn-off', entries('OFF')]];
+          actions.forEach(([label, className, batch]) => {
+              const button = document.createElement('button');
+              button.className = `btn ${className}`;
+              button.textContent = label;
+              button.addEventListener('click', () => {
+                  runBatch(batch)
+                  .then(data => {
+                      if (data.success) {
+                          showFeedback(`${set.name}: ${label} done.`);
+                      } else {
+                          showFeedback(data.error, true);
+                      }
+                  })
+                  .catch(error => console.error(`Error running ${set.name} ${label}:`, error));
+              });
+              item.appendChild(button);
+          });
+          list.appendChild(item);
+
+          const target = `${set.kind}:${set.id}`;
+          scheduleTargets[target] = set.kind === 'scene' ? `scene ${set.name}` : set.name;
+          const option = document.createElement('option');
+          option.value = target;
+          option.textContent = set.kind === 'scene' ? `Scene: ${set.name}` : `Group: ${set.name}`;
+          targetSelect.appendChild(option);
+      });
+      document.getElementById('light-sets').style.display = sets.length ? 'block' : 'none';
+  }
+
+  // Hydrate groups, scenes, schedules and light states from one request on page load
+  function bootstrap() {
+      fetch('/bootstrap')
+      .then(handleResponse)
+      .then(data => {
+          // Group and scene names first, so schedules can show their targets
+          renderLightSets(data.groups, data.scenes);
+          renderSchedules(data.schedules);
+          renderLightStates(data.state);
+      })
+      .catch(error => {
+          console.error('Error loading page data:', error);
+          showFeedback('Error loading page data', true);
+      });
+  }
+
+  bootstrap();
+  subscribeToEvents();
 });
 
 // Schedule management functions
+
+// Display names of schedule targets other than 'all', filled in by renderLightSets
+const scheduleTargets = {};
+
+// Append a text node, or a <strong> with the text, to parent
+function appendText(parent, text, strong) {
+    if (strong) {
+        const element = document.createElement('strong');
+        element.textContent = text;
+        parent.appendChild(element);
+    } else {
+        parent.appendChild(document.createTextNode(text));
+    }
+}
+
+// Describe a schedule inside container; names are user input, so only ever set as text
+function describeSchedule(schedule, container) {
+    if (schedule.target && schedule.target.startsWith('scene:')) {
+        appendText(container, 'Set ');
+        appendText(container, scheduleTargets[schedule.target] || schedule.target, true);
+        return;
+    }
+    const lights = schedule.target && schedule.target !== 'all'
+        ? (scheduleTargets[schedule.target] || schedule.target)
+        : 'all lights';
+    appendText(container, `Turn ${lights} `);
+    appendText(container, schedule.action, true);
+}
+
+function renderSchedules(schedules) {
+    const scheduleList = document.getElementById('schedule-list');
+    scheduleList.innerHTML = '';
+
+    if (schedules.length === 0) {
+        scheduleList.innerHTML = '<p style="text-align: center; color: #666;">No schedules configured</p>';
+        return;
+    }
+
+    schedules.forEach(schedule => {
+        const scheduleItem = document.createElement('div');
+        scheduleItem.className = 'schedule-item';
+
+        const info = document.createElement('div');
+        info.className = 'schedule-info';
+        appendText(info, schedule.time, true);
+        appendText(info, ' - ');
+        describeSchedule(schedule, info);
+        appendText(info, ` (${schedule.days}${schedule.skip_unchanged ? ', skips lights already set' : ''})`);
+
+        const actions = document.createElement('div');
+        actions.className = 'schedule-actions';
+        const toggle = document.createElement('button');
+        toggle.className = `btn-toggle ${schedule.enabled ? 'enabled' : 'disabled'}`;
+        toggle.textContent = schedule.enabled ? 'Enabled' : 'Disabled';
+        toggle.addEventListener('click', () => toggleSchedule(schedule.id));
+        const remove = document.createElement('button');
+        remove.className = 'btn-delete';
+        remove.textContent = 'Delete';
+        remove.addEventListener('click', () => deleteSchedule(schedule.id));
+        actions.appendChild(toggle);
+        actions.appendChild(remove);
+
+        scheduleItem.appendChild(info);
+        scheduleItem.appendChild(actions);
+        scheduleList.appendChild(scheduleItem);
+    });
+}
+
 function loadSchedules() {
     fetch('/schedules')
         .then(response => response.json())
-        .then(schedules => {
-            const scheduleList = document.getElementById('schedule-list');
-            scheduleList.innerHTML = '';
-            
-            if (schedules.length === 0) {
-                scheduleList.innerHTML = '<p style="text-align: center; color: #666;">No schedules configured</p>';
-                return;
-            }
-            
-            schedules.forEach(schedule => {
-                const scheduleItem = document.createElement('div');
-                scheduleItem.className = 'schedule-item';
-                scheduleItem.innerHTML = `
-                    <div class="schedule-info">
-                        <strong>${schedule.time}</strong> - Turn all lights <strong>${schedule.action}</strong>
-                    </div>
-                    <div class="schedule-actions">
-                        <button class="btn-toggle ${schedule.enabled ? 'enabled' : 'disabled'}" 
-                                onclick="toggleSchedule(${schedule.id})">
-                            ${schedule.enabled ? 'Enabled' : 'Disabled'}
-                        </button>
-                        <button class="btn-delete" onclick="deleteSchedule(${schedule.id})">Delete</button>
-                    </div>
-                `;
-                scheduleList.appendChild(scheduleItem);
-            });
-        })
+        .then(renderSchedules)
         .catch(error => {
             console.error('Error loading schedules:', error);
             showFeedback('Error loading schedules', true);
@@ -149,6 +395,9 @@ function loadSchedules() {
 function addSchedule() {
     const time = document.getElementById('schedule-time').value;
     const action = document.getElementById('schedule-action').value;
+    const days = document.getElementById('schedule-days').value;
+    const target = document.getElementById('schedule-target').value;
+    const skip_unchanged = document.getElementById('schedule-skip-unchanged').checked;
     
     if (!time) {
         showFeedback('Please select a time', true);
@@ -158,7 +407,7 @@ function addSchedule() {
     fetch('/schedules', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ time, action })
+        body: JSON.stringify({ time, action, days, target, skip_unchanged })
     })
     .then(response => response.json())
     .then(data => {
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# main.py keeps its database, config and logs here; never touch a real installation's
+os.environ.setdefault('LIGHT_CONTROL_DIR', tempfile.mkdtemp(prefix='light-control-test-'))
@@ -0,0 +1,76 @@
+"""AudioGate on synthetic audio: silence, hum and hiss are dropped, speech-like sound is kept and trimmed"""
+import numpy as np
+import pytest
+
+from audio_gate import AudioGate
+from recognizers import AudioChunk
+
+RATE = 16000
+
+
+def chunk(*parts):
+    """AudioChunk of float parts in [-1, 1) joined together, as 16-bit PCM"""
+    samples = np.concatenate(parts)
+    return AudioChunk((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes(), RATE)
+
+
+def quiet(seconds, seed=0):
+    """Room noise around -70 dBFS"""
+    return np.random.default_rng(seed).normal(0, 3e-4, int(seconds * RATE))
+
+
+def tone(seconds, hz, amplitude=0.3):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return amplitude * np.sin(2 * np.pi * hz * t)
+
+
+def voice(seconds):
+    """Speech-like: a 150 Hz voice with harmonics up to 1.5 kHz, its loudness varying like syllables"""
+    t = np.arange(int(seconds * RATE)) / RATE
+    harmonics = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 11))
+    return 0.2 * harmonics * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+
+
+def hiss(seconds, seed=1):
+    return np.random.default_rng(seed).normal(0, 0.2, int(seconds * RATE))
+
+
+def test_silence_is_dropped():
+    gate = AudioGate()
+    assert gate.process(chunk(quiet(2))) == (None, 'silence')
+    assert gate.process(AudioChunk(b'', RATE)) == (None, 'silence')
+    assert gate.stats.dropped['silence'][0] == 2
+    assert gate.stats.passed == 0
+
+
+@pytest.mark.parametrize('sound', [tone(1.0, 50), tone(1.0, 60), hiss(1.0)], ids=['hum 50 Hz', 'hum 60 Hz', 'hiss'])
+def test_hum_and_hiss_are_noise(sound):
+    gate = AudioGate()
+    assert gate.process(chunk(quiet(0.5), sound, quiet(0.5))) == (None, 'noise')
+    assert gate.stats.dropped == {'noise': [1, 2.0]}
+    assert 'noise' in gate.stats.summary()
+
+
+def test_speech_is_kept_and_trimmed():
+    gate = AudioGate()
+    trimmed, reason = gate.process(chunk(quiet(1.0), voice(0.8), quiet(1.5)))
+    assert reason is None
+    # The speech plus up to GATE_PAD on each side; most of the 2.5 s of silence is gone
+    assert 0.8 <= trimmed.duration <= 1.25
+    assert gate.stats.passed == 1
+    assert gate.stats.seconds_trimmed == pytest.approx(3.3 - trimmed.duration)
+
+
+def test_short_sound_is_not_enough():
+    gate = AudioGate()
+    assert gate.process(chunk(quiet(1.0), voice(0.1), quiet(1.0))) == (None, 'silence')
+
+
+def test_stats_separate_reasons():
+    gate = AudioGate()
+    gate.process(chunk(quiet(1.0)))
+    gate.process(chunk(quiet(0.5), tone(1.0, 60), quiet(0.5)))
+    gate.process(chunk(quiet(0.5), voice(1.0), quiet(0.5)))
+    stats = gate.stats.to_dict()
+    assert stats['chunks'] == 3 and stats['passed'] == 1
+    assert set(stats['dropped']) == {'silence', 'noise'}
@@ -0,0 +1,74 @@
+"""Circuit breakers: opening, probing with a capped backoff, closing; and the retry backoff"""
+import time
+
+import pytest
+
+import main
+
+IP = '10.8.8.8'
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_opens_after_threshold_and_closes_on_success():
+    breakers = main.CircuitBreakers(threshold=3, probe_interval=60)
+    assert breakers.allow(IP)
+    assert breakers.record_failure(IP, False, OSError("timed out")) is False
+    assert breakers.record_failure(IP, False, OSError("timed out")) is False
+    assert breakers.state(IP) == breakers.CLOSED
+    assert breakers.record_failure(IP, False, OSError("timed out")) is True
+    assert breakers.state(IP) == breakers.OPEN
+    assert not breakers.allow(IP)
+    assert breakers.open_count() == 1
+    assert breakers.record_failure(IP, False, OSError("refused")) is True  # Already open
+
+    snapshot = breakers.snapshot()[IP]
+    assert snapshot['failures'] == 4 and snapshot['last_error'] == 'refused'
+    assert 30 <= snapshot['next_probe_in'] <= 60  # First probe within [interval / 2, interval]
+
+    breakers.record_success(IP)
+    assert breakers.allow(IP)
+    assert breakers.open_count() == 0
+    assert breakers.snapshot() == {}
+
+
+def test_success_resets_the_failure_count():
+    breakers = main.CircuitBreakers(threshold=2, probe_interval=60)
+    breakers.record_failure(IP, False, OSError())
+    breakers.record_success(IP)
+    assert breakers.record_failure(IP, False, OSError()) is False  # Counting starts over
+    assert breakers.allow(IP)
+
+
+def test_probes_back_off_to_the_cap_then_close(monkeypatch):
+    breakers = main.CircuitBreakers(threshold=1, probe_interval=0.02, max_probe_interval=0.05)
+    probes = []  # (state, interval) seen by each probe
+
+    def probe_device(ip, is_kasa):
+        entry = breakers._devices[ip]
+        probes.append((entry['state'], entry['interval']))
+        if len(probes) < 4:
+            raise OSError("still down")
+
+    monkeypatch.setattr(main, 'probe_device', probe_device)
+    breakers.record_failure(IP, True, OSError("down"))
+    wait_for(lambda: breakers.state(IP) == breakers.CLOSED)
+
+    assert [state for state, _ in probes] == [breakers.HALF_OPEN] * 4
+    assert [interval for _, interval in probes] == [0.02, 0.04, 0.05, 0.05]  # Doubled, then capped
+    assert breakers.allow(IP)
+    assert breakers._devices[IP]['interval'] == 0.02  # Reset for the next outage
+
+
+@pytest.mark.parametrize('retry', range(8))
+def test_backoff_delay_bounds(retry):
+    base = 0.5
+    cap = min(main.RETRY_MAX_DELAY, base * 2 ** retry)
+    delays = [main.backoff_delay(retry, base) for _ in range(200)]
+    assert all(0 <= delay <= cap for delay in delays)
+    assert max(delays) > cap / 2  # Full jitter spreads over the whole range
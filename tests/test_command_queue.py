@@ -0,0 +1,133 @@
+"""DeviceCommandQueue: one command at a time per light, coalescing the ones that pile up"""
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class FakeLights:
+    """Stands in for _execute_command; each command blocks until released"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []   # (ip, command, thread name)
+        self.release = {}   # (ip, command) -> Event
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def gate(self, ip, command):
+        with self.lock:
+            return self.release.setdefault((ip, command), threading.Event())
+
+    def __call__(self, ip, command, is_kasa, max_retries, retry_delay, source='web'):
+        with self.lock:
+            self.started.append((ip, command, threading.current_thread().name))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            assert self.gate(ip, command).wait(5)
+            if command == 'fail':
+                raise RuntimeError("servo jammed")
+            return True, f"{command} done"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def wait_started(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.started) < count:
+            assert time.monotonic() < deadline, self.started
+            time.sleep(0.005)
+
+
+@pytest.fixture
+def lights(monkeypatch):
+    fake = FakeLights()
+    monkeypatch.setattr(main, '_execute_command', fake)
+    return fake
+
+
+def send_async(queue, ip, command, name):
+    """Send on a named thread; returns (thread, results list)"""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(queue.send(ip, command)), name=name)
+    thread.start()
+    return thread, results
+
+
+def wait_pending(queue, ip):
+    deadline = time.monotonic() + 5
+    while not queue.stats()[ip]['pending']:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_command_runs_on_the_calling_thread(lights):
+    queue = main.DeviceCommandQueue()
+    lights.gate('a', 'on').set()
+    threads_before = threading.active_count()
+    assert queue.send('a', 'on') == (True, 'on done')
+    assert lights.started == [('a', 'on', threading.current_thread().name)]
+    assert threading.active_count() == threads_before
+    assert queue.stats()['a'] == {'submitted': 1, 'executed': 1, 'coalesced': 0, 'pending': 0, 'busy': False}
+
+
+def test_waiting_command_superseded_by_a_different_one(lights):
+    queue = main.DeviceCommandQueue()
+    first, first_result = send_async(queue, 'a', 'on', 'first')
+    lights.wait_started(1)
+    second, second_result = send_async(queue, 'a', 'off', 'second')
+    wait_pending(queue, 'a')
+    third, third_result = send_async(queue, 'a', 'on', 'third')
+    second.join(5)
+    assert second_result == [(False, main.DeviceCommandQueue.SUPERSEDED)]  # Never sent, and says so
+
+    lights.gate('a', 'on').set()
+    first.join(5)
+    third.join(5)
+    assert first_result == [(True, 'on done')]
+    assert third_result == [(True, 'on done')]
+    assert [(command, name) for _, command, name in lights.started] == [('on', 'first'), ('on', 'third')]
+    assert queue.stats()['a']['executed'] == 2
+    assert queue.stats()['a']['coalesced'] == 1
+
+
+def test_identical_waiting_commands_share_one_send(lights):
+    queue = main.DeviceCommandQueue()
+    first, _ = send_async(queue, 'a', 'off', 'first')
+    lights.wait_started(1)
+    waiting = [send_async(queue, 'a', 'on', f'waiting-{n}') for n in range(3)]
+    wait_pending(queue, 'a')
+    while queue.stats()['a']['submitted'] < 4:
+        time.sleep(0.005)
+    lights.gate('a', 'off').set()
+    lights.gate('a', 'on').set()
+    for thread, results in waiting:
+        thread.join(5)
+        assert results == [(True, 'on done')]
+    first.join(5)
+    assert [command for _, command, _ in lights.started] == ['off', 'on']
+    assert queue.stats()['a']['coalesced'] == 2
+
+
+def test_lights_run_concurrently_one_command_each(lights):
+    queue = main.DeviceCommandQueue()
+    senders = [send_async(queue, ip, 'on', ip) for ip in ('a', 'b', 'c')]
+    lights.wait_started(3)
+    assert lights.max_in_flight == 3
+    for ip in ('a', 'b', 'c'):
+        lights.gate(ip, 'on').set()
+    for thread, results in senders:
+        thread.join(5)
+        assert results == [(True, 'on done')]
+
+
+def test_error_is_returned_and_light_freed(lights):
+    queue = main.DeviceCommandQueue()
+    lights.gate('a', 'fail').set()
+    assert queue.send('a', 'fail') == (False, 'servo jammed')
+    lights.gate('a', 'on').set()
+    assert queue.send('a', 'on') == (True, 'on done')
+    assert queue.stats()['a']['busy'] is False
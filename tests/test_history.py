@@ -0,0 +1,48 @@
+"""/history: filters, the entry limit and aggregates"""
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    main.db.execute('DELETE FROM command_history')
+    now = time.time()
+    main.db.executemany('INSERT INTO command_history (ts, device, ip, action, source, attempts, latency_ms, '
+                        'success, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        [(now - n, 'Desk', '10.0.0.1', 'ON', 'web', 1, float(n + 1), int(n % 4 != 0), None)
+                         for n in range(1200)])
+    yield main.app.test_client()
+    main.db.execute('DELETE FROM command_history')
+
+
+@pytest.mark.parametrize('limit, expected', [('5', 5), ('0', 1), ('-1', 1), ('5000', 1000)])
+def test_limit_is_clamped(client, limit, expected):
+    response = client.get(f'/history?limit={limit}')
+    assert response.status_code == 200
+    assert len(response.get_json()['entries']) == expected
+
+
+@pytest.mark.parametrize('query', ['limit=abc', 'limit=1.5', 'since=yesterday', 'since=inf', 'until=nope'])
+def test_invalid_parameters(client, query):
+    assert client.get(f'/history?{query}').status_code == 400
+
+
+def test_summary(client):
+    data = client.get('/history?limit=1').get_json()
+    summary = data['summary']
+    assert summary['count'] == 1200
+    assert summary['success_rate'] == 0.75
+    assert summary['latency_ms'] == {'p50': 600.0, 'p95': 1140.0, 'p99': 1188.0, 'max': 1200.0}
+    assert data['devices']['10.0.0.1'] == summary
+    assert data['entries'][0]['latency_ms'] == 1.0  # Most recent first
+
+
+def test_default_window_and_since(client):
+    main.db.execute('INSERT INTO command_history (ts, device, ip, action, source, attempts, latency_ms, success) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (time.time() - 2 * main.HISTORY_DEFAULT_WINDOW, 'Desk', '10.0.0.1', 'OFF', 'web', 1, 1.0, 1))
+    assert client.get('/history').get_json()['summary']['count'] == 1200
+    assert client.get('/history?since=0').get_json()['summary']['count'] == 1201
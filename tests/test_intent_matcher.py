@@ -0,0 +1,81 @@
+"""IntentMatcher: names, multi-light commands, adjacency and phrase boundaries"""
+import pytest
+
+import main_voice
+from main_voice import ALL_LIGHTS, IntentMatcher
+
+LIGHTS = {'Kitchen': ('10.0.0.1',), 'Porch': ('10.0.0.2',), 'Kitchen Lamp': ('10.0.0.3',),
+          'Downstairs': ('10.0.0.1', '10.0.0.2')}
+
+
+def targets():
+    phrases = {phrase: ALL_LIGHTS for phrase in main_voice.ALL_LIGHTS_PHRASES}
+    for name, ips in LIGHTS.items():
+        for phrase in (name,) + tuple(f"{name} {suffix}" for suffix in main_voice.NAME_SUFFIXES):
+            phrases[phrase] = (name, ips)
+    return phrases
+
+
+def match(*chunks):
+    """Commands found in chunks fed one after the other, as ([names], action)"""
+    matcher = IntentMatcher(targets())
+    found = []
+    for now, text in enumerate(chunks):
+        found += [([name for name, _ in found_targets], action) for found_targets, action in matcher.feed(text, now)]
+    return found
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("kitchen off", [(['Kitchen'], 'OFF')]),
+    ("turn on the kitchen", [(['Kitchen'], 'ON')]),
+    ("kitchen light on", [(['Kitchen'], 'ON')]),
+    ("kitchen lamp on", [(['Kitchen Lamp'], 'ON')]),        # Longest name wins
+    ("turn the lights off", [(['all lights'], 'OFF')]),
+    ("downstairs off", [(['Downstairs'], 'OFF')]),
+    ("Turn ON the Porch!", [(['Porch'], 'ON')]),
+])
+def test_single_commands(text, expected):
+    assert match(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("kitchen and porch off", [(['Kitchen', 'Porch'], 'OFF')]),
+    ("kitchen and the porch off", [(['Kitchen', 'Porch'], 'OFF')]),
+    ("turn on the kitchen lamp and the porch", [(['Kitchen Lamp', 'Porch'], 'ON')]),
+    ("kitchen on porch off", [(['Kitchen'], 'ON'), (['Porch'], 'OFF')]),
+])
+def test_multi_light_commands(text, expected):
+    assert match(text) == expected
+
+
+@pytest.mark.parametrize('text', [
+    "the kitchen is off limits",
+    "the kitchen window was on fire",   # Words between the name and the action
+    "kitchen maybe off",
+    "on the radio",                     # No name follows
+    "turn it on yesterday",
+    "porch",
+])
+def test_non_commands(text):
+    assert match(text) == []
+
+
+def test_only_the_name_next_to_the_action_counts():
+    assert match("porch is fine but kitchen off") == [(['Kitchen'], 'OFF')]
+
+
+def test_command_split_across_chunks():
+    assert match("turn on the", "kitchen") == [(['Kitchen'], 'ON')]
+    assert match("kitchen and", "porch off") == [(['Kitchen', 'Porch'], 'OFF')]
+
+
+def test_phrase_gap_drops_partial_command():
+    matcher = IntentMatcher(targets())
+    assert matcher.feed("the kitchen", 0.0) == []
+    assert not matcher.idle()
+    assert matcher.feed("off", 0.0 + main_voice.INTENT_PHRASE_GAP + 1) == []
+    assert matcher.feed("turn on", 100.0) == []
+    assert matcher.feed("porch", 100.0 + main_voice.INTENT_PHRASE_GAP + 1) == []
+    assert matcher.feed("turn on", 200.0) == []
+    assert [(names[0][0], action) for names, action in matcher.feed("porch", 201.0)] == [('Porch', 'ON')]
+    assert matcher.idle()
@@ -0,0 +1,75 @@
+"""Kasa plugs: the Smart Home XOR protocol, on/off commands and the kasa CLI fallback"""
+import json
+import socket
+import struct
+
+import pytest
+
+import main
+from benchmarks.fake_devices import FakeKasaDevice, _kasa_xor
+
+
+@pytest.fixture
+def plug():
+    device = FakeKasaDevice().start()
+    yield device
+    device.stop()
+
+
+def closed_address():
+    """host:port nothing listens on, so connecting is refused"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        host, port = sock.getsockname()
+    return f"{host}:{port}"
+
+
+def test_encrypt_decrypt_round_trip():
+    payload = json.dumps({'system': {'set_relay_state': {'state': 1}}}).encode('utf-8')
+    request = main.kasa_encrypt(payload)
+    assert struct.unpack('>I', request[:4])[0] == len(payload)
+    assert request[4:] != payload
+    assert main.kasa_decrypt(request[4:]) == payload
+
+
+def test_cipher_matches_plug():
+    payload = b'{"system": {"get_sysinfo": {}}}'
+    assert main.kasa_encrypt(payload)[4:] == _kasa_xor(payload, decrypt=False)
+    assert main.kasa_decrypt(_kasa_xor(payload, decrypt=False)) == payload
+
+
+def test_on_off_native(plug, monkeypatch):
+    monkeypatch.setattr(main, 'KASA_BACKEND', 'native')
+    monkeypatch.setattr(main.subprocess, 'run', lambda *args, **kwargs: pytest.fail("kasa CLI used"))
+
+    success, response = main.send_command(plug.address, main.COMMAND_ON, is_kasa=True, retry_delay=0)
+    assert success, response
+    assert plug.relay_state == 1
+
+    success, response = main.send_command(plug.address, main.COMMAND_OFF, is_kasa=True, retry_delay=0)
+    assert success, response
+    assert plug.relay_state == 0
+    assert plug.commands == 2
+    assert plug.connections == 1  # Both commands went over the kept connection
+
+
+def test_cli_fallback_on_connection_error(monkeypatch):
+    address = closed_address()
+    calls = []
+    monkeypatch.setattr(main, 'KASA_BACKEND', 'native')
+    monkeypatch.setattr(main, 'KASA_CLI_FALLBACK', True)
+    monkeypatch.setattr(main.subprocess, 'run', lambda command, **kwargs: calls.append(command))
+
+    success, response = main.send_command(address, main.COMMAND_ON, is_kasa=True, retry_delay=0)
+    assert success, response
+    assert calls == [['kasa', '--host', address, 'on']]
+
+
+def test_no_fallback_raises(monkeypatch):
+    address = closed_address()
+    monkeypatch.setattr(main, 'KASA_BACKEND', 'native')
+    monkeypatch.setattr(main, 'KASA_CLI_FALLBACK', False)
+    monkeypatch.setattr(main.subprocess, 'run', lambda *args, **kwargs: pytest.fail("kasa CLI used"))
+
+    with pytest.raises(OSError):
+        main.set_kasa_state(address, 'off')
@@ -0,0 +1,60 @@
+"""OrderedRecognizer hands results back in recording order whatever order they finish in"""
+import queue
+
+import pytest
+
+import recognizers
+from recognizers import AudioChunk, FakeBackend, OrderedRecognizer
+
+
+def chunk():
+    return AudioChunk(b'\0\0' * 160, 16000)
+
+
+def test_results_in_recording_order():
+    texts = [f"chunk {n}" for n in range(8)]
+    # Every even chunk is slow, so the odd chunk recorded after it finishes first
+    recognizer = OrderedRecognizer(FakeBackend(texts, delays=(0.15, 0.0)), workers=4)
+    try:
+        sequences = [recognizer.submit(chunk(), context=n) for n in range(len(texts))]
+        results = [recognizer.get(timeout=5) for _ in texts]
+    finally:
+        recognizer.close()
+
+    assert sequences == list(range(len(texts)))
+    assert [result.sequence for result in results] == sequences
+    assert [result.text for result in results] == texts
+    assert [result.context for result in results] == sequences
+    assert recognizer.pending == 0
+
+
+def test_later_chunks_wait_for_slow_one():
+    recognizer = OrderedRecognizer(FakeBackend(('slow', 'fast'), delays=(0.3, 0.0)), workers=2)
+    try:
+        recognizer.submit(chunk())
+        recognizer.submit(chunk())
+        with pytest.raises(queue.Empty):
+            recognizer.get(timeout=0.1)  # 'fast' is done but must not overtake 'slow'
+        assert recognizer.pending == 2
+        assert [recognizer.get(timeout=5).text for _ in range(2)] == ['slow', 'fast']
+    finally:
+        recognizer.close()
+
+
+def test_errors_keep_their_place(monkeypatch):
+    def recognize(text, delay):
+        if text == 'bad':
+            raise RuntimeError("no speech service")
+        return text
+
+    monkeypatch.setattr(recognizers, '_recognize_fake', recognize)
+    recognizer = OrderedRecognizer(FakeBackend(('one', 'bad', 'three')), workers=2)
+    try:
+        for _ in range(3):
+            recognizer.submit(chunk())
+        results = [recognizer.get(timeout=5) for _ in range(3)]
+    finally:
+        recognizer.close()
+
+    assert [result.text for result in results] == ['one', '', 'three']
+    assert isinstance(results[1].error, RuntimeError)
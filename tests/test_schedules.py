@@ -0,0 +1,176 @@
+"""Schedules: day masks, next fire times, the heap engine and the /schedules API"""
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import main
+
+LIGHT_IP = '10.9.9.9'
+MONDAY = datetime(2024, 1, 1, 8, 0)  # A Monday, 08:00
+
+
+@pytest.fixture
+def light(monkeypatch):
+    """One configured light whose commands are recorded instead of sent"""
+    with open(main.CONFIG_PATH, 'w') as file:
+        file.write(f"Desk - {LIGHT_IP}\n")
+    main.registry.reload()
+    sent = []
+
+    def send_command(ip, command, is_kasa=False, max_retries=3, retry_delay=1, source='web'):
+        sent.append((ip, command, source))
+        main.state_shadow.record(ip, main.COMMAND_STATES[command])
+        return True, 'ok'
+
+    monkeypatch.setattr(main, 'send_command', send_command)
+    main.state_shadow.forget(LIGHT_IP)
+    yield sent
+    main.state_shadow.forget(LIGHT_IP)
+
+
+@pytest.mark.parametrize('days, mask', [
+    ('daily', 0b1111111), ('weekdays', 0b0011111), ('weekends', 0b1100000), ('', 0b1111111), (None, 0b1111111),
+    ('mon,wed,fri', 0b0010101), ('Monday, Sunday', 0b1000001), ('SAT', 0b0100000),
+])
+def test_parse_days(days, mask):
+    assert main.parse_days(days) == mask
+
+
+@pytest.mark.parametrize('days', ['someday', 'mon,funday', 'mon,,fri', 'weekly'])
+def test_parse_days_rejects(days):
+    with pytest.raises(ValueError):
+        main.parse_days(days)
+
+
+@pytest.mark.parametrize('time_str, days, expected', [
+    ('09:30', 'daily', datetime(2024, 1, 1, 9, 30)),     # Later today
+    ('07:00', 'daily', datetime(2024, 1, 2, 7, 0)),      # Already past today: tomorrow
+    ('08:00', 'daily', datetime(2024, 1, 2, 8, 0)),      # Exactly now: not again until tomorrow
+    ('07:00', 'weekends', datetime(2024, 1, 6, 7, 0)),   # Next allowed day
+    ('07:00', 'mon', datetime(2024, 1, 8, 7, 0)),        # Only today's day, already past: a week later
+    ('23:59', 'sun', datetime(2024, 1, 7, 23, 59)),      # End of the week
+])
+def test_next_fire_time(time_str, days, expected):
+    assert main.next_fire_time(time_str, main.parse_days(days), MONDAY) == expected
+
+
+def test_next_fire_time_rolls_over_the_week():
+    sunday = datetime(2024, 1, 7, 22, 0)
+    assert main.next_fire_time('06:00', main.parse_days('mon'), sunday) == datetime(2024, 1, 8, 6, 0)
+    assert main.next_fire_time('21:00', main.parse_days('sun'), sunday) == datetime(2024, 1, 14, 21, 0)
+    assert main.next_fire_time('21:00', 0, sunday) is None
+
+
+def test_engine_add_replace_remove():
+    engine = main.ScheduleEngine(lambda *args: None)
+    engine.add(1, '07:00', 'ON', 'weekdays')
+    engine.add(2, '22:00', 'OFF')
+    assert engine.next_run(1) == main.next_fire_time('07:00', main.parse_days('weekdays'), datetime.now())
+    assert engine.queue_size() == 2
+
+    engine.add(1, '08:15', 'ON', 'weekends')  # Replaces schedule 1; its old heap entry goes stale
+    assert engine.next_run(1) == main.next_fire_time('08:15', main.parse_days('weekends'), datetime.now())
+    assert sum(1 for item in engine._heap if engine._is_current(item)) == 2
+
+    engine.remove(2)
+    engine.remove(3)  # Unknown schedules are ignored
+    assert engine.next_run(2) is None
+    assert [item[2] for item in engine._heap if engine._is_current(item)] == [1]
+
+    with pytest.raises(ValueError):
+        engine.add(4, '07:00', 'ON', 'someday')
+    assert engine.next_run(4) is None
+
+
+def test_engine_load_replaces_everything():
+    engine = main.ScheduleEngine(lambda *args: None)
+    engine.add(1, '07:00', 'ON')
+    engine.load([(2, '06:00', 'ON', 'daily', 'all', 0), (3, '21:00', 'OFF', 'someday', 'all', 0),
+                 (4, '23:00', 'OFF', 'sat,sun', 'all', 1)])
+    assert engine.next_run(1) is None
+    assert engine.next_run(3) is None  # Invalid days are skipped, not fatal
+    assert engine.next_run(2) is not None and engine.next_run(4).weekday() in (5, 6)
+    assert engine.queue_size() == 2
+    assert engine._entries[4][5] is True
+
+
+def fire_now(engine, sched_id):
+    """Run the engine with one schedule made due, and wait for its action to finish"""
+    done = threading.Event()
+    action = engine.action
+    engine.action = lambda *args: (action(*args), done.set())
+    with engine._cond:
+        version = engine._entries[sched_id][4]
+        engine._heap = [(time.time() - 1, version, sched_id)]
+    threading.Thread(target=engine.run, daemon=True).start()
+    assert done.wait(5)
+
+
+def test_redundant_scheduled_command_is_skipped(light):
+    main.state_shadow.record(LIGHT_IP, 'on')
+    engine = main.ScheduleEngine(main.execute_scheduled_action)
+    engine.add(1, '07:00', 'ON', 'daily', 'all', skip_unchanged=True)
+    fire_now(engine, 1)
+    assert light == []
+
+
+def test_scheduled_command_sent_without_skip_unchanged(light):
+    main.state_shadow.record(LIGHT_IP, 'on')
+    engine = main.ScheduleEngine(main.execute_scheduled_action)
+    engine.add(1, '07:00', 'ON', 'daily', 'all')
+    fire_now(engine, 1)
+    assert light == [(LIGHT_IP, main.COMMAND_ON, 'schedule')]
+
+
+def test_skip_unchanged_trusts_state_only_for_a_while(light):
+    main.state_shadow.record(LIGHT_IP, 'on')
+    main.state_shadow._states[LIGHT_IP]['updated_at'] -= main.STATE_TRUST_SECONDS + 1
+    engine = main.ScheduleEngine(main.execute_scheduled_action)
+    engine.add(1, '07:00', 'ON', 'daily', 'all', skip_unchanged=True)
+    fire_now(engine, 1)
+    assert light == [(LIGHT_IP, main.COMMAND_ON, 'schedule')]
+
+
+def test_skip_unchanged_stored_with_schedule(light):
+    client = main.app.test_client()
+    response = client.post('/schedules', json={'time': '07:00', 'action': 'OFF', 'skip_unchanged': True})
+    assert response.status_code == 200
+    schedule_id = response.get_json()['id']
+    assert main.schedule_engine._entries[schedule_id][5] is True
+    listed = [s for s in client.get('/schedules').get_json() if s['id'] == schedule_id]
+    assert listed[0]['skip_unchanged'] is True
+
+    response = client.post('/schedules', json={'time': '07:00', 'action': 'OFF', 'skip_unchanged': 'yes'})
+    assert response.status_code == 400
+    client.delete(f'/schedules/{schedule_id}')
+
+
+def test_enabling_legacy_schedule_with_invalid_days():
+    schedule_id = main.db.execute("INSERT INTO schedules (time, action, days, enabled) VALUES ('07:00', 'ON', "
+                                  "'someday', 0)").lastrowid
+    client = main.app.test_client()
+    response = client.put(f'/schedules/{schedule_id}/toggle')
+    assert response.status_code == 400
+    assert main.db.query_one('SELECT enabled FROM schedules WHERE id = ?', (schedule_id,))[0] == 0
+    assert schedule_id not in main.schedule_engine._entries
+    client.delete(f'/schedules/{schedule_id}')
+
+
+def test_create_schedules_batch():
+    client = main.app.test_client()
+    assert client.post('/schedules', json=[]).status_code == 400
+
+    response = client.post('/schedules', json=[{'time': '06:00', 'action': 'ON'}, {'time': '23:00', 'action': 'OFF'}])
+    assert response.status_code == 200
+    ids = response.get_json()['ids']
+    assert len(ids) == 2 and all(schedule_id in main.schedule_engine._entries for schedule_id in ids)
+
+    # One invalid item rejects the whole batch
+    count = main.db.query_one('SELECT COUNT(*) FROM schedules')[0]
+    response = client.post('/schedules', json=[{'time': '06:00', 'action': 'ON'}, {'time': '6pm', 'action': 'ON'}])
+    assert response.status_code == 400
+    assert main.db.query_one('SELECT COUNT(*) FROM schedules')[0] == count
+    for schedule_id in ids:
+        client.delete(f'/schedules/{schedule_id}')
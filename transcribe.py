@@ -5,10 +5,14 @@ import os
 import numpy as np
 import speech_recognition as sr
 from datetime import datetime, timedelta
-from queue import Queue
+from queue import Queue, Empty
 from time import sleep
 from sys import platform
 
+from audio_gate import KWS_THRESHOLD, AudioGate, KeywordSpotter
+from recognizers import RECOGNIZERS, WHISPER_MODEL, AudioChunk, Recognition, create_recognizer
+from transcript_stream import DEFAULT_SOCKET_PATH, TranscriptSender
+
 def list_audio_devices():
     """Lists the available audio input devices and their indices."""
     print("Available audio devices:")
@@ -22,7 +26,7 @@ def get_device_index(target_name):
             return index
     return None
 
-def main():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--energy_threshold", default=500,
                         help="Energy level for mic to detect.", type=int)
@@ -31,12 +35,42 @@ def main():
     parser.add_argument("--phrase_timeout", default=3,
                         help="How much empty space between recordings before we "
                              "consider it a new line in the transcription.", type=float)
-    parser.add_argument("--output_file", default="/home/jason/light-control/transcription.txt", help="File to write transcriptions to.", type=str)
+    parser.add_argument("--output_file", default="/home/jason/light-control/transcription.txt", help="File to keep a log of transcriptions in.", type=str)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH,
+                        help="Unix socket main_voice.py listens on for recognized text.", type=str)
     parser.add_argument("--device_index", default=None, type=int,
                         help="Device index of the microphone to use. Default is None to automatically select HyperX SoloCast.")
+    parser.add_argument("--recognizer", default="google", choices=RECOGNIZERS,
+                        help="Speech recognition backend: google (online), whisper (local CPU) or fake (tests).")
+    parser.add_argument("--workers", default=2, type=int,
+                        help="Chunks recognized at the same time (worker processes for whisper).")
+    parser.add_argument("--model", default=WHISPER_MODEL, help="Whisper model to load in each worker.")
+    parser.add_argument("--fake_text", action="append", default=None,
+                        help="Text the fake recognizer returns, in turn for each chunk. Can be repeated.")
+    parser.add_argument("--no_gate", action="store_true",
+                        help="Recognize every recording instead of only those the voice-activity gate lets through.")
+    parser.add_argument("--keyword_dir", default=None, type=str,
+                        help="Directory of <keyword>.wav recordings of command words. If given, only audio "
+                             "resembling one of them is recognized.")
+    parser.add_argument("--keyword_threshold", default=KWS_THRESHOLD, type=float,
+                        help="Largest keyword distance counted as a match (the gate stats show the closest one).")
+    return parser.parse_args(argv)
 
-    args = parser.parse_args()
-
+def main():
+    args = parse_args()
+    stream = TranscriptSender(args.socket)
+    try:
+        run(args, stream)
+    finally:
+        stream.close()
+
+def run(args, stream):
+    """
+    Transcribe the microphone until interrupted, passing each recognized chunk of text to stream.
+
+    stream is a transcript_stream sender (a TranscriptSender, or a QueueTranscriptStream
+    when main_voice.py runs the transcriber in its own process).
+    """
     # List audio devices on boot
     list_audio_devices()
 
@@ -67,6 +101,18 @@ def main():
 
     transcription = ['']
 
+    # Recognized text is put on the same queue as recorded audio, in recording order
+    recognizer = create_recognizer(args.recognizer, workers=args.workers, output=data_queue, model=args.model,
+                                   fake_texts=args.fake_text)
+    print(f"Starting {args.workers} {args.recognizer} recognizer workers...")
+    print(f"Recognizer ready in {recognizer.warm():.1f} s")
+
+    # Only audio with speech (and a keyword, with --keyword_dir) reaches the recognizer
+    gate = None
+    if not args.no_gate:
+        spotter = KeywordSpotter.from_directory(args.keyword_dir, args.keyword_threshold) if args.keyword_dir else None
+        gate = AudioGate(spotter)
+
     with source:
         recorder.adjust_for_ambient_noise(source)
 
@@ -90,9 +136,20 @@ def main():
     with open(args.output_file, "a") as f:
         while True:
             try:
-                now = datetime.utcnow()
-                # Pull recorded audio from the queue.
-                if not data_queue.empty():
+                # Wait for recorded audio or recognized text; the timeout only keeps Ctrl+C responsive
+                try:
+                    item = data_queue.get(timeout=1)
+                except Empty:
+                    continue
+
+                if not isinstance(item, Recognition):
+                    chunk = AudioChunk.from_audio_data(item)
+                    if gate:
+                        chunk, _ = gate.process(chunk)
+                        if chunk is None:
+                            continue
+
+                    now = datetime.utcnow()
                     phrase_complete = False
                     # If enough time has passed between recordings, consider the phrase complete.
                     # Clear the current working audio buffer to start over with the new data.
@@ -100,45 +157,49 @@ def main():
                         phrase_complete = True
                     # This is the last time we received new audio data from the queue.
                     phrase_time = now
-                    
-                    # Get audio data from queue
-                    audio = data_queue.get()
-                    
-                    # Recognize speech using Google Web Speech API
-                    try:
-                        text = recorder.recognize_google(audio).strip()
-                    except sr.UnknownValueError:
-                        text = ""
-                    except sr.RequestError as e:
-                        print(f"Could not request results; {e}")
-                        continue
-
-                    # If we detected a pause between recordings, add a new item to our transcription.
-                    # Otherwise, edit the existing one.
-                    if phrase_complete:
-                        transcription.append(text)
-                    else:
-                        transcription[-1] = text
-
-                    # Write the updated transcription to the file
-                    f.write(f"{text}\n")
-                    f.flush()  # Ensure it's written to disk immediately
-
-                    # Clear the console to reprint the updated transcription.
-                    os.system('cls' if os.name == 'nt' else 'clear')
-                    for line in transcription:
-                        print(line)
-                    # Flush stdout.
-                    print('', end='', flush=True)
+
+                    # Recognize in the background; the text comes back on data_queue
+                    recognizer.submit(chunk, context=phrase_complete)
+                    continue
+
+                if item.error:
+                    print(f"Could not request results; {item.error}")
+                    continue
+                text = item.text
+                phrase_complete = item.context
+
+                # If we detected a pause between recordings, add a new item to our transcription.
+                # Otherwise, edit the existing one.
+                if phrase_complete:
+                    transcription.append(text)
                 else:
-                    # Infinite loops are bad for processors, must sleep.
-                    sleep(0.25)
+                    transcription[-1] = text
+
+                # Hand the new text to main_voice.py right away
+                if text and not stream.send(text):
+                    print("main_voice.py is not listening; dropped transcription")
+
+                # Keep a log of the transcription
+                f.write(f"{text}\n")
+                f.flush()
+
+                # Clear the console to reprint the updated transcription.
+                os.system('cls' if os.name == 'nt' else 'clear')
+                for line in transcription:
+                    print(line)
+                if gate:
+                    print(f"\n{gate.stats.summary()}")
+                # Flush stdout.
+                print('', end='', flush=True)
             except KeyboardInterrupt:
                 break
 
+    recognizer.close()
     print("\n\nTranscription:")
     for line in transcription:
         print(line)
+    if gate:
+        print(f"\n{gate.stats.summary()}")
 
 if __name__ == "__main__":
     main()
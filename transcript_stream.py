@@ -0,0 +1,98 @@
+"""
+Streaming hand-off of recognized text from transcribe.py to main_voice.py.
+
+Each recognized chunk of text is passed on as soon as it is recognized,
+instead of being appended to transcription.txt for main_voice.py to poll,
+so the consumer wakes up immediately and only ever sees new text. Both
+transports have the same send() / receive() / iteration interface:
+
+  QueueTranscriptStream   transcriber and consumer in one process
+  TranscriptSender        transcribe.py's end when they are separate processes,
+  TranscriptListener      and main_voice.py's end (one Unix datagram per chunk)
+"""
+import os
+import queue
+import socket
+
+# Unix socket main_voice.py listens on and transcribe.py sends to
+DEFAULT_SOCKET_PATH = os.environ.get('LIGHT_CONTROL_VOICE_SOCKET',
+                                     '/home/jason/light-control/transcription.sock')
+MAX_CHUNK_BYTES = 65536  # Longest chunk of text accepted in one datagram
+
+
+class QueueTranscriptStream:
+    """Both ends of the stream for a transcriber running in the consumer's process"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def send(self, text):
+        self._queue.put(text)
+        return True
+
+    def receive(self, timeout=None):
+        """Next chunk of text; raises TimeoutError if none arrives within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No transcript received")
+
+    def __iter__(self):
+        while True:
+            yield self._queue.get()
+
+    def close(self):
+        pass
+
+
+class TranscriptSender:
+    """
+    Sends chunks of text to a TranscriptListener in another process.
+
+    Datagrams need no connection, so there is nothing to reconnect: if the
+    listener is not running, the chunk is dropped and send() returns False.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, text):
+        data = text.encode('utf-8')[:MAX_CHUNK_BYTES]
+        try:
+            self._sock.sendto(data, self.path)
+            return True
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False  # Nobody listening
+
+    def close(self):
+        self._sock.close()
+
+
+class TranscriptListener:
+    """Receives chunks of text sent by a TranscriptSender, one datagram per chunk"""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a listener that did not shut down cleanly
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(path)
+
+    def receive(self, timeout=None):
+        """Next chunk of text; raises TimeoutError if none arrives within timeout seconds"""
+        self._sock.settimeout(timeout)
+        try:
+            data = self._sock.recv(MAX_CHUNK_BYTES)
+        except socket.timeout:
+            raise TimeoutError("No transcript received")
+        return data.decode('utf-8', errors='replace')
+
+    def __iter__(self):
+        while True:
+            yield self.receive()
+
+    def close(self):
+        self._sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)